@@ -0,0 +1,93 @@
+"""Deferred systemd actions."""
+from futurelog import FutureLogger
+
+from app.connection import DeviceConnection
+
+FUTURE_LOGGER = FutureLogger(__name__)
+
+
+class SystemdActions:
+    """Collect the systemd side effects requested by the deployers of one device.
+
+    Deployers register what they need (daemon-reload, enable, restart) instead of
+    running it: the actions are applied once all deployers finished, with a single
+    SSH command and as few systemctl invocations as possible. It avoids restarting
+    salt-minion several times during one deployment.
+    """
+
+    def __init__(self, ssh: DeviceConnection, hostname: str) -> None:
+        """Initialize an empty set of actions."""
+        self.ssh = ssh
+        self.hostname = hostname
+        self.clear()
+
+    def clear(self) -> None:
+        """Forget all requested actions."""
+        self._daemon_reload = False
+        # unit -> start it as well
+        self._enable: dict[str, bool] = {}
+        self._restart: dict[str, None] = {}
+        self._try_restart: dict[str, None] = {}
+
+    def daemon_reload(self) -> None:
+        """Request to reload systemd configuration."""
+        self._daemon_reload = True
+
+    def enable(self, *units: str, now: bool = False) -> None:
+        """Request to enable units, and to start them if 'now' is set."""
+        for unit in units:
+            self._enable[unit] = self._enable.get(unit, False) or now
+
+    def restart(self, *units: str) -> None:
+        """Request to restart units."""
+        self._restart.update(dict.fromkeys(units))
+
+    def try_restart(self, *units: str) -> None:
+        """Request to restart units, only if they are running."""
+        self._try_restart.update(dict.fromkeys(units))
+
+    def is_restart_requested(self, unit: str) -> bool:
+        """Return if the unit will be restarted."""
+        return unit in self._restart
+
+    def commands(self) -> list[str]:
+        """Return the systemctl commands to run, in order."""
+        enable_now = [
+            unit for unit, now in self._enable.items() if now and unit not in self._restart
+        ]
+        enable = [unit for unit in self._enable if unit not in enable_now]
+        try_restart = [unit for unit in self._try_restart if unit not in self._restart]
+
+        commands = []
+        if self._daemon_reload:
+            commands.append("sudo systemctl daemon-reload")
+        # restart running units before starting the others, so a unit is not restarted twice
+        if try_restart:
+            commands.append(f"sudo systemctl try-restart {' '.join(try_restart)}")
+        if enable_now:
+            commands.append(f"sudo systemctl enable --now {' '.join(enable_now)}")
+        if enable:
+            commands.append(f"sudo systemctl enable {' '.join(enable)}")
+        if self._restart:
+            commands.append(f"sudo systemctl restart {' '.join(self._restart)}")
+
+        return commands
+
+    async def apply(self) -> bool:
+        """Run all requested actions at once."""
+        commands = self.commands()
+        self.clear()
+        if not commands:
+            return True
+
+        for cmd in commands:
+            FUTURE_LOGGER.info(self.hostname, cmd)
+
+        # the duration of the actions is dominated by the restart of the minion
+        with self.ssh.measure("restart"):
+            response = await self.ssh.run(" && ".join(commands))
+        if response.exit_status != 0:
+            FUTURE_LOGGER.error(self.hostname, "systemd actions failed: %s", response.stderr)
+            return False
+
+        return True
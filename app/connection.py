@@ -0,0 +1,262 @@
+"""SSH connection helpers."""
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple
+
+import asyncssh  # type: ignore
+from asyncssh.compression import get_compression_algs  # type: ignore
+from asyncssh.encryption import get_encryption_algs  # type: ignore
+from asyncssh.kex import get_kex_algs  # type: ignore
+from asyncssh.mac import get_mac_algs  # type: ignore
+
+from app.exceptions import DeviceConnectionException, DeviceTimeoutException
+from app.exceptions.config_exception import InvalidConfiguration
+from app.jump_hosts import JUMP_HOSTS, Upstream, get_jump_host
+from app.metrics import SSH_COMMANDS, TIMEOUTS, UPLOADED_BYTES, measure
+from app.retry import COMMAND_RETRY
+from app.scheduler import SCHEDULER
+from app.settings import CONF
+from app.tracing import TRACER
+
+# Algorithms are listed by order of preference: the first one supported by both
+# the deployer and the device is negotiated. Each list ends with a widely
+# available algorithm so old SONiC images are still reachable.
+SSH_PROFILES: Dict[str, Dict[str, List[str]]] = {
+    # let asyncssh negotiate its default algorithms
+    "default": {},
+    # best choice for CPUs with AES-NI, which is the case of most SONiC devices
+    "fast": {
+        "kex_algs": [
+            "curve25519-sha256",
+            "curve25519-sha256@libssh.org",
+            "ecdh-sha2-nistp256",
+            "diffie-hellman-group14-sha256",
+        ],
+        "encryption_algs": [
+            "aes128-gcm@openssh.com",
+            "aes256-gcm@openssh.com",
+            "chacha20-poly1305@openssh.com",
+            "aes128-ctr",
+        ],
+        "mac_algs": [
+            "umac-64-etm@openssh.com",
+            "hmac-sha2-256-etm@openssh.com",
+            "hmac-sha2-256",
+        ],
+    },
+    # best choice for CPUs without AES acceleration
+    "fast-chacha": {
+        "kex_algs": [
+            "curve25519-sha256",
+            "curve25519-sha256@libssh.org",
+            "ecdh-sha2-nistp256",
+            "diffie-hellman-group14-sha256",
+        ],
+        "encryption_algs": [
+            "chacha20-poly1305@openssh.com",
+            "aes128-gcm@openssh.com",
+            "aes128-ctr",
+        ],
+        "mac_algs": [
+            "umac-64-etm@openssh.com",
+            "hmac-sha2-256-etm@openssh.com",
+            "hmac-sha2-256",
+        ],
+    },
+}
+
+SUPPORTED_ALGS = {
+    "kex_algs": get_kex_algs,
+    "encryption_algs": get_encryption_algs,
+    "mac_algs": get_mac_algs,
+}
+
+# salt-minion PEX files are zip archives: compressing them only costs CPU time
+COMPRESSION_ALGS = ["zlib@openssh.com", "zlib", "none"]
+
+
+def _filter_supported(alg_type: str, algs: List[str]) -> List[str]:
+    """Remove algorithms not supported by the local asyncssh/cryptography libraries.
+
+    asyncssh refuses to connect if an unknown algorithm is requested.
+    """
+    supported = SUPPORTED_ALGS[alg_type]()
+    return [alg for alg in algs if alg.encode("ascii") in supported]
+
+
+def get_connect_options(
+    profile: Optional[str] = None, compression: Optional[bool] = None
+) -> Dict[str, Any]:
+    """Return asyncssh.connect() options for a performance profile.
+
+    :param profile: name of the profile in SSH_PROFILES, default to CONF.ssh_profile
+    :param compression: enable SSH compression, default to CONF.ssh_compression
+    """
+    profile = profile or CONF.ssh_profile
+    if compression is None:
+        compression = CONF.ssh_compression
+
+    if profile not in SSH_PROFILES:
+        raise InvalidConfiguration(f"unknown SSH profile: {profile}")
+
+    options: Dict[str, Any] = {}
+    for alg_type, algs in SSH_PROFILES[profile].items():
+        options[alg_type] = _filter_supported(alg_type, algs)
+
+    if compression:
+        supported = get_compression_algs()
+        options["compression_algs"] = [
+            alg for alg in COMPRESSION_ALGS if alg.encode("ascii") in supported
+        ]
+    else:
+        options["compression_algs"] = None
+
+    return options
+
+
+def get_endpoint(hostname: str) -> Tuple[str, int]:
+    """Return the address and the port to reach a device over SSH.
+
+    CONF.ssh_endpoints overrides the address of some devices, e.g. to reach
+    simulated devices on local ports.
+    """
+    endpoint = CONF.ssh_endpoints.get(hostname, hostname)
+    host, _, port = endpoint.rpartition(":")
+    if not host:
+        return endpoint, 22
+
+    return host, int(port)
+
+
+class ConnectionStats:  # pylint: disable=R0903
+    """Counters of one device, shared by all the views of its connection."""
+
+    def __init__(self) -> None:
+        """Initialize counters."""
+        self.commands = 0
+        self.uploaded_bytes = 0
+        # (component, phase) -> cumulated duration in seconds
+        self.durations: dict[tuple[str, str], float] = {}
+
+
+class DeviceConnection:
+    """Instrumented wrapper around the asyncssh connection of one device.
+
+    All SSH round trips and uploads go through it, so metrics are recorded in one
+    place. Each deployer gets its own view of the connection (see for_component),
+    so metrics are labeled by deployer.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        component: str = "device",
+        conn: Optional[asyncssh.SSHClientConnection] = None,
+        stats: Optional[ConnectionStats] = None,
+    ) -> None:
+        """Initialize the wrapper, the connection is opened by open()."""
+        self.hostname = hostname
+        self.component = component
+        self.conn = conn
+        self.stats = stats or ConnectionStats()
+        # jump host connection the device is tunneled over, released by abort()
+        self.upstream: Optional[Upstream] = None
+
+    def for_component(self, component: str) -> "DeviceConnection":
+        """Return a view of the same connection, labeled for a component."""
+        return DeviceConnection(self.hostname, component, self.conn, self.stats)
+
+    @property
+    def connection(self) -> asyncssh.SSHClientConnection:
+        """Return the SSH connection, raise if the device is not connected yet."""
+        if self.conn is None:
+            raise DeviceConnectionException(f"{self.hostname} is not connected")
+        return self.conn
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        """Measure the duration of a phase for this component."""
+        result: dict[str, float] = {}
+        try:
+            with TRACER.span(phase, self.hostname, component=self.component):
+                with measure(phase, self.component) as result:
+                    yield
+        finally:
+            key = (self.component, phase)
+            self.stats.durations[key] = self.stats.durations.get(key, 0.0) + result["duration"]
+
+    async def _watch(self, operation: str, awaitable: Awaitable, max_duration: float) -> Any:
+        """Await an SSH operation, abort the connection if it hangs.
+
+        A hung session (e.g. sudo waiting for a stuck TACACS server) would block
+        the device forever: the connection is aborted so the other sessions of the
+        device fail as well.
+        """
+        try:
+            return await asyncio.wait_for(awaitable, max_duration)
+        except asyncio.TimeoutError as error:
+            TIMEOUTS.labels(operation).inc()
+            self.abort()
+            raise DeviceTimeoutException(
+                f"{self.hostname}: {operation} did not finish after {max_duration}s"
+            ) from error
+
+    async def open(self, **kwargs: Any) -> None:
+        """Connect to the device, through its jump host if any.
+
+        See asyncssh.connect() for the arguments.
+        """
+        host, port = get_endpoint(self.hostname)
+        jump_host = get_jump_host(self.hostname)
+        await SCHEDULER.handshake(self.hostname)
+        with self.measure("connect"):
+            if jump_host:
+                self.conn, self.upstream = await JUMP_HOSTS.connect(jump_host, host, port, **kwargs)
+            else:
+                self.conn = await asyncssh.connect(host, port, **kwargs)
+
+    async def run(self, command: str, **kwargs: Any) -> Any:
+        """Run a command on the device, see SSHClientConnection.run().
+
+        The command is retried if its session could not be opened.
+        """
+        return await COMMAND_RETRY.run(self.hostname, lambda: self._run(command, **kwargs))
+
+    async def _run(self, command: str, **kwargs: Any) -> Any:
+        SSH_COMMANDS.labels(self.component).inc()
+        self.stats.commands += 1
+        with TRACER.span("run", self.hostname, component=self.component, command=command):
+            return await self._watch(
+                "command", self.connection.run(command, **kwargs), CONF.command_timeout
+            )
+
+    async def upload(self, local_path: str, remote_path: str) -> None:
+        """Upload a file to the device with SCP."""
+        sizes: dict[bytes, int] = {}
+
+        def progress(src: bytes, _: bytes, copied: int, __: int) -> None:
+            sizes[src] = copied
+
+        with self.measure("upload"):
+            await self._watch(
+                "upload",
+                asyncssh.scp(local_path, (self.connection, remote_path), progress_handler=progress),
+                CONF.upload_timeout,
+            )
+
+        size = sum(sizes.values())
+        UPLOADED_BYTES.labels(self.component).inc(size)
+        self.stats.uploaded_bytes += size
+
+    def abort(self) -> None:
+        """Forcibly close the connection."""
+        if self.conn:
+            self.conn.abort()
+        if self.upstream:
+            JUMP_HOSTS.release(self.upstream)
+            self.upstream = None
+
+    async def wait_closed(self) -> None:
+        """Wait for the connection to close."""
+        if self.conn:
+            await self.conn.wait_closed()
@@ -0,0 +1,118 @@
+"""Credentials of the devices.
+
+Static credentials (settings or prompt) are the same for all devices. Vault
+credentials are read from vault_secret_path, which may depend on the site or
+the hostname of the device (e.g. "sonic/{site}"). The secrets of all the paths
+are read concurrently before the deployment starts, once per path and with a
+single Vault token: no device waits for Vault. The token is revoked by close(),
+as soon as the secrets are read.
+"""
+import asyncio
+from typing import Any
+
+from app.exceptions import VaultPasswordNotFound, VaultUnreachable
+from app.logger import get_logger
+from app.settings import CONF
+from app.utils import get_site
+
+LOGGER = get_logger(__name__)
+
+# username -> password, in the order they are tried
+Credentials = dict[str, str]
+
+
+class StaticCredentials:
+    """The same credentials for all devices."""
+
+    def __init__(self, credentials: Credentials) -> None:
+        """Initialize with the credentials of all devices."""
+        self.credentials = credentials
+
+    async def get_all(self, hostnames: list[str]) -> dict[str, Credentials]:
+        """Return the credentials of each device."""
+        return dict.fromkeys(hostnames, self.credentials)
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+class VaultCredentials:
+    """Credentials read from Vault, once per secret path."""
+
+    def __init__(self) -> None:
+        """Initialize without Vault token, it is requested on first use."""
+        self._client: Any = None
+
+    @staticmethod
+    def secret_path(hostname: str) -> str:
+        """Return the Vault path of the credentials of a device."""
+        return str(CONF.vault_secret_path).format(hostname=hostname, site=get_site(hostname))
+
+    def _login(self) -> None:
+        import hvac  # type: ignore # noqa: PLC0415
+
+        client = hvac.Client(url=CONF.vault_url)
+        client.auth.ldap.login(username=CONF.vault_login, password=CONF.vault_password)
+        if not client.is_authenticated():
+            raise VaultUnreachable("Unable to connect to Vault")
+
+        self._client = client
+
+    def _read(self, path: str) -> Credentials:
+        """Read the credentials of one path.
+
+        :raises VaultPasswordNotFound: if the path or one of the usernames is missing
+        """
+        import hvac  # noqa: PLC0415
+
+        try:
+            result = self._client.secrets.kv.read_secret_version(path=path, mount_point="devices")
+        except hvac.exceptions.VaultError as error:
+            raise VaultPasswordNotFound(f"Unable to read {path}: {error}") from error
+
+        data = result["data"]["data"]
+        credentials = {}
+        for user in CONF.vault_device_usernames or []:
+            if user not in data:
+                raise VaultPasswordNotFound(f"Unable to find {user} in {path}")
+            credentials[user] = data[user]
+
+        return credentials
+
+    async def get_all(self, hostnames: list[str]) -> dict[str, Credentials]:
+        """Return the credentials of each device, empty if they are not available."""
+        paths = {hostname: self.secret_path(hostname) for hostname in hostnames}
+        secret_paths = sorted(set(paths.values()))
+        LOGGER.info("reading %i secret paths in Vault", len(secret_paths))
+        if self._client is None:
+            await asyncio.to_thread(self._login)
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._read, path) for path in secret_paths),
+            return_exceptions=True,
+        )
+
+        secrets = {}
+        for index, path in enumerate(secret_paths):
+            result = results[index]
+            if isinstance(result, VaultPasswordNotFound):
+                devices = sorted(hostname for hostname, item in paths.items() if item == path)
+                LOGGER.error("no credentials for %s in %s: %s", ", ".join(devices), path, result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                secrets[path] = result
+
+        return {hostname: secrets.get(path, {}) for hostname, path in paths.items()}
+
+    def close(self) -> None:
+        """Revoke the Vault token, errors are only logged: the secrets are already read."""
+        import hvac  # noqa: PLC0415
+
+        if self._client is None:
+            return
+
+        try:
+            self._client.logout(revoke_token=True)
+        except hvac.exceptions.VaultError as error:
+            LOGGER.error("unable to revoke the Vault token: %s", error)
+        self._client = None
@@ -1,23 +1,24 @@
 """Deployer for the configuration."""
 from typing import List
 
-import dns.resolver
 from futurelog import FutureLogger
 
 from app.deployers.deployer import Deployer
 from app.exceptions import ConfigDeployerException
 from app.logger import get_logger
+from app.resolver import RESOLVER
 from app.settings import CONF
 from app.utils import upload_file
 
 LOGGER = get_logger(__name__)
-FUTURE_LOGGER = FutureLogger(__name__, CONF.log_level)
+FUTURE_LOGGER = FutureLogger(__name__)
 
 
 class ConfigDeployer(Deployer):
     """Deploys configuration for DNS and minion."""
 
     resolv_conf: str
+    dns_servers: List[str] = []
 
     async def _check_dns_configuration(self) -> bool:
         """Check /etc/resolv.conf configuration."""
@@ -68,28 +69,23 @@ class ConfigDeployer(Deployer):
         return all(checks)
 
     @classmethod
-    def prepare(cls) -> None:
+    async def prepare(cls) -> None:
         """Get all necessary information to run the deployer."""
-        # prepare /etc/resolv.conf
-        dns_servers = cls._get_dns_resolvers()
-        cls.resolv_conf = cls._construct_dns(dns_servers)
+        # prepare /etc/resolv.conf, if the DNS servers changed
+        dns_servers = await cls._get_dns_resolvers()
+        if dns_servers != cls.dns_servers:
+            LOGGER.info("DNS servers: %s", ", ".join(dns_servers))
+            cls.resolv_conf = cls._construct_dns(dns_servers)
+            cls.dns_servers = dns_servers
 
     @staticmethod
-    def _get_dns_resolvers() -> List:
+    async def _get_dns_resolvers() -> List[str]:
         """Return valid DNS resolvers only."""
         if not CONF.resolve_dns_resolvers_hostname:
             return CONF.dns_resolvers
 
-        dns_resolvers = set()
-        for hostname in CONF.dns_resolvers:
-            try:
-                answers = dns.resolver.query(hostname, "A")
-            except dns.resolver.NXDOMAIN:
-                LOGGER.debug("%s does not exist", hostname)
-                continue
-
-            dns_resolvers.update([answer.address for answer in answers])
-
+        resolved = await RESOLVER.resolve(CONF.dns_resolvers)
+        dns_resolvers = {address for addresses in resolved.values() for address in addresses}
         if not dns_resolvers:
             raise ConfigDeployerException("No DNS servers found.")
 
@@ -142,11 +138,7 @@ class ConfigDeployer(Deployer):
                 return False
 
         # request the restart of the minion if necessary
-        response = await self.ssh.run("sudo systemctl is-active salt-minion.service")
-        if response.exit_status == 0:
-            response = await self.ssh.run("sudo systemctl restart salt-minion")
-            if response.exit_status != 0:
-                return False
+        self.actions.try_restart("salt-minion.service")
 
         return True
 
@@ -2,21 +2,33 @@
 
 Must be extended to be used.
 """
-from asyncssh.connection import SSHClientConnection  # type: ignore
+from app.actions import SystemdActions
+from app.connection import DeviceConnection
 
 
 class Deployer:
     """Define the structure of a Deployer."""
 
-    def __init__(self, ssh: SSHClientConnection, hostname: str, sonic_version: str) -> None:
+    # name of the components (see Device.components) which must be deployed before this one
+    dependencies: tuple[str, ...] = ()
+
+    def __init__(
+        self,
+        ssh: DeviceConnection,
+        hostname: str,
+        sonic_version: str,
+        actions: SystemdActions,
+    ) -> None:
         """Initialize the Deployer.
 
         It includes the SSH connection object to maintain and
-        reuse the connection during the deployment.
+        reuse the connection during the deployment, and the systemd
+        actions collector shared by all deployers of the device.
         """
         self.ssh = ssh
         self.hostname = hostname
         self.sonic_version = sonic_version
+        self.actions = actions
 
     async def check(self) -> bool:
         """Check if Salt is deployed properly on the remote device."""
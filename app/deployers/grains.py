@@ -5,10 +5,9 @@ from futurelog import FutureLogger
 
 from app import resources
 from app.deployers.deployer import Deployer
-from app.settings import CONF
 from app.utils import extract_checksum, get_sha256, upload_file
 
-FUTURE_LOGGER = FutureLogger(__name__, CONF.log_level)
+FUTURE_LOGGER = FutureLogger(__name__)
 
 
 class GrainsDeployer(Deployer):
@@ -1,62 +1,114 @@
-"""Deploy Salt minion executable."""
+"""Deploy Salt minion executable.
+
+By default ("direct" rollout), the PEX replaces /opt/salt/salt-minion. A new PEX can
+also be rolled out in two phases:
+- "stage": the PEX is uploaded next to the running one, in a versioned path; it is moved
+  and verified at low priority on the device (the SFTP transfer itself is not throttled)
+- "activate": /opt/salt/salt-minion becomes a symlink to the staged PEX (atomic swap)
+- "rollback": /opt/salt/salt-minion is swapped back to the previously active PEX
+
+With minion_fanout, the devices of a site copy the PEX from each other (see app.fanout).
+"""
+import asyncio
 import re
+import shlex
 import tempfile
 import xml.etree.ElementTree as ET
+from typing import Optional
 
-import requests
 from futurelog import FutureLogger
 
 from app.deployers.deployer import Deployer
 from app.exceptions import InvalidMinion, MinionDeployerException
 from app.exceptions.config_exception import InvalidConfiguration
+from app.fanout import FANOUT
 from app.logger import get_logger
 from app.settings import CONF
-from app.utils import extract_checksum, upload_file
+from app.utils import LOW_PRIORITY, extract_checksum, move_file, upload_file
 
 LOGGER = get_logger(__name__)
-FUTURE_LOGGER = FutureLogger(__name__, CONF.log_level)
+FUTURE_LOGGER = FutureLogger(__name__)
 
 PYTHON_SHEBANG = "#!/usr/bin/env python"
 
+MINION_PATH = "/opt/salt/salt-minion"
+RELEASES_DIRECTORY = "/opt/salt/releases"
+# symlink to the PEX active before the last activation
+PREVIOUS_PATH = "/opt/salt/salt-minion.previous"
+# directory served to the other devices of the site, see app.fanout
+FANOUT_DIRECTORY = "/tmp/salt-fanout"
+# attempts to reach the server of the PEX, and seconds between them
+SERVE_PROBES = 5
+SERVE_PROBE_INTERVAL = 0.5
+
 
 class MinionDeployer(Deployer):
     """Ensure the device has the salt-minion executable from Nexus."""
 
-    filepath: tempfile.TemporaryDirectory
+    # temporary directory of the PEX files downloaded from Nexus, removed once
+    # replaced by a new download (see app.reload)
+    download: Optional[tempfile.TemporaryDirectory] = None
+    # SONiC version -> local path of the PEX
+    minion_files: dict[str, str] = {}
     checksum_sha256: dict[str, str] = {}
 
     @classmethod
     def download_minions(cls) -> None:
-        """Get minion executables from local filesystem or Nexus and get the checksum."""
-        if CONF.minion_files_local_directory:
-            cls.filepath = CONF.minion_files_local_directory
+        """Get minion executables from local filesystem or Nexus and get the checksum.
 
+        The previous files and checksums are replaced at once, and only if all of
+        them are available (see app.reload).
+        """
+        minion_files = {}
+        checksums = {}
+        directory = None
+        if CONF.minion_files_local_directory:
             for sonic_version in CONF.sonic_versions:
                 minion_file = f"{CONF.minion_files_local_directory}/salt-minion-{sonic_version}.pex"
-                with open(minion_file, "r", encoding="utf-8") as minion_fd:
-                    if PYTHON_SHEBANG not in minion_fd.readline():
+                # a PEX is a zip archive: only the shebang line is text
+                with open(minion_file, "rb") as minion_fd:
+                    if PYTHON_SHEBANG.encode() not in minion_fd.readline():
                         raise InvalidMinion()
 
+                # the checksum file may be the output of sha256sum: "<checksum>  <filename>"
                 with open(f"{minion_file}.sha256", "r", encoding="utf-8") as checksum_file:
-                    cls.checksum_sha256[sonic_version] = checksum_file.read()
+                    checksum = checksum_file.read().strip()
+                checksums[sonic_version] = extract_checksum(checksum)
+                minion_files[sonic_version] = minion_file
 
         elif CONF.minion_files_nexus_location:
-            cls.filepath = tempfile.TemporaryDirectory()  # pylint: disable=R1732
-
-            for sonic_version in CONF.sonic_versions:
-                nexus_release = cls._get_latest_nexus_build()
-                cls._download_minion_from_nexus(nexus_release, sonic_version)
-                cls._get_checksum_from_nexus(nexus_release, sonic_version)
+            directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+            try:
+                for sonic_version in CONF.sonic_versions:
+                    nexus_release = cls._get_latest_nexus_build()
+                    minion_files[sonic_version] = cls._download_minion_from_nexus(
+                        directory.name, nexus_release, sonic_version
+                    )
+                    checksums[sonic_version] = cls._get_checksum_from_nexus(
+                        nexus_release, sonic_version
+                    )
+            except BaseException:
+                directory.cleanup()
+                raise
 
         else:
             raise InvalidConfiguration("minion files location was not specified")
 
+        cls.minion_files = minion_files
+        cls.checksum_sha256 = checksums
+        # the uploads in progress keep reading the files they opened
+        previous, cls.download = cls.download, directory
+        if previous is not None:
+            previous.cleanup()
+
     ##
     # Get minion executables from Nexus
     ##
 
     @classmethod
     def _get_latest_nexus_build(cls) -> str:
+        import requests  # noqa: PLC0415
+
         try:
             response = requests.get(
                 f"{CONF.minion_files_nexus_location}/maven-metadata.xml", timeout=60
@@ -68,7 +120,9 @@ class MinionDeployer(Deployer):
         return root.find("versioning").find("latest").text  # type: ignore
 
     @classmethod
-    def _get_checksum_from_nexus(cls, nexus_release, sonic_version) -> None:
+    def _get_checksum_from_nexus(cls, nexus_release, sonic_version) -> str:
+        import requests  # noqa: PLC0415
+
         basename = f"salt-minion-{nexus_release}-{sonic_version}.pex"
         # get checksum
         try:
@@ -83,10 +137,12 @@ class MinionDeployer(Deployer):
         if not re.match(r"^[A-Fa-f0-9]{64}$", checksum.text):
             raise MinionDeployerException("invalid checksum value")  # InconsistentChecksum
 
-        cls.checksum_sha256[sonic_version] = checksum.text
+        return checksum.text
 
     @classmethod
-    def _download_minion_from_nexus(cls, nexus_release, sonic_version) -> None:
+    def _download_minion_from_nexus(cls, directory, nexus_release, sonic_version) -> str:
+        import requests  # noqa: PLC0415
+
         basename = f"salt-minion-{nexus_release}-{sonic_version}.pex"
         minion_pex = requests.get(
             f"{CONF.minion_files_nexus_location}/{nexus_release}/{basename}",
@@ -99,16 +155,26 @@ class MinionDeployer(Deployer):
         if PYTHON_SHEBANG not in shebang:
             raise InvalidMinion()
 
-        with open(f"{cls.filepath.name}/salt-minion-{sonic_version}", "wb") as pex_file:
+        minion_file = f"{directory}/salt-minion-{sonic_version}"
+        with open(minion_file, "wb") as pex_file:
             for chunk in minion_pex.iter_content(102400):
                 pex_file.write(chunk)
 
+        return minion_file
+
     ##
     # Deploy and checks
     ##
 
     async def check(self) -> bool:
         """Check the minion has been well deployed."""
+        if CONF.minion_rollout == "stage":
+            return await self._check_staged()
+        if CONF.minion_rollout == "activate":
+            return await self._check_active(self._release_path())
+        if CONF.minion_rollout == "rollback":
+            return await self._check_active(PREVIOUS_PATH)
+
         checksum = ""
         commands = {
             "if minion is present": "ls /opt/salt/salt-minion",
@@ -131,14 +197,15 @@ class MinionDeployer(Deployer):
 
     async def deploy(self) -> bool:
         """Deploy the minion PEX in the right place."""
+        if CONF.minion_rollout == "stage":
+            return await self._stage()
+        if CONF.minion_rollout == "activate":
+            return await self._activate()
+        if CONF.minion_rollout == "rollback":
+            return await self._rollback()
+
         # Push the minion
-        uploaded = await upload_file(
-            self.hostname,
-            self.ssh,
-            f"{self.filepath.name}/salt-minion-{self.sonic_version}",
-            "/opt/salt",
-            "salt-minion",
-        )
+        uploaded = await self._push("/opt/salt", "salt-minion")
         if not uploaded:
             return False
 
@@ -149,3 +216,210 @@ class MinionDeployer(Deployer):
             return False
 
         return await self.check()
+
+    async def _push(self, remote_dir: str, remote_name: str, low_priority: bool = False) -> bool:
+        """Upload the PEX, or copy it from another device of the site (see app.fanout)."""
+        if not CONF.minion_fanout:
+            return await upload_file(
+                self.hostname,
+                self.ssh,
+                self.minion_files[self.sonic_version],
+                remote_dir,
+                remote_name,
+                low_priority=low_priority,
+            )
+
+        checksum = self.checksum_sha256[self.sonic_version]
+        site, source = await FANOUT.acquire(self.hostname, checksum)
+        pushed = serving = False
+        try:
+            if source:
+                pushed = await self._copy_from_peer(source, remote_dir, remote_name, low_priority)
+                if not pushed:
+                    FANOUT.discard(site, source)
+            if not pushed:
+                pushed = await upload_file(
+                    self.hostname,
+                    self.ssh,
+                    self.minion_files[self.sonic_version],
+                    remote_dir,
+                    remote_name,
+                    low_priority=low_priority,
+                ) and await self._verify(f"{remote_dir}/{remote_name}")
+            serving = pushed and await self._serve(f"{remote_dir}/{remote_name}")
+        finally:
+            await FANOUT.release(site, self.hostname, source, serving)
+
+        return pushed
+
+    def _fanout_name(self) -> str:
+        """Return the name of the PEX served to the other devices, based on its checksum."""
+        return f"salt-minion-{self.checksum_sha256[self.sonic_version][:16]}"
+
+    async def _verify(self, path: str) -> bool:
+        """Check the checksum of a copy of the PEX."""
+        response = await self.ssh.run(f"{LOW_PRIORITY} sha256sum {path}")
+        if response.exit_status != 0:
+            return False
+
+        return extract_checksum(response.stdout) == self.checksum_sha256[self.sonic_version]
+
+    async def _copy_from_peer(
+        self, source: str, remote_dir: str, remote_name: str, low_priority: bool
+    ) -> bool:
+        """Copy the PEX from another device of the site, and verify it."""
+        name = self._fanout_name()
+        FUTURE_LOGGER.info(self.hostname, "copy the minion from %s", source)
+        url = f"http://{source}:{CONF.minion_fanout_port}/{name}"
+        response = await self.ssh.run(
+            f"{LOW_PRIORITY} curl -fsS --connect-timeout 5 -o /tmp/{name} {url}"
+        )
+        if response.exit_status != 0 or not await self._verify(f"/tmp/{name}"):
+            FUTURE_LOGGER.warning(
+                self.hostname, "unable to copy the minion from %s: %s", source, response.stderr
+            )
+            await self.ssh.run(f"rm -f /tmp/{name}")
+            return False
+
+        return await move_file(
+            self.hostname, self.ssh, name, remote_dir, remote_name, low_priority=low_priority
+        )
+
+    async def _management_address(self) -> str:
+        """Return the address the device is reached on, empty if unknown."""
+        response = await self.ssh.run("echo $SSH_CONNECTION")
+        try:
+            _, _, address, _ = response.stdout.split()
+        except ValueError:
+            # not in an SSH session: no "client address, client port, address, port"
+            return ""
+
+        return address if response.exit_status == 0 else ""
+
+    async def _serve(self, path: str) -> bool:
+        """Serve the PEX to the other devices of the site, for minion_fanout_serve_time.
+
+        The server listens on the management address only, and is probed before
+        the device becomes a source.
+        """
+        address = await self._management_address()
+        if not address:
+            FUTURE_LOGGER.warning(self.hostname, "unknown management address: minion not served")
+            return False
+
+        name = self._fanout_name()
+        server = (
+            f"setsid timeout {CONF.minion_fanout_serve_time:g} python3 -m http.server "
+            f"{CONF.minion_fanout_port} --bind {address} --directory {FANOUT_DIRECTORY}"
+        )
+        # a server of a previous run may already serve the directory: the new one exits
+        response = await self.ssh.run(
+            f"mkdir -p {FANOUT_DIRECTORY} && ln -sfn {path} {FANOUT_DIRECTORY}/{name}"
+            f" && ({server} > /dev/null 2>&1 < /dev/null &)"
+        )
+        if response.exit_status != 0:
+            return False
+
+        host = f"[{address}]" if ":" in address else address
+        url = f"http://{host}:{CONF.minion_fanout_port}/{name}"
+        # the server takes a moment to start
+        for _ in range(SERVE_PROBES):
+            response = await self.ssh.run(f"curl -fsI --connect-timeout 5 {url}")
+            if response.exit_status == 0:
+                return True
+            await asyncio.sleep(SERVE_PROBE_INTERVAL)
+
+        FUTURE_LOGGER.warning(self.hostname, "minion not served on %s", url)
+        return False
+
+    ##
+    # Two-phase rollout
+    ##
+
+    def _release_name(self) -> str:
+        """Return the versioned name of the PEX, based on its checksum."""
+        checksum = self.checksum_sha256[self.sonic_version].split()[0]
+        return f"salt-minion-{checksum[:16]}"
+
+    def _release_path(self) -> str:
+        return f"{RELEASES_DIRECTORY}/{self._release_name()}"
+
+    async def _check_staged(self) -> bool:
+        """Check the PEX is staged with the right checksum."""
+        FUTURE_LOGGER.debug(self.hostname, "check if minion is staged")
+        response = await self.ssh.run(f"{LOW_PRIORITY} sha256sum {self._release_path()}")
+        if response.exit_status != 0:
+            FUTURE_LOGGER.info(self.hostname, "check if minion is staged: failed")
+            return False
+
+        return extract_checksum(response.stdout) == self.checksum_sha256[self.sonic_version]
+
+    async def _check_active(self, target: str) -> bool:
+        """Check the running minion is the target PEX."""
+        FUTURE_LOGGER.debug(self.hostname, "check if %s is active", target)
+        response = await self.ssh.run(
+            f'[ -e {MINION_PATH} ] && [ "$(readlink -f {MINION_PATH})" = "$(readlink -f {target})" ]'
+        )
+        return response.exit_status == 0
+
+    async def _stage(self) -> bool:
+        """Upload the PEX in its versioned path, without touching the running minion."""
+        uploaded = await self._push(RELEASES_DIRECTORY, self._release_name(), low_priority=True)
+        if not uploaded:
+            return False
+
+        response = await self.ssh.run(f"sudo chmod +x {self._release_path()}")
+        if response.exit_status != 0:
+            return False
+
+        return await self._check_staged()
+
+    async def _swap(self, script: str) -> bool:
+        """Run a swap script as root, in one command."""
+        response = await self.ssh.run(f"sudo sh -c {shlex.quote(script)}")
+        if response.exit_status != 0:
+            FUTURE_LOGGER.error(self.hostname, "swap failed: %s", response.stderr)
+            return False
+
+        return await self.check()
+
+    async def _activate(self) -> bool:
+        """Swap the running minion to the staged PEX.
+
+        A PEX deployed directly (regular file) is kept as "salt-minion-legacy" to allow a
+        rollback. Releases which are neither active nor previous are removed.
+        """
+        release = self._release_path()
+        FUTURE_LOGGER.info(self.hostname, "activate %s", release)
+        script = f"""set -e
+test -x {release} || {{ echo "{release} is not staged" >&2; exit 1; }}
+if [ -e {MINION_PATH} ]; then
+    current=$(readlink -f {MINION_PATH})
+    if [ ! -L {MINION_PATH} ]; then
+        cp -p {MINION_PATH} {RELEASES_DIRECTORY}/salt-minion-legacy
+        current={RELEASES_DIRECTORY}/salt-minion-legacy
+    fi
+    if [ "$current" != "{release}" ]; then ln -sfn "$current" {PREVIOUS_PATH}; fi
+fi
+ln -sfn {release} {MINION_PATH}.new
+mv -T {MINION_PATH}.new {MINION_PATH}
+previous=$(readlink -f {PREVIOUS_PATH} || true)
+for old in {RELEASES_DIRECTORY}/salt-minion-*; do
+    if [ "$old" != "{release}" ] && [ "$old" != "$previous" ]; then rm -f "$old"; fi
+done
+"""
+        return await self._swap(script)
+
+    async def _rollback(self) -> bool:
+        """Swap the running minion back to the previously active PEX.
+
+        The previous PEX is kept as is, so running a rollback twice is harmless.
+        """
+        FUTURE_LOGGER.info(self.hostname, "rollback to %s", PREVIOUS_PATH)
+        script = f"""set -e
+previous=$(readlink -f {PREVIOUS_PATH})
+test -x "$previous" || {{ echo "no previous minion to rollback to" >&2; exit 1; }}
+ln -sfn "$previous" {MINION_PATH}.new
+mv -T {MINION_PATH}.new {MINION_PATH}
+"""
+        return await self._swap(script)
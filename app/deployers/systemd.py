@@ -10,23 +10,41 @@ from app.settings import CONF
 from app.utils import extract_checksum, get_sha256, upload_file
 
 LOGGER = get_logger(__name__)
-FUTURE_LOGGER = FutureLogger(__name__, CONF.log_level)
+FUTURE_LOGGER = FutureLogger(__name__)
+
+# checksum name -> unit file
+UNITS = {
+    "minion.service": "salt-minion.service",
+    "grains.service": "salt-update-grains.service",
+    "grains.timer": "salt-update-grains.timer",
+}
+# installed if grains_path_unit is enabled
+PATH_UNITS = {"grains.path": "salt-update-grains.path"}
+
+
+def get_units() -> Dict[str, str]:
+    """Return the units to deploy, by checksum name."""
+    if CONF.grains_path_unit:
+        return {**UNITS, **PATH_UNITS}
+    return UNITS
 
 
 class SystemdDeployer(Deployer):
     """Deploys systemd services and timers to execute minion and scripts."""
 
+    # services are started with the executables and configuration they run
+    dependencies = ("minion", "grains", "config")
     sha256: Dict = {}
 
     @classmethod
     def calculate_checksum(cls) -> None:
         """Calculate checksum for local files."""
         path = f"{resources.__path__[0]}/systemd"
-        cls.sha256["minion.service"] = get_sha256(f"{path}/salt-minion.service")
-        cls.sha256["grains.service"] = get_sha256(f"{path}/salt-update-grains.service")
-        cls.sha256["grains.timer"] = get_sha256(f"{path}/salt-update-grains.timer")
+        for name, unit in {**UNITS, **PATH_UNITS}.items():
+            cls.sha256[name] = get_sha256(f"{path}/{unit}")
 
-    async def _check_systemd(self) -> bool:
+    async def check_services(self) -> bool:
+        """Check if all services are started and enabled."""
         commands = {
             "minion service is enabled": "sudo systemctl is-enabled salt-minion.service",
             "minion service is started": "sudo systemctl is-active salt-minion.service",
@@ -34,6 +52,9 @@ class SystemdDeployer(Deployer):
             "grains timer is started": "sudo systemctl is-active salt-update-grains.timer",
             "grains service is enabled": "sudo systemctl is-enabled salt-update-grains.service",
         }
+        if CONF.grains_path_unit:
+            commands["grains path is enabled"] = "sudo systemctl is-enabled salt-update-grains.path"
+            commands["grains path is started"] = "sudo systemctl is-active salt-update-grains.path"
 
         for action, cmd in commands.items():
             FUTURE_LOGGER.info(self.hostname, "check if %s", action)
@@ -47,9 +68,7 @@ class SystemdDeployer(Deployer):
 
     async def _check_checksum(self) -> bool:
         commands = {
-            "minion.service": "sha256sum /etc/systemd/system/salt-minion.service",
-            "grains.service": "sha256sum /etc/systemd/system/salt-update-grains.service",
-            "grains.timer": "sha256sum /etc/systemd/system/salt-update-grains.timer",
+            name: f"sha256sum /etc/systemd/system/{unit}" for name, unit in get_units().items()
         }
 
         for action, cmd in commands.items():
@@ -64,27 +83,18 @@ class SystemdDeployer(Deployer):
 
         return True
 
-    async def restart(self) -> bool:
-        """Restart salt-minion systemd service."""
-        response = await self.ssh.run("sudo systemctl restart salt-minion.service")
-
-        return not bool(response.exit_status)
-
     async def check(self) -> bool:
-        """Check if all services are started and enabled."""
-        checks = [await self._check_systemd(), await self._check_checksum()]
+        """Check if all services are started, enabled and up to date."""
+        checks = [await self.check_services(), await self._check_checksum()]
         return all(checks)
 
     async def deploy(self) -> bool:
-        """Deploys salt-minion service and timer/service for some scripts."""
-        systemd_files = [
-            "salt-minion.service",
-            "salt-update-grains.service",
-            "salt-update-grains.timer",
-        ]
-        commands = {
-            "reload systemd": "sudo systemctl daemon-reload",
-        }
+        """Deploys salt-minion service and timer/service for some scripts.
+
+        Reload, enable and start are requested to the systemd actions collector:
+        services are checked once actions are applied (see Device.apply).
+        """
+        systemd_files = list(get_units().values())
 
         # upload systemd files
         for elt in systemd_files:
@@ -98,14 +108,8 @@ class SystemdDeployer(Deployer):
             if not uploaded:
                 return False
 
-            commands[f"enable {elt}"] = f"sudo systemctl enable {elt}"
-            commands[f"starting {elt}"] = f"sudo systemctl start {elt}"
-
         # enable and start systemd services
-        for action, cmd in commands.items():
-            FUTURE_LOGGER.info(self.hostname, action)
-            response = await self.ssh.run(cmd)
-            if response.exit_status != 0:
-                return False
+        self.actions.daemon_reload()
+        self.actions.enable(*systemd_files, now=True)
 
-        return await self.check()
+        return await self._check_checksum()
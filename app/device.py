@@ -1,23 +1,32 @@
 """Device class."""
-import sys
+import asyncio
+import time
+from graphlib import TopologicalSorter
 
-import asyncssh  # type: ignore
 from futurelog import FutureLogger
 
-from app import utils
+from app.actions import SystemdActions
+from app.connection import DeviceConnection, get_connect_options
 from app.deployers import (
     ConfigDeployer,
     GrainsDeployer,
     MinionDeployer,
     SystemdDeployer,
 )
-from app.exceptions import DeviceConnectionException, UnknownSonicVersionException
+from app.deployers.deployer import Deployer
+from app.drain import DRAIN
+from app.exceptions import (
+    DeviceConnectionException,
+    DeviceTimeoutException,
+    UnknownSonicVersionException,
+)
 from app.logger import get_logger
-from app.metrics import DEPLOYMENT_STATUS
+from app.metrics import set_deployment_status
+from app.plan import DevicePlan, desired_state
 from app.settings import CONF
 
 LOGGER = get_logger(__name__)
-FUTURE_LOGGER = FutureLogger(__name__, CONF.log_level)
+FUTURE_LOGGER = FutureLogger(__name__)
 
 
 class Device:
@@ -26,8 +35,10 @@ class Device:
     connected: bool
     hostname: str
     components: dict
+    component_status: dict[str, str]
+    actions: SystemdActions
     salt_master: str
-    ssh: asyncssh
+    ssh: DeviceConnection
     sonic_version: str
 
     def __init__(self, hostname: str) -> None:
@@ -36,29 +47,47 @@ class Device:
         self.connected = False
         self.sonic_version = ""
         self.components = {}
+        self.component_status = {}
+        self.ssh = DeviceConnection(hostname)
 
     async def connect(self, user: str, password: str) -> None:
         """Connect to the device via SSH."""
         # set SSH connection for all deployers
         try:
-            self.ssh = await asyncssh.connect(
-                self.hostname, username=user, password=password, known_hosts=None, login_timeout=10
+            await self.ssh.open(
+                username=user,
+                password=password,
+                known_hosts=None,
+                login_timeout=10,
+                **get_connect_options(),
             )
             self.connected = True
-        except (asyncssh.Error, Exception) as error:
+        except Exception as error:  # pylint: disable=W0703
             FUTURE_LOGGER.error(self.hostname, error)
             raise DeviceConnectionException(f"Connection failure: {self.hostname}") from error
 
-        self.sonic_version = await self.get_running_sonic_version()
+        with self.ssh.measure("version"):
+            self.sonic_version = await self.get_running_sonic_version()
         if not self.sonic_version:
             raise UnknownSonicVersionException("failed to parse")
 
         FUTURE_LOGGER.info(self.hostname, f"SONiC version: {self.sonic_version}")
+        self.actions = SystemdActions(self.ssh.for_component("actions"), self.hostname)
+        deployers: dict[str, type[Deployer]] = {"minion": MinionDeployer}
+        # two-phase rollouts only deal with the minion
+        if CONF.minion_rollout == "direct":
+            deployers.update(
+                {
+                    "grains": GrainsDeployer,
+                    "config": ConfigDeployer,
+                    "systemd": SystemdDeployer,
+                }
+            )
         self.components = {
-            "minion": MinionDeployer(self.ssh, self.hostname, self.sonic_version),
-            "grains": GrainsDeployer(self.ssh, self.hostname, self.sonic_version),
-            "config": ConfigDeployer(self.ssh, self.hostname, self.sonic_version),
-            "systemd": SystemdDeployer(self.ssh, self.hostname, self.sonic_version),
+            name: deployer(
+                self.ssh.for_component(name), self.hostname, self.sonic_version, self.actions
+            )
+            for name, deployer in deployers.items()
         }
 
     async def disconnect(self) -> None:
@@ -86,72 +115,149 @@ class Device:
 
         return response.stdout.splitlines()[0]
 
-    async def is_salt_ready(self) -> bool:
-        """Check if Salt is properly installed."""
-        status = True
-        if self.components:
-            for component in self.components.values():
-                status = status and await component.check()
-        else:
-            status = False
+    async def _check_component(self, name: str) -> bool:
+        """Check if one component is already deployed."""
+        component = self.components[name]
+        with component.ssh.measure("check"):
+            return await component.check()
 
-        DEPLOYMENT_STATUS.labels(self.hostname, self.sonic_version).set(int(status))
+    async def plan(self, force: bool = False) -> DevicePlan:
+        """Check all components and plan the ones to deploy.
 
-        return status
+        :param force: plan to deploy all components, even the ones already deployed
+        """
+        with self.ssh.measure("check"):
+            checks = await asyncio.gather(
+                *[self._check_component(name) for name in self.components]
+            )
+        components = {name: checks[index] for index, name in enumerate(self.components)}
+        plan = DevicePlan(
+            hostname=self.hostname,
+            sonic_version=self.sonic_version,
+            minion_rollout=CONF.minion_rollout,
+            components=tuple(components.items()),
+            actions=tuple(
+                name for name in self._deployment_order() if force or not components[name]
+            ),
+            created_at=time.time(),
+            fingerprint=desired_state(self.sonic_version),
+        )
 
-    async def _stop_if_signal(self) -> None:
-        if utils.stop_requested:
-            LOGGER.warning("Exiting...")
-            await self.disconnect()
-            LOGGER.warning("SSH connection closed. Bye.")
-            sys.exit(0)
+        set_deployment_status(self.hostname, self.sonic_version, int(plan.ready))
 
-    @staticmethod
-    def _start_progress() -> None:
-        LOGGER.debug("Starting: prevent SIGTERM")
-        utils.in_progress = True
+        return plan
 
-    async def _stop_progress(self) -> None:
-        LOGGER.debug("Finished: allow SIGTERM and check if signal has been received")
-        utils.in_progress = False
-        await self._stop_if_signal()
+    def _deployment_order(self) -> list[str]:
+        """Sort components so each one comes after its dependencies."""
+        graph = {
+            name: [dep for dep in component.dependencies if dep in self.components]
+            for name, component in self.components.items()
+        }
+        return list(TopologicalSorter(graph).static_order())
 
-    async def deploy_salt(self, force: bool = False) -> bool:
-        """Deploy Salt on the device.
+    async def _deploy_component(
+        self, name: str, dependencies: list[asyncio.Task], failure: asyncio.Event, plan: DevicePlan
+    ) -> bool:
+        """Deploy one component once all its dependencies are deployed."""
+        component = self.components[name]
 
-        It will stop if one step fails.
-        """
-        changed = False
+        if dependencies and not all(await asyncio.gather(*dependencies)):
+            self.component_status[name] = "skipped"
+            return False
+
+        # we deploy only if not already deployed
+        if name not in plan.actions:
+            self.component_status[name] = "ready"
+            return True
+
+        # do not start a new step if another one failed or if we have to stop
+        if failure.is_set() or DRAIN.requested:
+            self.component_status[name] = "skipped"
+            return False
+
+        FUTURE_LOGGER.warning(self.hostname, "%s deployers started", name)
+        with component.ssh.measure("deploy"):
+            deployed = await component.deploy()
+
+        if not deployed:
+            failure.set()
+            self.component_status[name] = "failed"
+            set_deployment_status(self.hostname, self.sonic_version, -1)
+            FUTURE_LOGGER.error(self.hostname, "%s deployer failed", name)
+            return False
+
+        self.component_status[name] = "deployed"
+        set_deployment_status(self.hostname, self.sonic_version, 1)
+        FUTURE_LOGGER.warning(self.hostname, "%s deployer succeeded", name)
+        return True
 
+    async def _deploy_components(self, plan: DevicePlan) -> bool:
+        """Deploy all components, each one once its dependencies are deployed."""
+        failure = asyncio.Event()
+        tasks: dict[str, asyncio.Task] = {}
+        for name in self._deployment_order():
+            dependencies = [
+                tasks[dep] for dep in self.components[name].dependencies if dep in tasks
+            ]
+            tasks[name] = asyncio.ensure_future(
+                self._deploy_component(name, dependencies, failure, plan)
+            )
+
+        # wait for all steps, even if one raised, to not leave a step running in background
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # a hung step aborts the connection: report it rather than the steps it interrupted
+            raise next(
+                (error for error in errors if isinstance(error, DeviceTimeoutException)), errors[0]
+            )
+
+        # a component is not deployed if it failed, or was skipped (failure or drain)
+        return all(results)
+
+    async def _apply_actions(self, succeeded: bool) -> bool:
+        """Apply the systemd actions requested by the deployed components."""
+        # restart the minion only once, to take all changes into account
+        # a staged minion is not running yet: no need to restart
+        changed = "deployed" in self.component_status.values()
+        if succeeded and changed and CONF.minion_rollout != "stage":
+            self.actions.restart("salt-minion.service")
+
+        restart_requested = self.actions.is_restart_requested("salt-minion.service")
+        if not await self.actions.apply():
+            FUTURE_LOGGER.error(self.hostname, "salt-minion failed to restart")
+            return False
+
+        if restart_requested:
+            FUTURE_LOGGER.warning(self.hostname, "salt-minion restarted")
+
+        return True
+
+    async def apply(self, plan: DevicePlan) -> bool:
+        """Deploy Salt on the device, following a plan.
+
+        Components are not checked again: only the ones planned are deployed.
+        Components which do not depend on each other are deployed concurrently,
+        on the same SSH connection. It will stop if one step fails: the following
+        steps are not started.
+        """
         if not self.components:
             FUTURE_LOGGER.error(self.hostname, "missing deployer requirements")
             return False
 
-        for name, component in self.components.items():
-            # we deploy only if not already deployed
-            if not force and await component.check():
-                continue
-
-            FUTURE_LOGGER.warning(self.hostname, "%s deployers started", name)
-            self._start_progress()
-            if not await component.deploy():
-                DEPLOYMENT_STATUS.labels(self.hostname, self.sonic_version).set(-1)
-                FUTURE_LOGGER.error(self.hostname, "%s deployer failed", name)
-                await self._stop_progress()
-                return False
-
-            changed = True
-            DEPLOYMENT_STATUS.labels(self.hostname, self.sonic_version).set(1)
-            FUTURE_LOGGER.warning(self.hostname, "%s deployer succeeded", name)
+        with self.ssh.measure("deploy"):
+            succeeded = await self._deploy_components(plan)
+            # actions requested by deployed steps are applied even if another step failed
+            applied = await self._apply_actions(succeeded)
 
-            await self._stop_progress()
+        if not succeeded or not applied:
+            return False
 
-        if changed:
-            restarted = await self.components["systemd"].restart()
-            if restarted:
-                FUTURE_LOGGER.warning(self.hostname, "salt-minion restarted")
-            else:
-                FUTURE_LOGGER.error(self.hostname, "salt-minion failed to restart")
+        if self.component_status.get("systemd") == "deployed":
+            if not await self.components["systemd"].check_services():
+                set_deployment_status(self.hostname, self.sonic_version, -1)
+                FUTURE_LOGGER.error(self.hostname, "systemd services failed to start")
+                return False
 
         FUTURE_LOGGER.warning(self.hostname, "SUCCESS: %s", self.hostname)
         return True
@@ -0,0 +1,63 @@
+"""Graceful drain of a run, on SIGTERM or SIGINT.
+
+Once a drain is requested, no new device and no new component is started: the
+components in progress may finish until the drain deadline, then the remaining
+devices are cancelled (their connection is aborted). The run then ends as
+usual: logs, report and metrics are written. A second signal cancels the
+remaining devices at once.
+"""
+import asyncio
+from typing import Iterable, Optional
+
+from app.logger import get_logger
+from app.settings import CONF
+
+LOGGER = get_logger(__name__)
+
+
+class Drain:
+    """Drain state of the current run, shared by all devices."""
+
+    def __init__(self) -> None:
+        """Initialize a run without drain."""
+        self.requested = False
+        self._tasks: set[asyncio.Task] = set()
+        self._deadline: Optional[asyncio.TimerHandle] = None
+
+    def reset(self) -> None:
+        """Start a new run."""
+        self.requested = False
+        self._tasks = set()
+        if self._deadline:
+            self._deadline.cancel()
+            self._deadline = None
+
+    def track(self, tasks: Iterable[asyncio.Task]) -> None:
+        """Register the device tasks to cancel at the deadline."""
+        for task in tasks:
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def request(self) -> None:
+        """Start draining, must be called from the event loop (see loop.add_signal_handler)."""
+        if self.requested:
+            self.cancel()
+            return
+
+        self.requested = True
+        LOGGER.warning(
+            "drain requested: waiting up to %ss for %i devices",
+            CONF.drain_timeout,
+            len(self._tasks),
+        )
+        self._deadline = asyncio.get_running_loop().call_later(CONF.drain_timeout, self.cancel)
+
+    def cancel(self) -> None:
+        """Cancel the devices still in progress."""
+        if self._tasks:
+            LOGGER.warning("cancelling %i devices still in progress", len(self._tasks))
+        for task in list(self._tasks):
+            task.cancel()
+
+
+DRAIN = Drain()
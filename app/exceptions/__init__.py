@@ -7,6 +7,7 @@ from app.exceptions.deployer_exceptions import (
 )
 from app.exceptions.device_exceptions import (
     DeviceConnectionException,
+    DeviceTimeoutException,
     UnknownSonicVersionException,
 )
 from app.exceptions.utils_exceptions import APIException, ChecksumException
@@ -9,6 +9,14 @@ class DeviceConnectionException(RuntimeError):
         super().__init__(f"Connection issues with device: {msg}")
 
 
+class DeviceTimeoutException(RuntimeError):
+    """Exception raised when an operation on a device hangs."""
+
+    def __init__(self, msg: str) -> None:
+        """Initialize."""
+        super().__init__(f"Timeout on device: {msg}")
+
+
 class UnknownSonicVersionException(RuntimeError):
     """Exception found when trying to get SONiC version."""
 
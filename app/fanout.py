@@ -0,0 +1,85 @@
+"""Peer-to-peer fan-out of the minion PEX within a site.
+
+The deployer uploads a PEX once per site (see site_pattern): the first device
+of the site which needs it is the seed. The other devices of the site copy it
+from the seed, or from a device which already copied it, each source serving
+minion_fanout_degree devices at a time: the PEX spreads as a tree, and crosses
+the WAN about once per site. Each copy is verified against the checksum of the
+PEX. A device which cannot copy the PEX from a peer gets it from the deployer.
+"""
+import asyncio
+from typing import Optional, Tuple
+
+from app.settings import CONF
+from app.utils import get_site
+
+
+class SiteFanOut:  # pylint: disable=R0903
+    """Devices of a site which serve a PEX, and the devices they are serving."""
+
+    def __init__(self) -> None:
+        """Initialize without source."""
+        # hostname -> number of devices copying the PEX from it
+        self.sources: dict[str, int] = {}
+        self.seeding = False
+        self.changed = asyncio.Condition()
+
+
+class FanOut:
+    """Sources of each PEX in each site, shared by the devices of a run."""
+
+    def __init__(self) -> None:
+        """Initialize without source."""
+        # (site, checksum) -> sources
+        self._sites: dict[tuple[str, str], SiteFanOut] = {}
+
+    def reset(self) -> None:
+        """Start a new run: the servers of the previous run may be stopped."""
+        self._sites = {}
+
+    async def acquire(self, hostname: str, checksum: str) -> Tuple[SiteFanOut, Optional[str]]:
+        """Return the sources of the site, and the device to copy the PEX from.
+
+        The device is None if the PEX must be uploaded (seed). Wait until a source
+        can serve one more device, or until the seed failed.
+        """
+        site = self._sites.setdefault((get_site(hostname), checksum), SiteFanOut())
+        async with site.changed:
+            while True:
+                available = [
+                    source
+                    for source, peers in site.sources.items()
+                    if peers < CONF.minion_fanout_degree
+                ]
+                if available:
+                    source = min(available, key=site.sources.__getitem__)
+                    site.sources[source] += 1
+                    return site, source
+
+                if not site.sources and not site.seeding:
+                    site.seeding = True
+                    return site, None
+
+                await site.changed.wait()
+
+    @staticmethod
+    async def release(
+        site: SiteFanOut, hostname: str, source: Optional[str], serving: bool
+    ) -> None:
+        """Release the source of a device, which becomes a source if it serves the PEX."""
+        async with site.changed:
+            if source is None:
+                site.seeding = False
+            elif source in site.sources:
+                site.sources[source] -= 1
+            if serving:
+                site.sources.setdefault(hostname, 0)
+            site.changed.notify_all()
+
+    @staticmethod
+    def discard(site: SiteFanOut, source: str) -> None:
+        """Stop copying the PEX from a source a device failed to copy it from."""
+        site.sources.pop(source, None)
+
+
+FANOUT = FanOut()
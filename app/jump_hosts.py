@@ -0,0 +1,115 @@
+"""Jump hosts (bastions) to reach the devices of some sites.
+
+The jump host of a device is selected by its hostname, or by its site (see
+site_pattern). The connections to the devices behind a jump host are tunneled
+over a few shared upstream connections: one handshake with the jump host per
+jump_host_max_channels devices instead of one per device. Upstream connections
+which are closed (e.g. the jump host restarted) are replaced on next use; they
+are all closed at the end of the run.
+"""
+import asyncio
+from typing import Any, Optional, Tuple
+
+import asyncssh  # type: ignore
+
+from app.logger import get_logger
+from app.settings import CONF
+from app.utils import get_site
+
+LOGGER = get_logger(__name__)
+
+
+def get_jump_host(hostname: str) -> Optional[str]:
+    """Return the jump host of a device, None if it is reached directly."""
+    return CONF.jump_hosts.get(hostname) or CONF.jump_hosts.get(get_site(hostname))
+
+
+def parse_jump_host(jump_host: str) -> Tuple[Optional[str], str, int]:
+    """Return the username, address and port of a "[user@]address[:port]" jump host."""
+    username, _, endpoint = jump_host.rpartition("@")
+    host, _, port = endpoint.rpartition(":")
+    if not host:
+        return username or None, endpoint, 22
+
+    return username or None, host, int(port)
+
+
+class Upstream:  # pylint: disable=R0903
+    """Connection to a jump host, and the number of devices tunneled over it."""
+
+    def __init__(self, conn: asyncssh.SSHClientConnection) -> None:
+        """Initialize without tunneled device."""
+        self.conn = conn
+        self.channels = 0
+
+
+class JumpHostPool:
+    """Upstream connections to the jump hosts, shared by the devices of a run."""
+
+    def __init__(self) -> None:
+        """Initialize without upstream connection, they are opened on first use."""
+        self._upstreams: dict[str, list[Upstream]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def _open(self, jump_host: str) -> Upstream:
+        username, host, port = parse_jump_host(jump_host)
+        LOGGER.info("opening a connection to jump host %s", jump_host)
+        options: dict[str, Any] = {"known_hosts": None, "login_timeout": 10}
+        if username:
+            options["username"] = username
+        if CONF.jump_host_password:
+            options["password"] = CONF.jump_host_password
+        return Upstream(await asyncssh.connect(host, port, **options))
+
+    async def acquire(self, jump_host: str) -> Upstream:
+        """Return an upstream connection with a free channel, open one if needed."""
+        lock = self._locks.setdefault(jump_host, asyncio.Lock())
+        # the devices wait for a single new upstream rather than opening one each
+        async with lock:
+            upstreams = [
+                upstream
+                for upstream in self._upstreams.get(jump_host, [])
+                if not upstream.conn.is_closed()
+            ]
+            upstream = next(
+                (item for item in upstreams if item.channels < CONF.jump_host_max_channels), None
+            )
+            if upstream is None:
+                upstream = await self._open(jump_host)
+                upstreams.append(upstream)
+            self._upstreams[jump_host] = upstreams
+            upstream.channels += 1
+            return upstream
+
+    @staticmethod
+    def release(upstream: Upstream) -> None:
+        """Free the channel of a device which is disconnected."""
+        upstream.channels -= 1
+
+    async def connect(
+        self, jump_host: str, host: str, port: int, **kwargs: Any
+    ) -> Tuple[asyncssh.SSHClientConnection, Upstream]:
+        """Connect to a device through a jump host, see asyncssh.connect() for the arguments.
+
+        The upstream must be released when the device is disconnected.
+        """
+        upstream = await self.acquire(jump_host)
+        try:
+            conn = await asyncssh.connect(host, port, tunnel=upstream.conn, **kwargs)
+        except BaseException:
+            self.release(upstream)
+            raise
+
+        return conn, upstream
+
+    async def close(self) -> None:
+        """Close all upstream connections."""
+        upstreams = [upstream for items in self._upstreams.values() for upstream in items]
+        self._upstreams = {}
+        self._locks = {}
+        for upstream in upstreams:
+            upstream.conn.close()
+        await asyncio.gather(*(upstream.conn.wait_closed() for upstream in upstreams))
+
+
+JUMP_HOSTS = JumpHostPool()
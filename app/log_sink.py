@@ -0,0 +1,72 @@
+"""Output of the logs recorded per device by FutureLogger.
+
+The logs of a device are flushed as one block as soon as the device is done, so
+memory only holds the logs of the devices in progress and blocks are not
+interleaved.
+"""
+import json
+import logging
+import os
+import sys
+from typing import Any, Optional
+
+from futurelog import FutureLogger
+
+
+class DeviceLogSink:
+    """Flush the logs of one device to the logging stream, to JSON lines or to files."""
+
+    def __init__(self, directory: Optional[str] = None, log_format: str = "text") -> None:
+        """Initialize the sink.
+
+        :param directory: write the logs of each device in its own file in this directory
+        :param log_format: "text" or "json" (one JSON object per line)
+        """
+        self.directory = directory
+        self.log_format = log_format
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _pop_logs(hostname: str) -> list:
+        """Remove the logs of the device from all loggers, sorted by time."""
+        logs = []
+        for future_logger in FutureLogger.ALL_LOGGERS:
+            logs.extend(future_logger.logs.pop(hostname, []))
+
+        return sorted(logs, key=lambda log: log.time)
+
+    def _format(self, hostname: str, log: Any) -> str:
+        message = log.msg % log.args if log.args else str(log.msg)
+        if self.log_format == "json":
+            return json.dumps(
+                {
+                    "time": log.time,
+                    "hostname": hostname,
+                    "logger": log.logger.name,
+                    "level": logging.getLevelName(log.level),
+                    "message": message,
+                }
+            )
+
+        return f"{logging.getLevelName(log.level)} - {log.logger.name}: {message}"
+
+    def flush(self, hostname: str) -> None:
+        """Output all the logs of a device at once."""
+        if not self.directory and self.log_format == "text":
+            FutureLogger.consume_all_logger_for(hostname)
+            return
+
+        logs = self._pop_logs(hostname)
+        lines = [self._format(hostname, log) for log in logs if log.logger.isEnabledFor(log.level)]
+        block = "".join(f"{line}\n" for line in lines)
+
+        if self.directory:
+            extension = "jsonl" if self.log_format == "json" else "log"
+            with open(
+                f"{self.directory}/{hostname}.{extension}", "w", encoding="utf-8"
+            ) as log_file:
+                log_file.write(block)
+        else:
+            sys.stdout.write(block)
+            sys.stdout.flush()
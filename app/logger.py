@@ -1,7 +1,13 @@
-"""Logger helper."""
+"""Logger helper.
+
+Loggers are created when modules are imported, but logging is configured once,
+by the entrypoint, with the level of the settings (see configure_logging).
+"""
 import logging
 import logging.config
 
+from futurelog import FutureLogger
+
 from app.settings import CONF
 
 LOGGING_CONFIG = {
@@ -23,9 +29,19 @@ LOGGING_CONFIG = {
 }
 
 
+# loggers of the application, their level is set by configure_logging
+LOGGERS: list[logging.Logger] = []
+
+
 def get_logger(name: str) -> "logging.Logger":
-    """Provide already configured logger."""
-    logging.config.dictConfig(LOGGING_CONFIG)
+    """Provide a logger, configured by configure_logging."""
     logger = logging.getLogger(name.split(".").pop())
-    logger.setLevel(CONF.log_level)
+    LOGGERS.append(logger)
     return logger
+
+
+def configure_logging() -> None:
+    """Configure logging, and the level of the loggers of the application."""
+    logging.config.dictConfig(LOGGING_CONFIG)
+    for logger in LOGGERS + [future_logger.logger for future_logger in FutureLogger.ALL_LOGGERS]:
+        logger.setLevel(CONF.log_level)
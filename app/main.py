@@ -1,17 +1,18 @@
 """Start deployment on all devices."""
+import argparse
 import asyncio
 import getpass
-import os
 import signal
 import sys
-from typing import Any, Dict, List
+import time
+from typing import Dict, List, Optional, Union
 
-import coloredlogs  # type: ignore
-import jq  # type: ignore
+import asyncssh  # type: ignore
 from futurelog import FutureLogger
 from prometheus_client import start_http_server  # type: ignore
 
 from app import utils
+from app.credentials import StaticCredentials, VaultCredentials
 from app.deployers import (
     ConfigDeployer,
     GrainsDeployer,
@@ -19,13 +20,29 @@ from app.deployers import (
     SystemdDeployer,
 )
 from app.device import Device
-from app.exceptions import APIException, DeviceConnectionException
+from app.drain import DRAIN
+from app.exceptions import (
+    APIException,
+    DeviceConnectionException,
+    DeviceTimeoutException,
+)
 from app.exceptions.config_exception import InvalidConfiguration
-from app.logger import get_logger
+from app.fanout import FANOUT
+from app.jump_hosts import JUMP_HOSTS
+from app.log_sink import DeviceLogSink
+from app.logger import configure_logging, get_logger
+from app.metrics import DEVICES_PER_SECOND, RUN_DURATION, TIMEOUTS, export_metrics
+from app.plan import DevicePlan, desired_state, load_plans, save_plans
+from app.profiling import peak_rss_mib, run_profiled
+from app.reload import RELOADER
+from app.report import DeviceResult, RunReport
+from app.retry import COMMAND_RETRY, DEVICE_RETRY, is_transient
+from app.scheduler import SCHEDULER
 from app.settings import CONF
+from app.tracing import TRACER
 
 LOGGER = get_logger(__name__)
-FUTURE_LOGGER = FutureLogger(__name__, CONF.log_level)
+FUTURE_LOGGER = FutureLogger(__name__)
 
 
 DEFAULT_PASSWORD_SUFFIX = "_default"
@@ -39,6 +56,8 @@ def get_all_devices() -> list[str]:
         LOGGER.error("unable to get devices list: %s", error)
         return []
 
+    import jq  # type: ignore # noqa: PLC0415
+
     try:
         devices = jq.compile(CONF.inventory_filter).input(data).all()  # pylint: disable=I1101
     except SyntaxError as error:
@@ -57,7 +76,7 @@ def get_all_devices() -> list[str]:
     return devices
 
 
-def prepare_deployers() -> None:
+async def prepare_deployers() -> None:
     """Prepare all deployers."""
     # Download minion pex
     LOGGER.info("Downloading salt-minion pex files")
@@ -70,15 +89,71 @@ def prepare_deployers() -> None:
 
     # Prepare configuration
     LOGGER.info("Resolving DNS forwarders hostnames are valid")
-    ConfigDeployer.prepare()
+    await ConfigDeployer.prepare()
+
+
+async def deploy_on_device(
+    hostname: str,
+    credentials: Dict,
+    plans: Dict[str, DevicePlan],
+    result: Optional[DeviceResult] = None,
+) -> bool:
+    """Deploy salt minion on one device.
+
+    :param plans: plans reused from a previous dry-run, by hostname. The plan of
+        the device is added or updated.
+    :param result: filled with the outcome of the deployment, for the run report
+    """
+    result = result or DeviceResult(hostname=hostname)
+    with TRACER.span("deploy_on_device", hostname):
+        status = await _deploy_on_device(hostname, credentials, plans, result)
+
+    if result.failure:
+        result.outcome = "failed"
+    elif CONF.dry_run:
+        result.outcome = "already_deployed" if status else "to_deploy"
+    elif result.outcome not in ("already_deployed", "skipped"):
+        result.outcome = "succeeded" if status else "failed"
+
+    return status
 
 
-async def deploy_on_device(hostname: str, credentials: Dict) -> bool:
-    """Deploy salt minion on one device."""
+async def _deploy_on_device(
+    hostname: str, credentials: Dict, plans: Dict[str, DevicePlan], result: DeviceResult
+) -> bool:
     FUTURE_LOGGER.warning(hostname, "********* %s *********", hostname)
+    plan = plans.get(hostname)
+
+    # the plan says everything is already deployed: no need to connect
+    if plan and plan.fingerprint != desired_state(plan.sonic_version):
+        FUTURE_LOGGER.info(hostname, "ignoring the plan: the desired state changed")
+        plan = None
+    if plan and plan.ready and not CONF.dry_run:
+        FUTURE_LOGGER.warning(hostname, "minion is already installed (planned)")
+        result.outcome = "already_deployed"
+        result.sonic_version = plan.sonic_version
+        return True
+
     device = Device(hostname)
+    try:
+        return await _deploy_with_connection(device, credentials, plans, plan, result)
+    finally:
+        # the deployment may have been interrupted: do not leave the connection open
+        device.ssh.abort()
+        result.add_stats(device.ssh.stats)
+
+
+async def _deploy_with_connection(
+    device: Device,
+    credentials: Dict,
+    plans: Dict[str, DevicePlan],
+    plan: Optional[DevicePlan],
+    result: DeviceResult,
+) -> bool:
+    hostname = device.hostname
 
     # Try to connect with one user in the list
+    connection_error = None
     for user, password in credentials.items():
         if user.endswith(DEFAULT_PASSWORD_SUFFIX):
             user = user[: -len(DEFAULT_PASSWORD_SUFFIX)]  # noqa: PLW2901
@@ -93,20 +168,29 @@ async def deploy_on_device(hostname: str, credentials: Dict) -> bool:
             FUTURE_LOGGER.error(
                 hostname, "Unable to connect to %s with user '%s': %s", device.hostname, user, error
             )
+            connection_error = error
 
     if not device.connected:
+        # e.g. a connection reset: the device may be reachable a bit later
+        if connection_error and is_transient(connection_error):
+            raise connection_error
+        result.failure = "connection"
         return False
+    result.sonic_version = device.sonic_version
 
-    FUTURE_LOGGER.warning(hostname, "checking if minion needs to be installed")
-    ready = await device.is_salt_ready()
+    # SONiC may have been upgraded since the plan was made
+    if plan is None or plan.sonic_version != device.sonic_version:
+        FUTURE_LOGGER.warning(hostname, "checking if minion needs to be installed")
+        plan = await device.plan(CONF.force)
+        plans[hostname] = plan
 
     if CONF.dry_run:
-        status = ready
-    elif CONF.force or not ready:
-        FUTURE_LOGGER.warning(hostname, "starting deployment")
-        status = await device.deploy_salt(CONF.force)
+        status = plan.ready
+    elif plan.actions:
+        status = await _apply_plan(device, plan, result)
     else:
         FUTURE_LOGGER.warning(hostname, "minion is already installed")
+        result.outcome = "already_deployed"
         status = True
 
     await device.disconnect()
@@ -114,6 +198,29 @@ async def deploy_on_device(hostname: str, credentials: Dict) -> bool:
     return status
 
 
+async def _apply_plan(device: Device, plan: DevicePlan, result: DeviceResult) -> bool:
+    hostname = device.hostname
+    if DRAIN.requested:
+        FUTURE_LOGGER.warning(hostname, "drain requested: deployment not started")
+        result.outcome = "skipped"
+        return False
+
+    FUTURE_LOGGER.warning(hostname, "starting deployment of %s", ", ".join(plan.actions))
+    status = await device.apply(plan)
+    result.changed = [
+        name for name, state in device.component_status.items() if state == "deployed"
+    ]
+    result.failed = [name for name, state in device.component_status.items() if state == "failed"]
+    if not status and DRAIN.requested and not result.failed:
+        # the components not started yet were skipped by the drain
+        FUTURE_LOGGER.warning(hostname, "drain requested: deployment interrupted")
+        result.outcome = "skipped"
+    elif not status:
+        result.failure = "deployment"
+
+    return status
+
+
 def print_result(succeeded: List, failed: List) -> None:
     """Print deployment results."""
     if CONF.dry_run:
@@ -123,8 +230,9 @@ def print_result(succeeded: List, failed: List) -> None:
         ok_msg = "succeeded"
         nok_msg = "failed"
 
-    LOGGER.info("%s: %s", ok_msg, succeeded)
-    LOGGER.info("%s: %s", nok_msg, failed)
+    # see the run report for per-device results
+    LOGGER.debug("%s: %s", ok_msg, succeeded)
+    LOGGER.debug("%s: %s", nok_msg, failed)
 
     LOGGER.warning(
         "********* FINISHED (%s: %s, %s: %s) *********",
@@ -135,97 +243,142 @@ def print_result(succeeded: List, failed: List) -> None:
     )
 
 
-async def start_deployment(credentials: Dict, devices: List) -> None:
-    """Start the deployment."""
+def _load_plans() -> Dict[str, DevicePlan]:
+    """Load plans of a previous dry-run, to skip the check phase."""
+    if not CONF.plan_file or CONF.dry_run or CONF.force:
+        return {}
+
+    return load_plans(CONF.plan_file, CONF.plan_max_age)
+
+
+async def _deploy_and_flush_logs(  # noqa: PLR0913
+    hostname: str,
+    credentials: Dict,
+    plans: Dict[str, DevicePlan],
+    log_sink: DeviceLogSink,
+    report: RunReport,
+) -> bool:
+    """Deploy on one device, then output its logs and its result right away."""
+    result = DeviceResult(hostname=hostname)
+    start = time.perf_counter()
+
+    async def attempt() -> bool:
+        result.attempts += 1
+        return await deploy_on_device(hostname, credentials, plans, result)
+
+    try:
+        async with SCHEDULER.slot(hostname):
+            result.queued = time.perf_counter() - start
+            start = time.perf_counter()
+            if DRAIN.requested:
+                result.outcome = "skipped"
+                return False
+            return await asyncio.wait_for(DEVICE_RETRY.run(hostname, attempt), CONF.device_timeout)
+    except DeviceTimeoutException as error:
+        FUTURE_LOGGER.error(hostname, error)
+        result.outcome = result.failure = "timeout"
+        return False
+    except asyncio.TimeoutError:
+        TIMEOUTS.labels("device").inc()
+        FUTURE_LOGGER.error(hostname, "deployment aborted after %ss", CONF.device_timeout)
+        result.outcome = result.failure = "timeout"
+        return False
+    except (RuntimeError, asyncssh.Error) as error:
+        FUTURE_LOGGER.error(hostname, error)
+        result.outcome = "failed"
+        result.failure = type(error).__name__
+        return False
+    except asyncio.CancelledError:
+        if result.attempts:
+            # cancelled by the drain deadline: the connection has been aborted
+            FUTURE_LOGGER.error(hostname, "deployment cancelled")
+            result.outcome = result.failure = "cancelled"
+        else:
+            # cancelled by the drain deadline while waiting for a slot
+            result.outcome = "skipped"
+        return False
+    finally:
+        result.duration = time.perf_counter() - start
+        report.add(result)
+        # consume all logs for current device
+        log_sink.flush(hostname)
+
+
+async def start_deployment(credentials: Dict[str, Dict], devices: List) -> None:
+    """Start the deployment.
+
+    :param credentials: credentials of each device, username -> password
+    """
+    plans = _load_plans()
+    TRACER.enabled = bool(CONF.trace_file)
+    log_sink = DeviceLogSink(CONF.device_log_directory, CONF.device_log_format)
+    COMMAND_RETRY.reset()
+    DEVICE_RETRY.reset()
+    DRAIN.reset()
+    FANOUT.reset()
+    SCHEDULER.reset()
+    report = RunReport(CONF.report_file, CONF.report_csv_file, CONF.report_top_n)
+
     # deploy
     LOGGER.warning("Starting deployment")
+    start = time.perf_counter()
     tasks = {}
-    wait_tasks = []
     for hostname in devices:
-        task = asyncio.ensure_future(deploy_on_device(hostname, credentials))
-        wait_tasks.append(task)
-        tasks[hostname] = task
+        tasks[hostname] = asyncio.ensure_future(
+            _deploy_and_flush_logs(hostname, credentials[hostname], plans, log_sink, report)
+        )
+    DRAIN.track(tasks.values())
 
-    done, _ = await asyncio.wait(wait_tasks, return_when=asyncio.ALL_COMPLETED)
+    await asyncio.wait(tasks.values(), return_when=asyncio.ALL_COMPLETED)
+    await JUMP_HOSTS.close()
 
     # get result
     failed = []
     succeeded = []
     for hostname, task in tasks.items():
-        if task not in done:
-            raise RuntimeError("A task was incomplete, it should not have happen.")
-
-        try:
-            status = await task
-        except RuntimeError as error:
-            FUTURE_LOGGER.error(hostname, error)
-            status = False
-
-        if status:
+        if not task.cancelled() and task.result():
             succeeded.append(hostname)
         else:
             failed.append(hostname)
 
-        # consume all logs for current device
-        FutureLogger.consume_all_logger_for(hostname)
-
     # consume logs
     FutureLogger.consume_all_logger()
+    report.close()
 
-    print_result(succeeded, failed)
-
-
-def stop_request(_: int, __: Any) -> None:
-    """Stop handler for SIGTERM.
-
-    :param signum: signal number
-    :param frame: None or a frame object. Represents execution frames
-    """
-    if not utils.in_progress:
-        # we restart directly if there is no job in progress
-        LOGGER.warning("Process %i exiting...", os.getpid())
-        sys.exit(0)
-    else:
-        utils.stop_requested = True
+    duration = time.perf_counter() - start
+    RUN_DURATION.set(duration)
+    DEVICES_PER_SECOND.set(len(devices) / duration if duration else 0)
+    export_metrics(devices)
 
+    if CONF.trace_file:
+        TRACER.export(CONF.trace_file, CONF.trace_format)
 
-def interruption_request(_: int, __: Any) -> None:
-    """Stop handler for SIGTERM.
+    if CONF.dry_run and CONF.plan_file:
+        save_plans(CONF.plan_file, plans)
 
-    :param signum: signal number
-    :param frame: None or a frame object. Represents execution frames
-    """
-    LOGGER.warning("Process %i exiting...", os.getpid())
-    sys.exit(0)
+    print_result(succeeded, failed)
 
 
-def _get_credentials() -> dict[str, str]:
+def _get_credentials() -> Union[StaticCredentials, VaultCredentials]:
     if CONF.is_vault_enabled():
-        path = CONF.vault_secret_path
-        credentials = utils.get_passwords(
-            CONF.vault_device_usernames, path, kv_v2=True, mount_point="devices"
-        )
-    elif CONF.username and CONF.password:
-        credentials = {CONF.username: CONF.password}
-    else:
-        user = input("Username: ")
-        credentials = {
-            user: getpass.getpass(prompt="Password: ", stream=None),
-        }
+        return VaultCredentials()
 
-    return credentials
+    if CONF.username and CONF.password:
+        return StaticCredentials({CONF.username: CONF.password})
+
+    user = input("Username: ")
+    return StaticCredentials({user: getpass.getpass(prompt="Password: ", stream=None)})
 
 
 async def start_app() -> None:
     """Prepare environment and start deployment."""
-    signal.signal(signal.SIGTERM, stop_request)
-    signal.signal(signal.SIGINT, stop_request)
-
     # pretty logging
     if CONF.pretty_logs:
+        import coloredlogs  # type: ignore # noqa: PLC0415
+
         coloredlogs.install(fmt="%(name)s\t\t%(levelname)s\t\t%(message)s")
 
-    credentials = _get_credentials()
+    provider = _get_credentials()
     devices = CONF.devices or get_all_devices()
 
     if not devices:
@@ -238,14 +391,69 @@ async def start_app() -> None:
     if CONF.dry_run:
         LOGGER.warning("Dry-run mode enabled")
 
-    prepare_deployers()
+    # credentials are read while the deployers are prepared
+    try:
+        credentials, _ = await asyncio.gather(provider.get_all(devices), prepare_deployers())
+    finally:
+        # not needed during the deployment, which may outlast the Vault token
+        await asyncio.to_thread(provider.close)
+
+    # until now, a signal stops the process: nothing is in progress
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, DRAIN.request)
+    loop.add_signal_handler(signal.SIGINT, DRAIN.request)
+    loop.add_signal_handler(signal.SIGHUP, RELOADER.request)
 
     await start_deployment(credentials, devices)
 
 
+def install_uvloop() -> None:
+    """Use uvloop as event loop, if available."""
+    try:
+        import uvloop  # type: ignore # noqa: PLC0415
+    except ImportError:
+        LOGGER.warning("uvloop is not installed, using the default event loop")
+        return
+
+    uvloop.install()
+    LOGGER.info("uvloop event loop enabled")
+
+
+def _parse_args() -> argparse.Namespace:
+    """Parse command line arguments, the configuration comes from the settings."""
+    parser = argparse.ArgumentParser(description="Deploy Salt on SONiC devices.")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="sonic-salt-deployer.pstats",
+        default=CONF.profile_file,
+        metavar="FILE",
+        help="profile the run and write pstats to FILE (default: %(const)s)",
+    )
+    parser.add_argument(
+        "--slow-callback-duration",
+        type=float,
+        default=CONF.slow_callback_duration,
+        metavar="SECONDS",
+        help="when profiling, log what blocks the event loop longer than SECONDS",
+    )
+    return parser.parse_args()
+
+
 def main():
     """Entrypoint."""
-    asyncio.run(start_app())
+    args = _parse_args()
+    configure_logging()
+
+    if CONF.uvloop:
+        install_uvloop()
+
+    if args.profile:
+        run_profiled(start_app, args.profile, args.slow_callback_duration)
+    else:
+        asyncio.run(start_app())
+
+    LOGGER.info("peak RSS: %.1f MiB", peak_rss_mib())
 
 
 if __name__ == "__main__":
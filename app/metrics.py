@@ -1,8 +1,180 @@
 """Prometheus metrics."""
-from prometheus_client import Gauge  # type: ignore
+import time
+from collections import Counter as CountDict
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+from urllib.error import URLError
+
+from prometheus_client import (  # type: ignore
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    push_to_gateway,
+    write_to_textfile,
+)
+
+from app.logger import get_logger
+from app.settings import CONF
+
+LOGGER = get_logger(__name__)
 
 DEPLOYMENT_STATUS = Gauge(
     "sonic_salt_minion_deployment_status",
     "Deployment of Salt status on SONiC devices: -1 = failed, 0 = waiting, 1 = updated",
     ["hostname", "salt_pex_build_version"],
 )
+
+##
+# Aggregates, with a low cardinality for dashboards
+##
+STATUS_NAMES = {-1: "failed", 0: "waiting", 1: "updated"}
+DEPLOYMENT_STATUS_DEVICES = Gauge(
+    "sonic_salt_minion_deployment_status_devices",
+    "Number of SONiC devices per deployment status",
+    ["status"],
+)
+SONIC_VERSION_DEVICES = Gauge(
+    "sonic_salt_deployer_sonic_version_devices",
+    "Number of SONiC devices per SONiC version",
+    ["sonic_version"],
+)
+
+# hostname -> (sonic_version, status): last known state of each device
+_DEVICES: dict[str, tuple[str, int]] = {}
+_STATUS_COUNT: CountDict = CountDict()
+_VERSION_COUNT: CountDict = CountDict()
+
+##
+# Performance, recorded by app.connection.DeviceConnection
+##
+PHASE_DURATION = Histogram(
+    "sonic_salt_deployer_phase_duration_seconds",
+    "Duration of the deployment phases on one device: "
+    "connect, version, check, deploy, upload and restart",
+    ["phase", "component"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+SSH_COMMANDS = Counter(
+    "sonic_salt_deployer_ssh_commands",
+    "Number of commands run on the devices through SSH",
+    ["component"],
+)
+UPLOADED_BYTES = Counter(
+    "sonic_salt_deployer_uploaded_bytes",
+    "Number of bytes uploaded to the devices",
+    ["component"],
+)
+RETRIES = Counter(
+    "sonic_salt_deployer_retries",
+    "Number of retries of transient failures: command or device (reconnection)",
+    ["level"],
+)
+TIMEOUTS = Counter(
+    "sonic_salt_deployer_timeouts",
+    "Number of operations aborted by the watchdog: command, upload or device",
+    ["operation"],
+)
+
+##
+# Run
+##
+RUN_DURATION = Gauge(
+    "sonic_salt_deployer_run_duration_seconds",
+    "Duration of the last deployment run",
+)
+DEVICES_PER_SECOND = Gauge(
+    "sonic_salt_deployer_devices_per_second",
+    "Number of devices handled per second during the last deployment run",
+)
+
+
+@contextmanager
+def measure(phase: str, component: str) -> Iterator[dict[str, float]]:
+    """Measure the duration of a phase.
+
+    The yielded dict gets the duration, in seconds, under the "duration" key.
+    """
+    result = {"duration": 0.0}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["duration"] = time.perf_counter() - start
+        PHASE_DURATION.labels(phase, component).observe(result["duration"])
+
+
+def _update_count(counts: CountDict, gauge: Gauge, label: str, increment: int) -> None:
+    """Update an aggregate, its series is removed when no device is left."""
+    counts[label] += increment
+    if counts[label] > 0:
+        gauge.labels(label).set(counts[label])
+    else:
+        del counts[label]
+        gauge.remove(label)
+
+
+def _forget_device(hostname: str) -> None:
+    """Remove a device from the aggregates and remove its series."""
+    sonic_version, status = _DEVICES.pop(hostname)
+    _update_count(_STATUS_COUNT, DEPLOYMENT_STATUS_DEVICES, STATUS_NAMES[status], -1)
+    _update_count(_VERSION_COUNT, SONIC_VERSION_DEVICES, sonic_version, -1)
+    try:
+        DEPLOYMENT_STATUS.remove(hostname, sonic_version)
+    except KeyError:
+        # per-host series disabled
+        pass
+
+
+def set_deployment_status(hostname: str, sonic_version: str, status: int) -> None:
+    """Set the deployment status of a device.
+
+    If the SONiC version of the device changed, the series of the old version is removed.
+    """
+    if hostname in _DEVICES:
+        _forget_device(hostname)
+
+    _DEVICES[hostname] = (sonic_version, status)
+    _update_count(_STATUS_COUNT, DEPLOYMENT_STATUS_DEVICES, STATUS_NAMES[status], 1)
+    _update_count(_VERSION_COUNT, SONIC_VERSION_DEVICES, sonic_version, 1)
+
+    if CONF.prometheus_per_host_metrics:
+        DEPLOYMENT_STATUS.labels(hostname, sonic_version).set(status)
+
+
+def prune_deployment_status(hostnames: Iterable[str]) -> None:
+    """Remove the devices which are not in the inventory anymore."""
+    inventory = set(hostnames)
+    for hostname in list(_DEVICES):
+        if hostname not in inventory:
+            _forget_device(hostname)
+
+
+def export_metrics(hostnames: Iterable[str]) -> None:
+    """Export the metrics of a run to a textfile collector and/or a Pushgateway.
+
+    The HTTP server only lives as long as the run, so metrics of timer-driven runs
+    may never be scraped.
+
+    :param hostnames: devices of the inventory, the series of other devices are removed
+    """
+    prune_deployment_status(hostnames)
+
+    # for node_exporter textfile collector: written in a temporary file, then renamed
+    if CONF.prometheus_textfile_path:
+        try:
+            write_to_textfile(CONF.prometheus_textfile_path, REGISTRY)
+        except OSError as error:
+            LOGGER.error("unable to write metrics to %s: %s", CONF.prometheus_textfile_path, error)
+
+    # PUT replaces all the series of the job: series of removed devices are dropped too
+    if CONF.prometheus_pushgateway_url:
+        try:
+            push_to_gateway(
+                CONF.prometheus_pushgateway_url,
+                job=CONF.prometheus_pushgateway_job,
+                registry=REGISTRY,
+                timeout=30,
+            )
+        except (OSError, URLError) as error:
+            LOGGER.error("unable to push metrics to %s: %s", CONF.prometheus_pushgateway_url, error)
@@ -0,0 +1,102 @@
+"""Deployment plans.
+
+The check phase produces one plan per device: the state of each component and
+the components to deploy. The apply phase deploys from the plan without
+checking the device again.
+
+A plan is only reused for the desired state it was made for: a new PEX, new
+units or a new configuration make it stale.
+"""
+import hashlib
+import json
+import os
+import time
+
+from pydantic import BaseModel, ValidationError
+
+from app.deployers import (
+    ConfigDeployer,
+    GrainsDeployer,
+    MinionDeployer,
+    SystemdDeployer,
+)
+from app.deployers.systemd import get_units
+from app.logger import get_logger
+from app.settings import CONF
+
+LOGGER = get_logger(__name__)
+
+
+class DevicePlan(BaseModel):
+    """Immutable result of the check phase for one device."""
+
+    hostname: str
+    sonic_version: str
+    minion_rollout: str = "direct"
+    # (component name, True if already deployed)
+    components: tuple[tuple[str, bool], ...]
+    # components to deploy, ordered by dependencies
+    actions: tuple[str, ...]
+    created_at: float
+    # desired state the plan was made for, see desired_state()
+    fingerprint: str = ""
+
+    class Config:  # pylint: disable=R0903
+        """Pydantic settings."""
+
+        frozen = True
+
+    @property
+    def ready(self) -> bool:
+        """Return if Salt is properly installed."""
+        return bool(self.components) and all(deployed for _, deployed in self.components)
+
+
+def desired_state(sonic_version: str) -> str:
+    """Return a fingerprint of what the deployers deploy on a device of a SONiC version."""
+    state = {
+        "minion_rollout": CONF.minion_rollout,
+        "minion": MinionDeployer.checksum_sha256.get(sonic_version, ""),
+        "units": {name: SystemdDeployer.sha256.get(name, "") for name in get_units()},
+        "grains": GrainsDeployer.sha256.get("update_grains", ""),
+        "resolv_conf": getattr(ConfigDeployer, "resolv_conf", ""),
+        "minion_config": CONF.minion_config,
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+
+class PlanFile(BaseModel):
+    """Plans of a dry-run, exported to be reused by the next run."""
+
+    created_at: float
+    plans: dict[str, DevicePlan]
+
+
+def save_plans(path: str, plans: dict[str, DevicePlan]) -> None:
+    """Save plans atomically to a JSON file."""
+    plan_file = PlanFile(created_at=time.time(), plans=plans)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as tmp_file:
+        tmp_file.write(plan_file.json())
+    os.replace(tmp_path, path)
+
+    LOGGER.info("%i plans saved to %s", len(plans), path)
+
+
+def load_plans(path: str, max_age: int) -> dict[str, DevicePlan]:
+    """Load plans from a JSON file, if it is recent enough."""
+    try:
+        plan_file = PlanFile.parse_file(path)
+    except FileNotFoundError:
+        return {}
+    except ValidationError as error:
+        LOGGER.warning("ignoring invalid plan file %s: %s", path, error)
+        return {}
+
+    age = time.time() - plan_file.created_at
+    if age > max_age:
+        LOGGER.warning("ignoring plan file %s: too old (%i seconds)", path, age)
+        return {}
+
+    LOGGER.info("reusing %i plans from %s", len(plan_file.plans), path)
+    return plan_file.plans
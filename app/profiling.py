@@ -0,0 +1,63 @@
+"""Profiling of the deployer process.
+
+The profile is written in pstats format: open it with snakeviz, or convert it to
+a flamegraph with flameprof or gprof2dot.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import resource
+import sys
+from typing import Any, Callable, Coroutine
+
+from app.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+
+def peak_rss_mib() -> float:
+    """Return the peak resident set size of the process, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+
+    return peak / 1024
+
+
+def enable_slow_callback_detection(threshold: float) -> None:
+    """Log callbacks and coroutine steps blocking the event loop longer than threshold.
+
+    asyncio logs the blocking task and its coroutine, e.g. a synchronous requests.get().
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+
+
+def run_profiled(
+    app: Callable[[], Coroutine[Any, Any, None]], output: str, slow_callback_duration: float
+) -> None:
+    """Run the app under cProfile, in asyncio debug mode, and save the profile.
+
+    :param app: coroutine function to run
+    :param output: pstats output file
+    :param slow_callback_duration: threshold in seconds to log slow callbacks
+    """
+
+    async def debugged_app() -> None:
+        enable_slow_callback_detection(slow_callback_duration)
+        await app()
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(asyncio.run, debugged_app())
+    finally:
+        profiler.dump_stats(output)
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(20)
+        LOGGER.info("profile saved to %s, top functions:\n%s", output, summary.getvalue())
@@ -0,0 +1,164 @@
+"""Reload of the settings on SIGHUP, without restarting the process.
+
+The settings are read again (settings.env, settings.json, environment) and
+updated in place, so every module sees the new values. Only the prepared state
+which depends on a changed setting is rebuilt, e.g. /etc/resolv.conf when the
+DNS resolvers change, or the PEX files and their checksums when their location
+changes: the other PEX files, checksums and the open SSH connections are kept.
+
+The new settings apply to the checks and deployments which start after the
+reload: devices already checked keep their plan.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Optional, Union
+
+from pydantic import ValidationError
+
+from app.deployers import ConfigDeployer, MinionDeployer
+from app.exceptions.config_exception import InvalidConfiguration
+from app.logger import get_logger
+from app.settings import CONF, Settings
+
+LOGGER = get_logger(__name__)
+
+# settings of the whole run, read once at start or which would mix devices deployed
+# with the old and the new values: they are not reloaded
+RUN_SETTINGS = frozenset(
+    {
+        "prometheus_listen_port",
+        "uvloop",
+        "log_level",
+        "pretty_logs",
+        "profile_file",
+        "slow_callback_duration",
+        "inventory_url",
+        "inventory_filter",
+        "devices",
+        "username",
+        "password",
+        "vault_url",
+        "vault_login",
+        "vault_password",
+        "vault_secret_path",
+        "vault_device_usernames",
+        "site_pattern",
+        "jump_hosts",
+        "jump_host_password",
+        "jump_host_max_channels",
+        "minion_fanout",
+        "minion_fanout_degree",
+        "minion_fanout_port",
+        "minion_fanout_serve_time",
+        "dry_run",
+        "force",
+        "minion_rollout",
+        "plan_file",
+        "plan_max_age",
+        "report_file",
+        "report_csv_file",
+        "report_top_n",
+        "device_log_directory",
+        "device_log_format",
+        "trace_file",
+        "trace_format",
+    }
+)
+
+Prepare = Callable[[], Union[None, Awaitable[None]]]
+
+# prepared state, and the settings it depends on
+PREPARED_STATE: tuple[tuple[Prepare, frozenset[str]], ...] = (
+    (
+        MinionDeployer.download_minions,
+        frozenset(
+            {"sonic_versions", "minion_files_local_directory", "minion_files_nexus_location"}
+        ),
+    ),
+    (
+        ConfigDeployer.prepare,
+        frozenset({"dns_resolvers", "resolve_dns_resolvers_hostname", "dns_cache_file"}),
+    ),
+)
+
+
+def changed_settings(settings: Settings) -> dict[str, Any]:
+    """Return the settings which differ from the current ones, with their new value."""
+    return {name: value for name, value in settings.dict().items() if value != getattr(CONF, name)}
+
+
+def _affected_state(changes: dict[str, Any]) -> list[Prepare]:
+    """Return the preparations of the state which depends on the changed settings."""
+    return [prepare for prepare, settings in PREPARED_STATE if settings & changes.keys()]
+
+
+async def _prepare(prepare: Prepare) -> None:
+    LOGGER.info("settings reload: %s", prepare.__qualname__)
+    if asyncio.iscoroutinefunction(prepare):
+        await prepare()
+    else:
+        # downloads must not block the deployments in progress
+        await asyncio.to_thread(prepare)
+
+
+async def reload_settings() -> list[str]:
+    """Read the settings again and apply the changes, return the changed settings.
+
+    If the new settings are invalid or the prepared state cannot be rebuilt, the
+    previous settings and state are kept.
+    """
+    try:
+        settings = await asyncio.to_thread(Settings)
+    except (ValidationError, InvalidConfiguration, OSError) as error:
+        LOGGER.error("settings not reloaded: %s", error)
+        return []
+
+    changes = changed_settings(settings)
+    ignored = sorted(changes.keys() & RUN_SETTINGS)
+    if ignored:
+        LOGGER.warning("settings not reloaded, restart needed: %s", ", ".join(ignored))
+    for name in ignored:
+        del changes[name]
+    if not changes:
+        LOGGER.warning("settings reloaded: no change")
+        return []
+
+    previous = {name: getattr(CONF, name) for name in changes}
+    for name, value in changes.items():
+        setattr(CONF, name, value)
+    # the state is replaced only once rebuilt, so a failure leaves it unchanged
+    prepared = []
+    try:
+        for prepare in _affected_state(changes):
+            await _prepare(prepare)
+            prepared.append(prepare)
+    except Exception as error:  # pylint: disable=W0703
+        LOGGER.error("settings not reloaded: %s", error)
+        for name, value in previous.items():
+            setattr(CONF, name, value)
+        # except the state rebuilt before the failure
+        for prepare in prepared:
+            await _prepare(prepare)
+        return []
+
+    LOGGER.warning("settings reloaded: %s", ", ".join(sorted(changes)))
+    return sorted(changes)
+
+
+class Reloader:
+    """Reload the settings in the background, one reload at a time."""
+
+    def __init__(self) -> None:
+        """Initialize without reload in progress."""
+        self._task: Optional[asyncio.Task] = None
+
+    def request(self) -> None:
+        """Start a reload, must be called from the event loop (see loop.add_signal_handler)."""
+        if self._task and not self._task.done():
+            LOGGER.warning("settings reload already in progress")
+            return
+
+        LOGGER.warning("settings reload requested")
+        self._task = asyncio.ensure_future(reload_settings())
+
+
+RELOADER = Reloader()
@@ -0,0 +1,167 @@
+"""Machine-readable report of a run.
+
+Each device is written as one JSON line (and optionally one CSV row) as soon as
+it is done, so a partial report exists even if the run is killed. The last JSON
+line is the summary of the run: outcome counts, duration percentiles and the
+slowest devices.
+"""
+import csv
+import heapq
+import json
+import time
+from typing import IO, Any, Optional
+
+from pydantic import BaseModel
+
+from app.connection import ConnectionStats
+from app.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+# device-level phases reported, see DeviceConnection.measure()
+REPORTED_PHASES = ("connect", "check", "deploy")
+
+CSV_FIELDS = (
+    "hostname",
+    "outcome",
+    "failure",
+    "sonic_version",
+    "changed",
+    "duration",
+    "queued",
+    *REPORTED_PHASES,
+    "attempts",
+    "commands",
+    "uploaded_bytes",
+)
+
+
+class DeviceResult(BaseModel):
+    """Outcome of the deployment on one device."""
+
+    hostname: str
+    # succeeded, failed, already_deployed or to_deploy (dry-run)
+    outcome: str = "failed"
+    # class of failure: connection, deployment or the exception name
+    failure: str = ""
+    sonic_version: str = ""
+    # components deployed, or failed to deploy
+    changed: list[str] = []
+    failed: list[str] = []
+    # phase -> duration in seconds
+    durations: dict[str, float] = {}
+    duration: float = 0.0
+    # seconds waiting for a slot before the deployment, see app.scheduler
+    queued: float = 0.0
+    # 1 + number of retries of the device (reconnections)
+    attempts: int = 0
+    commands: int = 0
+    uploaded_bytes: int = 0
+
+    def add_stats(self, stats: ConnectionStats) -> None:
+        """Copy the counters of the SSH connection of the device."""
+        self.durations = {
+            phase: duration
+            for (component, phase), duration in stats.durations.items()
+            if component == "device" and phase in REPORTED_PHASES
+        }
+        self.commands = stats.commands
+        self.uploaded_bytes = stats.uploaded_bytes
+
+
+def _percentile(values: list[float], percent: int) -> float:
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+
+    rank = -(-percent * len(values) // 100)  # ceil
+    return values[max(rank, 1) - 1]
+
+
+class RunReport:
+    """Write device results to JSON lines and CSV files, as they come."""
+
+    def __init__(
+        self, path: Optional[str] = None, csv_path: Optional[str] = None, top_n: int = 10
+    ) -> None:
+        """Open the report files.
+
+        :param path: JSON lines report, one line per device then the summary
+        :param csv_path: CSV report, one row per device
+        :param top_n: number of slowest devices in the summary
+        """
+        self.top_n = top_n
+        self.started_at = time.time()
+        self.outcomes: dict[str, int] = {}
+        # only durations are kept in memory, for the summary
+        self.durations: list[tuple[float, str]] = []
+
+        self._file: Optional[IO[str]] = None
+        self._csv_file: Optional[IO[str]] = None
+        self._csv: Any = None
+        # pylint: disable=R1732
+        if path:
+            self._file = open(path, "w", encoding="utf-8")
+        if csv_path:
+            self._csv_file = open(csv_path, "w", encoding="utf-8", newline="")
+            self._csv = csv.DictWriter(self._csv_file, CSV_FIELDS)
+            self._csv.writeheader()
+            self._csv_file.flush()
+
+    def add(self, result: DeviceResult) -> None:
+        """Record the result of one device."""
+        self.outcomes[result.outcome] = self.outcomes.get(result.outcome, 0) + 1
+        self.durations.append((result.duration, result.hostname))
+
+        if self._file:
+            self._file.write(json.dumps({"type": "device", **result.dict()}) + "\n")
+            self._file.flush()
+
+        if self._csv_file:
+            row = result.dict(exclude={"durations", "failed"})
+            row["changed"] = " ".join(result.changed)
+            row.update({phase: result.durations.get(phase, "") for phase in REPORTED_PHASES})
+            self._csv.writerow(row)
+            self._csv_file.flush()
+
+    def summary(self) -> dict[str, Any]:
+        """Return outcome counts, duration percentiles and the slowest devices."""
+        durations = sorted(duration for duration, _ in self.durations)
+        slowest = heapq.nlargest(self.top_n, self.durations)
+        return {
+            "type": "summary",
+            "started_at": self.started_at,
+            "duration": time.time() - self.started_at,
+            "devices": len(durations),
+            "outcomes": self.outcomes,
+            "duration_percentiles": {
+                f"p{percent}": _percentile(durations, percent) for percent in (50, 90, 99)
+            },
+            "slowest": [
+                {"hostname": hostname, "duration": duration} for duration, hostname in slowest
+            ],
+        }
+
+    def close(self) -> dict[str, Any]:
+        """Write the summary and close the report files."""
+        summary = self.summary()
+        LOGGER.info(
+            "devices: %i, %s, duration p50/p90/p99: %s",
+            summary["devices"],
+            summary["outcomes"],
+            "/".join(f"{value:.1f}s" for value in summary["duration_percentiles"].values()),
+        )
+        LOGGER.info(
+            "slowest devices: %s",
+            ", ".join(
+                f"{item['hostname']} ({item['duration']:.1f}s)" for item in summary["slowest"]
+            ),
+        )
+
+        if self._file:
+            self._file.write(json.dumps(summary) + "\n")
+            self._file.close()
+        if self._csv_file:
+            self._csv_file.close()
+
+        return summary
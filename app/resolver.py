@@ -0,0 +1,128 @@
+"""Concurrent resolution of hostnames, cached for the TTL of the answers.
+
+All hostnames, and their A and AAAA records, are resolved at the same time, each
+query with its own timeout: a slow resolver delays the start by dns_timeout at
+most. Answers are cached until their TTL expires, in memory for the reloads of
+the settings, and in dns_cache_file for the next runs.
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+from pydantic import BaseModel, ValidationError
+
+from app.logger import get_logger
+from app.settings import CONF
+
+LOGGER = get_logger(__name__)
+
+RECORD_TYPES = ("A", "AAAA")
+
+
+class CachedAddresses(BaseModel):
+    """Addresses of a hostname, valid until the shortest TTL of the answers expires."""
+
+    addresses: list[str]
+    expires_at: float
+
+
+class DNSCache(BaseModel):
+    """Resolved hostnames, saved to be reused by the next runs."""
+
+    entries: dict[str, CachedAddresses] = {}
+
+    def get(self, hostname: str) -> Optional[list[str]]:
+        """Return the addresses of a hostname, None if unknown or expired."""
+        entry = self.entries.get(hostname)
+        if entry is None or entry.expires_at <= time.time():
+            return None
+        return entry.addresses
+
+    def add(self, hostname: str, addresses: list[str], ttl: float) -> None:
+        """Cache the addresses of a hostname for ttl seconds."""
+        self.entries[hostname] = CachedAddresses(addresses=addresses, expires_at=time.time() + ttl)
+
+
+def load_cache(path: Optional[str]) -> DNSCache:
+    """Load the DNS cache file, expired entries are ignored when read."""
+    if not path:
+        return DNSCache()
+
+    try:
+        return DNSCache.parse_file(path)
+    except FileNotFoundError:
+        return DNSCache()
+    except ValidationError as error:
+        LOGGER.warning("ignoring invalid DNS cache file %s: %s", path, error)
+        return DNSCache()
+
+
+def save_cache(path: Optional[str], cache: DNSCache) -> None:
+    """Save the DNS cache atomically to a JSON file."""
+    if not path:
+        return
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as tmp_file:
+        tmp_file.write(cache.json())
+    os.replace(tmp_path, path)
+
+
+async def _query(resolver, hostname: str, record_type: str) -> tuple[list[str], float]:
+    """Return the addresses of one record type, and their TTL."""
+    import dns.exception  # noqa: PLC0415
+    import dns.resolver  # noqa: PLC0415
+
+    try:
+        answer = await resolver.resolve(hostname, record_type, lifetime=CONF.dns_timeout)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        return [], 0
+    except (dns.exception.Timeout, dns.resolver.NoNameservers) as error:
+        LOGGER.warning("unable to resolve %s %s: %s", record_type, hostname, error)
+        return [], 0
+
+    return [record.address for record in answer], answer.rrset.ttl
+
+
+async def _resolve(resolver, hostname: str) -> tuple[str, list[str], float]:
+    """Return a hostname, its A and AAAA addresses, and their shortest TTL."""
+    answers = await asyncio.gather(
+        *(_query(resolver, hostname, record_type) for record_type in RECORD_TYPES)
+    )
+    addresses = [address for records, _ in answers for address in records]
+    ttls = [ttl for records, ttl in answers if records]
+    return hostname, addresses, min(ttls, default=0)
+
+
+class HostnameResolver:
+    """Resolve hostnames, with a cache shared by the runs of the process."""
+
+    def __init__(self) -> None:
+        """Initialize without cache, it is loaded on first use."""
+        self.cache: Optional[DNSCache] = None
+
+    async def resolve(self, hostnames: list[str]) -> dict[str, list[str]]:
+        """Resolve hostnames concurrently, return their addresses (empty if not resolved)."""
+        import dns.asyncresolver  # noqa: PLC0415
+
+        if self.cache is None:
+            self.cache = load_cache(CONF.dns_cache_file)
+
+        addresses = {hostname: self.cache.get(hostname) for hostname in hostnames}
+        missing = [hostname for hostname, cached in addresses.items() if cached is None]
+        if missing:
+            resolver = dns.asyncresolver.Resolver()
+            results = await asyncio.gather(*(_resolve(resolver, hostname) for hostname in missing))
+            for hostname, resolved, ttl in results:
+                addresses[hostname] = resolved
+                if resolved:
+                    self.cache.add(hostname, resolved, ttl)
+                else:
+                    LOGGER.debug("%s not resolved", hostname)
+            save_cache(CONF.dns_cache_file, self.cache)
+
+        return {hostname: cached or [] for hostname, cached in addresses.items()}
+
+
+RESOLVER = HostnameResolver()
@@ -1,39 +1,71 @@
 #!/usr/bin/python
 # type: ignore
-# pylint: disable=E0401,C0412
+# pylint: disable=E0401,C0412,C0415
 """Script to update grains.
 
 Once sonic_device_util will be available as python3 lib, this script should use it to
 fill /etc/salt/grain file directly (grain file can be a python returning a Dict).
+
+The script runs often (timer, and path unit if enabled): when the fingerprint of the
+sources of the grains did not change, it stops before importing the SONiC modules,
+which are slow to import on switch CPUs. The grains file is only written when the
+grains changed. Use --force to refresh the grains anyway.
 """
 
 import os
+import sys
 
 import yaml
 
-try:
-    from sonic_py_common import device_info as sonic_info
-except ImportError:
-    import sonic_device_util as sonic_info
+GRAINS_FILE = "/etc/salt/grains"
+FINGERPRINT_FILE = "/etc/salt/grains.fingerprint"
+# files the grains are read from (SONiC version, HwSKU), and this script
+SOURCE_FILES = ("/etc/sonic/sonic_version.yml", "/etc/sonic/config_db.json", __file__)
+MACHINE_CONF = "/host/machine.conf"
+
+
+def get_platform():
+    """Get the platform from machine.conf, without SONiC modules."""
+    try:
+        with open(MACHINE_CONF, "r") as machine_conf:  # pylint: disable=W1514
+            for line in machine_conf:
+                key, _, value = line.strip().partition("=")
+                if key in ("onie_platform", "aboot_platform"):
+                    return value
+    except (IOError, OSError):
+        pass
+
+    return ""
+
 
-try:
-    from sonic_py_common.device_info import get_platform_info as get_hw_info_dict
-except ImportError:
-    from show.main import get_hw_info_dict
+def get_fingerprint():
+    """Get a fingerprint of the sources of the grains: it changes when they may change."""
+    fingerprint = ["platform=%s" % get_platform()]
+    for path in SOURCE_FILES:
+        try:
+            stat = os.stat(path)
+            fingerprint.append("%s=%r,%i" % (path, stat.st_mtime, stat.st_size))
+        except OSError:
+            fingerprint.append("%s=missing" % path)
+
+    return "\n".join(fingerprint) + "\n"
 
 
 class Grains:
     """Grains handler."""
 
-    def __init__(self, grains_file):
+    def __init__(self, grains_file, fingerprint_file):
         """Initialize Grains attributes."""
         self.grains_file = grains_file
+        self.fingerprint_file = fingerprint_file
         self.grains = {}
 
     def _save(self):
-        """Save grains to file."""
-        with open(self.grains_file, "w") as grains_file:  # pylint: disable=W1514
+        """Save grains to file, atomically: the minion may read it at any time."""
+        new_file = self.grains_file + ".new"
+        with open(new_file, "w") as grains_file:  # pylint: disable=W1514
             yaml.safe_dump(self.grains, grains_file, default_flow_style=False)
+        os.rename(new_file, self.grains_file)
 
     def load(self):
         """Load grains from file."""
@@ -44,8 +76,34 @@ class Grains:
         if not self.grains:
             self.grains = {}
 
+    def is_up_to_date(self, fingerprint):
+        """Return if the grains were computed from the same sources."""
+        if not os.path.isfile(self.grains_file) or not os.path.isfile(self.fingerprint_file):
+            return False
+
+        with open(self.fingerprint_file, "r") as fingerprint_file:  # pylint: disable=W1514
+            return fingerprint_file.read() == fingerprint
+
+    def save_fingerprint(self, fingerprint):
+        """Save the fingerprint of the sources of the grains."""
+        with open(self.fingerprint_file, "w") as fingerprint_file:  # pylint: disable=W1514
+            fingerprint_file.write(fingerprint)
+
     def _update_version(self):
         """Get fresh version."""
+        # slow to import: only when the grains must be refreshed
+        try:
+            from sonic_py_common import device_info as sonic_info  # noqa: PLC0415
+        except ImportError:
+            import sonic_device_util as sonic_info  # noqa: PLC0415
+
+        try:
+            from sonic_py_common.device_info import (  # noqa: PLC0415
+                get_platform_info as get_hw_info_dict,
+            )
+        except ImportError:
+            from show.main import get_hw_info_dict  # noqa: PLC0415
+
         version_info = sonic_info.get_sonic_version_info()
         hw_info = get_hw_info_dict()
         self.grains = {
@@ -59,12 +117,28 @@ class Grains:
         }
 
     def update(self):
-        """Get fresh info and write the new grains file."""
+        """Get fresh info and write the grains file if they changed, return if written."""
+        loaded = self.grains
         self._update_version()
+        if self.grains == loaded:
+            return False
+
         self._save()
+        return True
 
 
-if __name__ == "__main__":
-    grains = Grains("/etc/salt/grains")
+def main(argv):
+    """Refresh the grains if their sources changed, or if forced."""
+    # computed first: a change during the refresh is seen by the next run
+    fingerprint = get_fingerprint()
+    grains = Grains(GRAINS_FILE, FINGERPRINT_FILE)
+    if "--force" not in argv and grains.is_up_to_date(fingerprint):
+        return
+
     grains.load()
     grains.update()
+    grains.save_fingerprint(fingerprint)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,145 @@
+"""Retries of transient failures.
+
+Errors are classified as transient (the same operation may succeed a bit later:
+connection reset, channel open failure, timeout) or permanent (authentication
+failure, unknown SONiC version...). Transient errors are retried with an
+exponential backoff and full jitter, so devices failing at the same time do not
+retry at the same time.
+
+A retry budget, shared by all devices, bounds the number of retries of a run:
+when a large part of the fleet fails (e.g. a TACACS outage), failures become
+final instead of multiplying the load.
+"""
+import asyncio
+import random
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import asyncssh  # type: ignore
+from futurelog import FutureLogger
+
+from app.drain import DRAIN
+from app.exceptions import (
+    ChecksumException,
+    DeviceTimeoutException,
+    InvalidMinion,
+    UnknownSonicVersionException,
+)
+from app.metrics import RETRIES
+from app.settings import CONF
+
+FUTURE_LOGGER = FutureLogger(__name__)
+
+T = TypeVar("T")
+
+# errors after which the same operation may succeed
+TRANSIENT_ERRORS = (
+    asyncssh.ConnectionLost,
+    asyncssh.ChannelOpenError,
+    ConnectionError,
+    asyncio.TimeoutError,
+    DeviceTimeoutException,
+)
+# errors which would happen again, even if they are caused by a transient error
+PERMANENT_ERRORS = (
+    asyncssh.PermissionDenied,
+    ChecksumException,
+    InvalidMinion,
+    UnknownSonicVersionException,
+)
+
+
+def is_transient(error: BaseException, transient_errors: tuple = TRANSIENT_ERRORS) -> bool:
+    """Return if an error, or the error which caused it, is transient."""
+    cause: Optional[BaseException] = error
+    while cause is not None:
+        if isinstance(cause, PERMANENT_ERRORS):
+            return False
+        if isinstance(cause, transient_errors):
+            return True
+        cause = cause.__cause__
+
+    return False
+
+
+class RetryBudget:
+    """Allow retries up to a ratio of the operations of the run, plus a minimum."""
+
+    def __init__(self) -> None:
+        """Initialize an empty budget."""
+        self.operations = 0
+        self.retries = 0
+
+    def record_operation(self) -> None:
+        """Record a new operation, which increases the budget."""
+        self.operations += 1
+
+    def acquire(self) -> bool:
+        """Consume one retry, return False if the budget is exhausted."""
+        if self.retries >= CONF.retry_budget_minimum + CONF.retry_budget_ratio * self.operations:
+            return False
+
+        self.retries += 1
+        return True
+
+
+class RetryPolicy:
+    """Retry the transient failures of one level of operations (command or device)."""
+
+    def __init__(self, level: str, transient_errors: tuple = TRANSIENT_ERRORS) -> None:
+        """Initialize the policy.
+
+        :param level: name of the operations, for logs and metrics
+        :param transient_errors: errors to retry at this level
+        """
+        self.level = level
+        self.transient_errors = transient_errors
+        self.budget = RetryBudget()
+
+    def reset(self) -> None:
+        """Start a new run, with a new budget."""
+        self.budget = RetryBudget()
+
+    @staticmethod
+    def backoff(retry: int) -> float:
+        """Return the delay before a retry: exponential backoff with full jitter."""
+        return random.uniform(0, min(CONF.retry_max_delay, CONF.retry_base_delay * 2**retry))
+
+    def should_retry(self, error: BaseException, retry: int) -> bool:
+        """Return if a failed operation must be retried, consume the budget if so."""
+        return (
+            retry < CONF.retry_attempts
+            and not DRAIN.requested
+            and is_transient(error, self.transient_errors)
+            and self.budget.acquire()
+        )
+
+    async def run(self, hostname: str, operation: Callable[[], Awaitable[T]]) -> T:
+        """Run an operation, retry it while it fails with transient errors."""
+        self.budget.record_operation()
+        retry = 0
+        while True:
+            try:
+                return await operation()
+            except Exception as error:
+                if not self.should_retry(error, retry):
+                    raise
+
+                delay = self.backoff(retry)
+                retry += 1
+                RETRIES.labels(self.level).inc()
+                FUTURE_LOGGER.warning(
+                    hostname,
+                    "%s failed: %r, retry %i/%i in %.1fs",
+                    self.level,
+                    error,
+                    retry,
+                    CONF.retry_attempts,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+
+
+# the connection is still usable after these errors: retry the command only
+COMMAND_RETRY = RetryPolicy("command", (asyncssh.ChannelOpenError,))
+# reconnect and deploy again
+DEVICE_RETRY = RetryPolicy("device")
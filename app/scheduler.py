@@ -0,0 +1,136 @@
+"""Scheduling of the devices of a run, site by site.
+
+A device waits for a slot before its deployment starts: at most
+max_concurrent_devices devices in total, and max_concurrent_devices_per_site
+per site (see site_pattern), are deployed at the same time. Free slots are
+given to the sites in turn, so all sites progress together instead of one
+site getting all the slots.
+
+New SSH connections are also limited per site by a token bucket
+(site_handshake_rate per second, bursts of site_handshake_burst), so the
+TACACS servers of a site are not hammered, e.g. when many devices reconnect.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from app.settings import CONF
+from app.utils import get_site
+
+
+class TokenBucket:
+    """Allow rate operations per second, and bursts of burst operations."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """Initialize a full bucket."""
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        # the waiters are served in order
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Wait for a token."""
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class Scheduler:
+    """Slots of the devices of the current run, and handshake buckets of the sites."""
+
+    def __init__(self) -> None:
+        """Initialize a run without device."""
+        self.reset()
+
+    def reset(self) -> None:
+        """Start a new run."""
+        self.running = 0
+        self._site_running: dict[str, int] = {}
+        # site -> devices waiting for a slot, in order; sites in turn
+        self._waiting: dict[str, deque[asyncio.Future]] = {}
+        self._sites: deque[str] = deque()
+        self._dispatch_handle: Optional[asyncio.Handle] = None
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def _has_slot(self, site: str) -> bool:
+        if CONF.max_concurrent_devices and self.running >= CONF.max_concurrent_devices:
+            return False
+        per_site = CONF.max_concurrent_devices_per_site
+        return not per_site or self._site_running.get(site, 0) < per_site
+
+    def _dispatch(self) -> None:
+        """Give the free slots to the waiting devices, one site after the other."""
+        self._dispatch_handle = None
+        skipped = 0
+        while skipped < len(self._sites):
+            site = self._sites[0]
+            self._sites.rotate(-1)
+            waiting = self._waiting[site]
+            while waiting and waiting[0].done():
+                # cancelled while waiting
+                waiting.popleft()
+            if not waiting or not self._has_slot(site):
+                skipped += 1
+                continue
+
+            waiting.popleft().set_result(None)
+            self.running += 1
+            self._site_running[site] = self._site_running.get(site, 0) + 1
+            skipped = 0
+
+    def _schedule_dispatch(self) -> None:
+        # once the devices started at the same time are all waiting: they are interleaved
+        if self._dispatch_handle is None:
+            self._dispatch_handle = asyncio.get_running_loop().call_soon(self._dispatch)
+
+    def _release(self, site: str) -> None:
+        self.running -= 1
+        self._site_running[site] -= 1
+        self._schedule_dispatch()
+
+    @asynccontextmanager
+    async def slot(self, hostname: str) -> AsyncIterator[None]:
+        """Wait for a slot to deploy a device, release it at the end of the deployment."""
+        site = get_site(hostname)
+        if site not in self._waiting:
+            self._waiting[site] = deque()
+            self._sites.append(site)
+        granted = asyncio.get_running_loop().create_future()
+        self._waiting[site].append(granted)
+        self._schedule_dispatch()
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if granted.done() and not granted.cancelled():
+                self._release(site)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(site)
+
+    async def handshake(self, hostname: str) -> None:
+        """Wait until a new SSH connection may be opened to a device."""
+        if not CONF.site_handshake_rate:
+            return
+
+        site = get_site(hostname)
+        if site not in self._buckets:
+            self._buckets[site] = TokenBucket(CONF.site_handshake_rate, CONF.site_handshake_burst)
+        await self._buckets[site].acquire()
+
+
+SCHEDULER = Scheduler()
@@ -1,7 +1,13 @@
-"""SONiC Salt Deployer settings."""
+"""SONiC Salt Deployer settings.
+
+CONF is built on first use, not when the application is imported: reading the
+settings (and the minion configuration file) is the job of the run, not of an
+import.
+"""
 import json
+import os
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Literal, Optional, cast
 
 from pydantic import BaseSettings
 
@@ -21,10 +27,62 @@ class Settings(BaseSettings):
     """SONiC Salt Deployer configuration."""
 
     prometheus_listen_port: int = 9000
+    # export metrics at the end of each run
+    prometheus_textfile_path: Optional[str]
+    prometheus_pushgateway_url: Optional[str]
+    prometheus_pushgateway_job: str = "sonic-salt-deployer"
+    # one deployment status series per device, aggregates are always exported
+    prometheus_per_host_metrics: bool = True
+    # trace of the deployment timelines, written at the end of the run
+    trace_file: Optional[str]
+    trace_format: Literal["chrome", "otlp"] = "chrome"
+    # profile of the run (pstats), also enabled by --profile
+    profile_file: Optional[str]
+    slow_callback_duration: float = 0.1
+    # report of the run: one line per device, written as devices are done
+    report_file: Optional[str]
+    report_csv_file: Optional[str]
+    report_top_n: int = 10
     force: bool = False
     dry_run: bool = False
+    # plans exported by a dry-run, and reused by the next run if recent enough
+    plan_file: Optional[str]
+    plan_max_age: int = 3600
     pretty_logs: bool = True
     log_level: str = "INFO"
+    # logs of each device are written as soon as the device is done
+    device_log_directory: Optional[str]
+    device_log_format: Literal["text", "json"] = "text"
+
+    ##
+    # Performance
+    ##
+    # use uvloop as event loop (if installed)
+    uvloop: bool = False
+    # SSH algorithms profile, see app.connection.SSH_PROFILES
+    ssh_profile: str = "default"
+    ssh_compression: bool = False
+    # hostname -> "address:port" to reach some devices on another address or port
+    ssh_endpoints: dict[str, str] = {}
+    # seconds before a hung command, upload or device is aborted
+    command_timeout: float = 120
+    upload_timeout: float = 600
+    device_timeout: float = 1800
+    # retries of transient failures (connection reset, channel open failure, timeout)
+    retry_attempts: int = 2
+    retry_base_delay: float = 1
+    retry_max_delay: float = 30
+    # retries allowed per run: retry_budget_minimum + retry_budget_ratio * operations
+    retry_budget_ratio: float = 0.1
+    retry_budget_minimum: int = 10
+    # seconds given to the devices in progress to finish after SIGTERM or SIGINT
+    drain_timeout: float = 60
+    # devices deployed at the same time, in total and per site (0: no limit)
+    max_concurrent_devices: int = 0
+    max_concurrent_devices_per_site: int = 0
+    # new SSH connections per second per site, and their bursts (0: no limit)
+    site_handshake_rate: float = 0
+    site_handshake_burst: int = 10
 
     sonic_versions: list[str]
 
@@ -32,9 +90,21 @@ class Settings(BaseSettings):
     minion_config_file: str = "./minion.yml"
     dns_resolvers: list[str]
     resolve_dns_resolvers_hostname: bool = False
+    # timeout of each DNS query, and cache of the answers for the next runs
+    dns_timeout: float = 5
+    dns_cache_file: Optional[str]
 
     minion_files_local_directory: Optional[str]
     minion_files_nexus_location: Optional[str]
+    # how to roll out a new minion PEX, see app.deployers.minion
+    minion_rollout: Literal["direct", "stage", "activate", "rollback"] = "direct"
+    # copy the PEX from device to device within a site, see app.fanout
+    minion_fanout: bool = False
+    minion_fanout_degree: int = 4
+    minion_fanout_port: int = 8765
+    minion_fanout_serve_time: float = 900
+    # refresh the grains when the SONiC version or configuration changes, see settings.env
+    grains_path_unit: bool = False
 
     ##
     # SONiC devices list
@@ -61,6 +131,15 @@ class Settings(BaseSettings):
     vault_secret_path: Optional[str]
     vault_device_usernames: Optional[list[str]]
 
+    # site of a device, from its hostname: the "site" group of this regex
+    site_pattern: str = r"^[^.]+\.(?P<site>[^.]+)\."
+
+    # hostname or site -> "[user@]address[:port]" jump host to reach the devices through
+    jump_hosts: dict[str, str] = {}
+    jump_host_password: Optional[str]
+    # devices tunneled over each connection to a jump host
+    jump_host_max_channels: int = 64
+
     def __init__(self, **kwargs: Any) -> None:
         """Override init to add post init."""
         super().__init__(**kwargs)
@@ -73,8 +152,7 @@ class Settings(BaseSettings):
 
         # if self.minion_config is defined, we save its content to minion_config file
         if self.minion_config:
-            with open(self.minion_config_file, "w", encoding="utf-8") as config_file:
-                config_file.write(self.minion_config)
+            _write_if_changed(self.minion_config_file, self.minion_config)
         # or we load the content from minion_config file
         else:
             with open(self.minion_config_file, "r", encoding="utf-8") as config_file:
@@ -106,4 +184,46 @@ class Settings(BaseSettings):
             return (init_settings, json_config_settings_source, env_settings, file_secret_settings)
 
 
-CONF = Settings()
+def _write_if_changed(path: str, content: str) -> None:
+    """Replace a file atomically, only if its content changed.
+
+    The settings are read again on reload (see app.reload), while the file may be
+    uploaded to devices: an upload never reads a truncated or partial file.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as current_file:
+            if current_file.read() == content:
+                return
+    except FileNotFoundError:
+        pass
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_path, path)
+
+
+class LazySettings:
+    """Settings built on first access, attributes are then read and set on them."""
+
+    def __init__(self) -> None:
+        """Initialize without settings."""
+        object.__setattr__(self, "_settings", None)
+
+    def _get(self) -> Settings:
+        settings = object.__getattribute__(self, "_settings")
+        if settings is None:
+            settings = Settings()
+            object.__setattr__(self, "_settings", settings)
+        return settings
+
+    def __getattr__(self, name: str) -> Any:
+        """Read a setting."""
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """Change a setting."""
+        setattr(self._get(), name, value)
+
+
+CONF = cast(Settings, LazySettings())
@@ -0,0 +1,171 @@
+"""Span-based tracing of the deployment timelines.
+
+Spans are kept in memory and written to a file at the end of the run, either as
+Chrome trace events (one line per device in Perfetto / chrome://tracing) or as
+OTLP JSON (one trace per device, for Jaeger or any OpenTelemetry backend).
+When tracing is disabled, TRACER.span() returns a shared no-op context manager.
+"""
+import contextvars
+import json
+import os
+import secrets
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Iterator, Optional
+
+from app.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+SERVICE_NAME = "sonic-salt-deployer"
+
+
+class Span:  # pylint: disable=R0903
+    """One timed operation."""
+
+    __slots__ = (
+        "name",
+        "hostname",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+    )
+
+    hostname: str
+    trace_id: str
+
+    def __init__(self, name: str, hostname: str, parent: Optional["Span"], **attributes: Any):
+        """Start a span, child of parent if any."""
+        self.name = name
+        self.hostname = hostname or (parent.hostname if parent else "")
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else ""
+        self.attributes = attributes
+        self.error = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = self.start_ns
+
+
+_CURRENT_SPAN: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+_NO_SPAN: ContextManager[None] = nullcontext()
+
+
+class Tracer:
+    """Record spans, each asyncio task inherits the current span of its creator."""
+
+    def __init__(self) -> None:
+        """Initialize a disabled tracer."""
+        self.enabled = False
+        self.spans: list[Span] = []
+
+    def span(self, name: str, hostname: str = "", **attributes: Any) -> ContextManager:
+        """Return a context manager recording a span.
+
+        :param hostname: device of the span, inherited from the parent span if empty
+        """
+        if not self.enabled:
+            return _NO_SPAN
+
+        return self._record(name, hostname, **attributes)
+
+    @contextmanager
+    def _record(self, name: str, hostname: str, **attributes: Any) -> Iterator[Span]:
+        span = Span(name, hostname, _CURRENT_SPAN.get(), **attributes)
+        token = _CURRENT_SPAN.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.error = repr(error)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _CURRENT_SPAN.reset(token)
+            self.spans.append(span)
+
+    def _chrome_trace(self) -> dict:
+        """Format spans as Chrome trace events: one thread per device."""
+        threads: dict[str, int] = {}
+        events = []
+        for span in sorted(self.spans, key=lambda span: span.start_ns):
+            if span.hostname not in threads:
+                threads[span.hostname] = len(threads) + 1
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": 1,
+                        "tid": threads[span.hostname],
+                        "args": {"name": span.hostname or "deployer"},
+                    }
+                )
+
+            args = dict(span.attributes)
+            if span.error:
+                args["error"] = span.error
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": SERVICE_NAME,
+                    "ph": "X",
+                    "ts": span.start_ns / 1000,
+                    "dur": (span.end_ns - span.start_ns) / 1000,
+                    "pid": 1,
+                    "tid": threads[span.hostname],
+                    "args": args,
+                }
+            )
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def _otlp_trace(self) -> dict:
+        """Format spans as OTLP JSON: one trace per device."""
+        spans = []
+        for span in self.spans:
+            attributes = {"host.name": span.hostname, **span.attributes}
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id,
+                "name": span.name,
+                "kind": 1,  # internal
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [
+                    {"key": key, "value": {"stringValue": str(value)}}
+                    for key, value in attributes.items()
+                ],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            spans.append(otlp_span)
+
+        resource = {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]}
+        return {
+            "resourceSpans": [
+                {
+                    "resource": resource,
+                    "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+                }
+            ]
+        }
+
+    def export(self, path: str, trace_format: str = "chrome") -> None:
+        """Write all spans to a file, atomically, and forget them."""
+        trace = self._otlp_trace() if trace_format == "otlp" else self._chrome_trace()
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as trace_file:
+            json.dump(trace, trace_file)
+        os.replace(tmp_path, path)
+
+        LOGGER.info("%i spans written to %s", len(self.spans), path)
+        self.spans = []
+
+
+TRACER = Tracer()
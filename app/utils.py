@@ -2,62 +2,82 @@
 import hashlib
 import json
 import os
-from typing import Any, Dict, Optional
+import re
+from typing import TYPE_CHECKING, Any, Dict
 
 import asyncssh  # type: ignore
-import hvac  # type: ignore
-import requests
-from asyncssh.connection import SSHClientConnection  # type: ignore
 from futurelog import FutureLogger
 
-from app.exceptions import (
-    APIException,
-    ChecksumException,
-    VaultPasswordNotFound,
-    VaultUnreachable,
-)
+from app.exceptions import APIException, ChecksumException
 from app.exceptions.utils_exceptions import UploadException
 from app.settings import CONF
+from app.tracing import TRACER
 
-FUTURE_LOGGER = FutureLogger(__name__, CONF.log_level)
+if TYPE_CHECKING:
+    from app.connection import DeviceConnection
 
+FUTURE_LOGGER = FutureLogger(__name__)
 
-in_progress = False  # pylint: disable=C0103
-stop_requested = False  # pylint: disable=C0103
 
+# prefix of remote commands which must not disturb the device
+LOW_PRIORITY = "nice -n 19 ionice -c 3"
 
-async def upload_file(
+
+async def upload_file(  # noqa: PLR0913
     hostname: str,
-    ssh: SSHClientConnection,
+    ssh: "DeviceConnection",
     local_resource: str,
     remote_dir: str,
     remote_name: str = "",
+    *,
+    low_priority: bool = False,
 ) -> bool:
     """Upload files to a remote device using SCP.
 
     :param hostname: hostname of the remote device
-    :param ssh: asyncssh SSHClientConnection object which must be already connected to the device
+    :param ssh: connection to the device, already opened
     :param local_resource: filepath to push
     :param remote_dir: target path on the remote device
     :param remote_name: filename on remote device
+    :param low_priority: move the file with the lowest CPU and I/O priorities on the device
     """
-    # get local path and filename
-    absolute_filepath = os.path.abspath(local_resource)
-    filename = os.path.basename(local_resource)
+    with TRACER.span("upload_file", hostname, file=local_resource):
+        # get local path and filename
+        absolute_filepath = os.path.abspath(local_resource)
+        filename = os.path.basename(local_resource)
 
-    # Push grain script
-    FUTURE_LOGGER.debug(hostname, "pushing %s to remote", local_resource)
-    try:
-        await asyncssh.scp(absolute_filepath, (ssh, "/tmp"))
-    except (asyncssh.sftp.SFTPFailure, FileNotFoundError) as error:
-        raise UploadException(f"{remote_name} because of: {error}") from error
+        # Push grain script
+        FUTURE_LOGGER.debug(hostname, "pushing %s to remote", local_resource)
+        try:
+            await ssh.upload(absolute_filepath, "/tmp")
+        except (asyncssh.sftp.SFTPFailure, FileNotFoundError) as error:
+            raise UploadException(f"{remote_name} because of: {error}") from error
+
+        return await move_file(
+            hostname, ssh, filename, remote_dir, remote_name, low_priority=low_priority
+        )
+
+
+async def move_file(  # noqa: PLR0913
+    hostname: str,
+    ssh: "DeviceConnection",
+    filename: str,
+    remote_dir: str,
+    remote_name: str = "",
+    *,
+    low_priority: bool = False,
+) -> bool:
+    """Move a file from /tmp of the device to the right place, owned by root:root.
 
-    # Put it in the right place and change the owner to root:root.
+    :param filename: name of the file in /tmp
+    See upload_file() for the other parameters.
+    """
     remote_filepath = os.path.join(remote_dir, remote_name)
     FUTURE_LOGGER.info(hostname, "move %s to %s", filename, remote_filepath)
+    sudo = f"sudo {LOW_PRIORITY}" if low_priority else "sudo"
     commands = {
         f"ensure {remote_dir} exists": f"sudo mkdir -p {remote_dir}",
-        f"move file to {remote_dir}": f"sudo mv /tmp/{filename} {remote_filepath}",
+        f"move file to {remote_dir}": f"{sudo} mv /tmp/{filename} {remote_filepath}",
         "change owner to root": f"sudo chown -R root:root {remote_filepath}",
     }
 
@@ -96,6 +116,8 @@ def request_api(request: str) -> Dict:
     :param request: URL request
     :param session: requests.session object
     """
+    import requests  # noqa: PLC0415
+
     try:
         response = requests.get(request, timeout=60)
         response.raise_for_status()
@@ -111,29 +133,7 @@ def request_api(request: str) -> Dict:
     return json_data
 
 
-def get_passwords(
-    users: list, path: str, kv_v2: bool = False, mount_point: Optional[str] = None
-) -> dict[str, str]:
-    """Get passwords from Vault."""
-    passwords = {}
-
-    vault_client = hvac.Client(url=CONF.vault_url)
-    vault_client.auth.ldap.login(username=CONF.vault_login, password=CONF.vault_password)
-    if not vault_client.is_authenticated():
-        raise VaultUnreachable("Unable to connect to Vault")
-
-    if kv_v2:
-        result = vault_client.secrets.kv.read_secret_version(path=path, mount_point=mount_point)
-    else:
-        result = vault_client.read(path)
-
-    vault_client.logout(revoke_token=True)
-
-    for user in users:
-        data = result["data"]["data"] if kv_v2 else result["data"]
-        if user not in data:
-            raise VaultPasswordNotFound(f"Unable to find {user}")
-
-        passwords[user] = data[user]
-
-    return passwords
+def get_site(hostname: str) -> str:
+    """Return the site of a device, from its hostname (see site_pattern)."""
+    match = re.search(CONF.site_pattern, hostname)
+    return match.group("site") if match else "default"
@@ -1,7 +1,5 @@
 """Start Salt deployer."""
-import asyncio
-
 from app import main
 
 if __name__ == "__main__":
-    asyncio.run(main.start_app())
+    main.main()
@@ -0,0 +1,41 @@
+"""Load test of the deployment on a simulated fleet.
+
+The size of the fleet and the latency of the devices are set by the environment:
+
+    FLEET_SIZE=1000 FLEET_LATENCY=0.05 pytest tests/benchmarks/test_fleet_load.py
+
+Devices per second, round trips per device and peak memory are reported in the
+extra info of the benchmark (--benchmark-json). The simulated devices run in the
+same process: the CPU time and memory of both sides are accounted.
+"""
+import asyncio
+import os
+
+from fleet import run_deployment
+
+from app.settings import CONF
+
+FLEET_SIZE = int(os.environ.get("FLEET_SIZE", "50"))
+FLEET_LATENCY = float(os.environ.get("FLEET_LATENCY", "0.01"))
+
+
+def test_fleet_deployment(benchmark, simulated_fleet, monkeypatch):
+    """Deploy on a fresh fleet, then run again on the deployed fleet."""
+    fleet = simulated_fleet(FLEET_SIZE, latency=FLEET_LATENCY)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(fleet.start())
+    monkeypatch.setattr(CONF, "ssh_endpoints", fleet.endpoints)
+
+    try:
+        first_run = benchmark.pedantic(
+            lambda: loop.run_until_complete(run_deployment(fleet)), rounds=1, iterations=1
+        )
+        second_run = loop.run_until_complete(run_deployment(fleet))
+    finally:
+        loop.run_until_complete(fleet.stop())
+        loop.close()
+
+    benchmark.extra_info.update({f"first_run_{key}": value for key, value in first_run.items()})
+    benchmark.extra_info.update({f"second_run_{key}": value for key, value in second_run.items()})
+    assert all(device.active for device in fleet.devices.values())
+    assert second_run["round_trips_per_device"] < first_run["round_trips_per_device"]
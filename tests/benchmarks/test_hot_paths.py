@@ -0,0 +1,140 @@
+"""Micro-benchmarks of the CPU and memory sensitive parts of the deployer.
+
+Results are saved by tox. On a branch, compare them to the results of the base
+branch, and fail if one of them is more than 25% slower (CI does the same):
+
+    git checkout main && tox -e benchmark
+    git checkout my-branch
+    tox -e benchmark -- --benchmark-compare --benchmark-compare-fail=min:25%
+
+The peak memory allocated by Python during one call is reported as
+"peak_memory_mib" in the extra info of the benchmarks which depend on the size
+of their input.
+
+CI also runs these benchmarks on the code of the base branch: the benchmarks of
+features missing there are skipped, and mocks tolerate missing functions.
+"""
+import asyncio
+import random
+import tracemalloc
+
+import pytest
+from futurelog import FutureLogger
+
+from app import main
+from app.deployers.config import ConfigDeployer
+from app.settings import CONF
+from app.utils import extract_checksum, get_sha256
+
+INVENTORY_SIZE = 50_000
+INVENTORY_FILTER = '.devices[] | select(.os|ascii_downcase == "sonic").host_name'
+SHA256SUM_OUTPUT = (
+    "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08  /opt/salt/salt-minion\n"
+)
+
+
+def _peak_memory_mib(function, *args):
+    """Return the peak memory allocated by Python during one call."""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture(name="inventory", scope="module")
+def fixture_inventory():
+    """Return a synthetic inventory, with one SONiC device out of two."""
+    rng = random.Random(0)
+    return {
+        "devices": [
+            {
+                "host_name": f"switch{index}.dc{index % 40}.example.net",
+                "os": rng.choice(["SONiC", "sonic", "EOS", "JunOS"]),
+                "site": f"dc{index % 40}",
+                "rack": f"r{index % 500}",
+            }
+            for index in range(INVENTORY_SIZE)
+        ]
+    }
+
+
+@pytest.mark.parametrize("size_mib", [1, 64])
+def test_get_sha256(benchmark, tmp_path, size_mib):
+    """Checksum of a local file, e.g. the salt-minion PEX."""
+    path = tmp_path / "salt-minion.pex"
+    path.write_bytes(random.Random(0).randbytes(size_mib * 1024 * 1024))
+
+    checksum = benchmark(get_sha256, str(path))
+
+    assert len(checksum) == 64
+    benchmark.extra_info["peak_memory_mib"] = round(_peak_memory_mib(get_sha256, str(path)), 1)
+
+
+def test_extract_checksum(benchmark):
+    """Parse the output of sha256sum."""
+    assert len(benchmark(extract_checksum, SHA256SUM_OUTPUT)) == 64
+
+
+def test_inventory_filter(benchmark, mocker, inventory, monkeypatch):
+    """Filter the SONiC devices of a large inventory with jq."""
+    mocker.patch("app.utils.request_api", return_value=inventory)
+    monkeypatch.setattr(CONF, "inventory_filter", INVENTORY_FILTER)
+
+    devices = benchmark(main.get_all_devices)
+
+    assert 0 < len(devices) < INVENTORY_SIZE
+    benchmark.extra_info["peak_memory_mib"] = round(_peak_memory_mib(main.get_all_devices), 1)
+
+
+def test_dns_configuration(benchmark):
+    """Build the expected /etc/resolv.conf and compare it to the one of a device."""
+    dns_servers = [f"192.0.2.{index}" for index in range(1, 4)]
+    remote = "\n".join(f"nameserver {server}" for server in dns_servers) + "\n"
+
+    def check():
+        return ConfigDeployer._construct_dns(dns_servers) == remote.rstrip()
+
+    assert benchmark(check)
+
+
+def test_start_deployment_aggregation(benchmark, mocker, monkeypatch):
+    """Gather the results of a large fleet, without any SSH connection."""
+    devices = [f"switch{index}" for index in range(INVENTORY_SIZE)]
+
+    async def deploy_on_device(hostname, *_):
+        return not hostname.endswith("7")
+
+    mocker.patch("app.main.deploy_on_device", deploy_on_device)
+    mocker.patch("app.main.export_metrics", create=True)
+    mocker.patch("app.main.print_result")
+    monkeypatch.setattr(CONF, "dry_run", False)
+
+    def run():
+        asyncio.run(main.start_deployment(dict.fromkeys(devices, {}), devices))
+
+    benchmark.pedantic(run, rounds=3, iterations=1)
+
+    benchmark.extra_info["peak_memory_mib"] = round(_peak_memory_mib(run), 1)
+    succeeded, failed = main.print_result.call_args.args
+    assert len(succeeded) + len(failed) == INVENTORY_SIZE
+
+
+def test_future_logger(benchmark):
+    """Buffer the logs of many devices, then flush them device by device."""
+    log_sink = pytest.importorskip("app.log_sink")
+    future_logger = FutureLogger("benchmark", "DEBUG")
+    sink = log_sink.DeviceLogSink(log_format="json")
+    hostnames = [f"switch{index}" for index in range(1_000)]
+
+    def log_and_flush():
+        for hostname in hostnames:
+            for step in range(10):
+                future_logger.info(hostname, "step %i of %s", step, hostname)
+        for hostname in hostnames:
+            sink.flush(hostname)
+
+    benchmark(log_and_flush)
+
+    assert not future_logger.logs
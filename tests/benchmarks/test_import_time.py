@@ -0,0 +1,30 @@
+"""Benchmark the cold start of the deployer, paid on each timer firing.
+
+Each round starts a new interpreter which imports the application, as the PEX
+entrypoint does. Saved and compared by tox, with the hot paths benchmarks:
+
+    tox -e benchmark -- --benchmark-compare --benchmark-compare-fail=min:25%
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+IMPORT_APP = (
+    "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+)
+
+
+def _import_app():
+    """Import the application in a new interpreter, return the import duration."""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_APP], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output)
+
+
+def test_import_app(benchmark):
+    """Start an interpreter and import app.main."""
+    benchmark.pedantic(_import_app, rounds=5, iterations=1, warmup_rounds=1)
+
+    benchmark.extra_info["import_ms"] = round(min(_import_app() for _ in range(3)) * 1000, 1)
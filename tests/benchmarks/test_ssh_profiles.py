@@ -0,0 +1,117 @@
+"""Benchmark SSH performance profiles.
+
+An in-process asyncssh server is used, so the CPU time of both sides of the
+link is accounted: compare profiles relatively to each other.
+
+    pytest tests/benchmarks/test_ssh_profiles.py --benchmark-columns=ops,mean
+"""
+import asyncio
+import time
+
+import asyncssh  # type: ignore
+import pytest
+
+from app.connection import SSH_PROFILES, get_connect_options
+
+PAYLOAD_SIZE = 16 * 1024 * 1024
+PAYLOAD = b"\0" * PAYLOAD_SIZE
+
+
+class _AcceptAllServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+def _send_payload(process):
+    process.stdout.write(PAYLOAD)
+    process.exit(0)
+
+
+def _new_event_loop(loop_name):
+    if loop_name == "uvloop":
+        uvloop = pytest.importorskip("uvloop")
+        return uvloop.new_event_loop()
+
+    return asyncio.new_event_loop()
+
+
+@pytest.fixture(scope="module", params=["asyncio", "uvloop"])
+def ssh_server(request):
+    """Start a local SSH server, yield its event loop and port."""
+    loop = _new_event_loop(request.param)
+    host_key = asyncssh.generate_private_key("ssh-ed25519")
+    server = loop.run_until_complete(
+        asyncssh.listen(
+            "127.0.0.1",
+            0,
+            server_host_keys=[host_key],
+            server_factory=_AcceptAllServer,
+            process_factory=_send_payload,
+            encoding=None,
+        )
+    )
+    port = server.sockets[0].getsockname()[1]
+
+    yield loop, port
+
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+
+
+async def _connect(port, profile, compression=False):
+    return await asyncssh.connect(
+        "127.0.0.1",
+        port,
+        username="admin",
+        password="YourPaSsWoRd",
+        known_hosts=None,
+        **get_connect_options(profile, compression),
+    )
+
+
+async def _handshake(port, profile):
+    conn = await _connect(port, profile)
+    conn.close()
+    await conn.wait_closed()
+
+
+async def _transfer(port, profile, compression):
+    async with await _connect(port, profile, compression) as conn:
+        response = await conn.run("payload", encoding=None)
+
+    return len(response.stdout)
+
+
+@pytest.mark.parametrize("profile", sorted(SSH_PROFILES))
+def test_handshakes_per_second(benchmark, ssh_server, profile):
+    """Handshakes per second is the OPS column."""
+    loop, port = ssh_server
+    benchmark(lambda: loop.run_until_complete(_handshake(port, profile)))
+
+
+@pytest.mark.parametrize("compression", [False, True], ids=["no-compression", "compression"])
+@pytest.mark.parametrize("profile", sorted(SSH_PROFILES))
+def test_throughput_per_core(benchmark, ssh_server, profile, compression):
+    """Throughput per core is reported as 'MiB_per_cpu_second' in extra info."""
+    loop, port = ssh_server
+    cpu_times = []
+
+    def transfer():
+        start = time.process_time()
+        size = loop.run_until_complete(_transfer(port, profile, compression))
+        cpu_times.append(time.process_time() - start)
+        return size
+
+    size = benchmark(transfer)
+
+    assert size == PAYLOAD_SIZE
+    benchmark.extra_info["MiB_per_cpu_second"] = round(
+        PAYLOAD_SIZE / (1024 * 1024) / (sum(cpu_times) / len(cpu_times)), 2
+    )
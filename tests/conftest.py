@@ -0,0 +1,48 @@
+"""Tests configuration.
+
+The deployer settings are loaded from the environment: set the mandatory ones
+before the application is imported.
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+
+import pytest
+
+_MINION_DIRECTORY = tempfile.mkdtemp(prefix="sonic-salt-deployer-")
+
+os.environ.setdefault("SONIC_VERSIONS", '["202205"]')
+os.environ.setdefault("DNS_RESOLVERS", '["192.0.2.1"]')
+os.environ.setdefault("MINION_CONFIG_FILE", f"{_MINION_DIRECTORY}/minion.yml")
+os.environ.setdefault("MINION_CONFIG", "master: salt.lan\n")
+
+
+@pytest.fixture(name="simulated_fleet")
+def fixture_simulated_fleet(tmp_path, monkeypatch):
+    """Return a factory of simulated fleets, the deployer is prepared to deploy on them."""
+    from fleet import PASSWORD, USERNAME, SimulatedFleet  # noqa: PLC0415
+
+    from app.main import prepare_deployers  # noqa: PLC0415
+    from app.settings import CONF  # noqa: PLC0415
+
+    pex_directory = tmp_path / "pex"
+    pex_directory.mkdir()
+    for sonic_version in CONF.sonic_versions:
+        pex = pex_directory / f"salt-minion-{sonic_version}.pex"
+        pex.write_bytes(b"#!/usr/bin/env python\n" + os.urandom(256 * 1024))
+        checksum = hashlib.sha256(pex.read_bytes()).hexdigest()
+        pex.with_suffix(".pex.sha256").write_text(f"{checksum}  {pex.name}\n")
+
+    monkeypatch.setattr(CONF, "minion_files_local_directory", str(pex_directory))
+    monkeypatch.setattr(CONF, "username", USERNAME)
+    monkeypatch.setattr(CONF, "password", PASSWORD)
+    monkeypatch.setattr(CONF, "ssh_endpoints", {})
+    monkeypatch.setattr(CONF, "dry_run", False)
+    monkeypatch.setattr(CONF, "force", False)
+    asyncio.run(prepare_deployers())
+
+    def make_fleet(size, **device_options):
+        return SimulatedFleet(str(tmp_path / "fleet"), size, **device_options)
+
+    return make_fleet
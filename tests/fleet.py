@@ -0,0 +1,528 @@
+"""Simulated fleet of SONiC devices, for end-to-end and load tests.
+
+Each device is an in-process asyncssh server listening on its own local port,
+with its own filesystem (a directory, which is the root of the device). It
+answers the commands run by the deployer: cat, sha256sum, ls, mv, tee, chmod,
+systemctl, sudo... and SCP uploads. Use the endpoints of the fleet as
+CONF.ssh_endpoints to run start_deployment() against it.
+
+Latency is added to each authentication, command and file transfer, failures
+can be injected per device:
+- failures: command substring -> exit status of the commands containing it
+- hangs: command substrings, the commands containing one never finish
+- disconnects: command substrings, the first command containing one resets the
+  connection (once per substring)
+- refuse_auth: the password is always rejected
+- without_version: /etc/sonic/sonic_release is missing, the version is unknown
+
+The devices of the fleet copy files from each other with curl, from the
+directory one of them serves with python3 -m http.server.
+
+SimulatedJumpHost forwards the connections to the devices, see CONF.jump_hosts.
+
+The scripts of the two-phase rollouts (sh -c, command substitutions) are run by
+the local sh, with the paths of the device rewritten into its root: ln -sfn,
+readlink -f, mv -T... act on the filesystem of the device.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import time
+from functools import partial
+from typing import Optional
+
+import asyncssh  # type: ignore
+
+from app.profiling import peak_rss_mib
+from app.utils import LOW_PRIORITY
+
+USERNAME = "admin"
+PASSWORD = "YourPaSsWoRd"
+
+_IF_STATEMENT = re.compile(r"^if (?P<condition>.+?) ?; then (?P<body>.+?) ?; fi$")
+_OPERATORS = re.compile(r" (&&|\|\|) ")
+# absolute paths of the device, in the scripts run by the local sh
+_DEVICE_PATHS = re.compile(r"(?<![\w./-])/(?=(opt|etc|tmp)/)")
+
+NOT_FOUND = 127
+
+
+class SimulatedDevice:  # pylint: disable=R0902
+    """State of one simulated SONiC device."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        hostname: str,
+        root: str,
+        sonic_version: str = "202205",
+        latency: float = 0.0,
+        failures: Optional[dict[str, int]] = None,
+        hangs: Optional[list[str]] = None,
+        disconnects: Optional[list[str]] = None,
+        refuse_auth: bool = False,
+        without_version: bool = False,
+    ) -> None:
+        """Create the filesystem of the device."""
+        self.hostname = hostname
+        self.root = root
+        self.latency = latency
+        self.failures = failures or {}
+        self.hangs = hangs or []
+        self.disconnects = disconnects or []
+        self.refuse_auth = refuse_auth
+        self.enabled: set[str] = set()
+        self.active: set[str] = set()
+        self.port = 0
+        # devices of the fleet, reached by curl; address and directory served by http.server
+        self.peers: dict[str, "SimulatedDevice"] = {}
+        self.served_address: Optional[str] = None
+        self.served_directory: Optional[str] = None
+        self.reset_counters()
+
+        os.makedirs(self.path("/tmp"), exist_ok=True)
+        if not without_version:
+            self.write("/etc/sonic/sonic_release", f"{sonic_version}\n")
+
+    def reset_counters(self) -> None:
+        """Forget the commands, uploads and connections of the previous runs."""
+        # commands run on the device, in order
+        self.commands: list[str] = []
+        self.uploads = 0
+        self.connections = 0
+        # devices files were copied from with curl
+        self.copied_from: list[str] = []
+
+    @property
+    def round_trips(self) -> int:
+        """Return the number of commands and file transfers."""
+        return len(self.commands) + self.uploads
+
+    def path(self, path: str) -> str:
+        """Return the local path of a path of the device."""
+        return os.path.join(self.root, os.path.normpath(path).lstrip("/"))
+
+    def read(self, path: str) -> str:
+        """Read a file of the device."""
+        with open(self.path(path), encoding="utf-8") as device_file:
+            return device_file.read()
+
+    def write(self, path: str, content: str) -> None:
+        """Write a file of the device."""
+        os.makedirs(os.path.dirname(self.path(path)), exist_ok=True)
+        with open(self.path(path), "w", encoding="utf-8") as device_file:
+            device_file.write(content)
+
+    ##
+    # SSH server side
+    ##
+
+    async def handle_process(self, process: asyncssh.SSHServerProcess) -> None:
+        """Run the command of an SSH session."""
+        await asyncio.sleep(self.latency)
+        command = process.command or ""
+        if any(pattern in command for pattern in self.hangs):
+            self.commands.append(command)
+            # until the client gives up
+            await process.wait_closed()
+            return
+
+        disconnect = next((pattern for pattern in self.disconnects if pattern in command), None)
+        if disconnect:
+            self.commands.append(command)
+            self.disconnects.remove(disconnect)
+            process.channel.get_connection().abort()
+            return
+
+        status, stdout, stderr = self.run(command)
+        process.stdout.write(stdout)
+        process.stderr.write(stderr)
+        process.exit(status)
+
+    def start_sftp(self, chan: asyncssh.SSHServerChannel) -> asyncssh.SFTPServer:
+        """Start the SFTP server used by SCP, jailed in the device root."""
+        self.uploads += 1
+        return _SFTPServer(chan, self)
+
+    ##
+    # Shell
+    ##
+
+    def run(self, command: str) -> tuple[int, str, str]:
+        """Run a command line, return its exit status, stdout and stderr."""
+        self.commands.append(command)
+        for pattern, status in self.failures.items():
+            if pattern in command:
+                return status, "", f"injected failure: {pattern}\n"
+
+        if command.startswith("sudo sh -c ") or "$(" in command:
+            return self._run_script(command)
+        return self._run_list(command)
+
+    def _run_script(self, command: str) -> tuple[int, str, str]:
+        """Run a shell script with the local sh, jailed in the device root."""
+        if command.startswith("sudo "):
+            command = command[len("sudo ") :]
+        script = _DEVICE_PATHS.sub(f"{self.root}/", command)
+        process = subprocess.run(
+            ["sh", "-c", script], capture_output=True, text=True, check=False, cwd=self.root
+        )
+        return process.returncode, process.stdout, process.stderr
+
+    def _run_list(self, command: str) -> tuple[int, str, str]:
+        """Run commands joined by && and ||, or an if statement."""
+        match = _IF_STATEMENT.match(command)
+        if match:
+            status, stdout, stderr = self._run_list(match["condition"])
+            if status:
+                return 0, stdout, stderr
+            return self._run_list(match["body"])
+
+        status, stdout, stderr = 0, "", ""
+        operator = "&&"
+        for index, item in enumerate(_OPERATORS.split(command)):
+            if index % 2:
+                operator = item
+                continue
+            if (operator == "&&" and status) or (operator == "||" and not status):
+                continue
+            status, out, err = self._run_pipeline(item)
+            stdout += out
+            stderr += err
+
+        return status, stdout, stderr
+
+    def _run_pipeline(self, pipeline: str) -> tuple[int, str, str]:
+        status, stdout, stderr = 0, "", ""
+        for command in pipeline.split(" | "):
+            status, stdout, err = self._run_command(command, stdout)
+            stderr += err
+
+        return status, stdout, stderr
+
+    def _run_command(self, command: str, stdin: str) -> tuple[int, str, str]:
+        """Run one simple command."""
+        command = command.replace("2> /dev/null", "").strip()
+        if command.startswith("(") and command.endswith(")"):
+            command = command[1:-1]
+        args = shlex.split(command)
+        while args and args[0] == "sudo":
+            args = args[1:]
+        if " ".join(args).startswith(LOW_PRIORITY):
+            args = args[len(LOW_PRIORITY.split()) :]
+
+        if not args:
+            return 0, "", ""
+
+        handler = getattr(self, f"_cmd_{args[0].replace('-', '_')}", None)
+        if args[0] == "[":
+            handler = self._cmd_test
+        if handler is None:
+            return NOT_FOUND, "", f"{args[0]}: command not found\n"
+
+        try:
+            return handler(args[1:], stdin)
+        except OSError as error:
+            return 1, "", f"{args[0]}: {error.strerror}\n"
+
+    def _cmd_exit(self, args: list[str], _: str) -> tuple[int, str, str]:
+        return int(args[0]) if args else 0, "", ""
+
+    def _cmd_echo(self, args: list[str], _: str) -> tuple[int, str, str]:
+        # the devices are reached on 127.0.0.1
+        ssh_connection = f"127.0.0.1 0 127.0.0.1 {self.port}"
+        return 0, " ".join(args).replace("$SSH_CONNECTION", ssh_connection) + "\n", ""
+
+    def _cmd_cat(self, args: list[str], _: str) -> tuple[int, str, str]:
+        return 0, "".join(self.read(path) for path in args), ""
+
+    def _cmd_ls(self, args: list[str], _: str) -> tuple[int, str, str]:
+        if not os.path.exists(self.path(args[-1])):
+            return 2, "", f"ls: cannot access '{args[-1]}': No such file or directory\n"
+        return 0, f"{args[-1]}\n", ""
+
+    def _cmd_test(self, args: list[str], _: str) -> tuple[int, str, str]:
+        args = [arg for arg in args if arg != "]"]
+        negate = args[0] == "!"
+        if negate:
+            args = args[1:]
+        flag, path = args
+        result = {
+            "-e": os.path.exists,
+            "-d": os.path.isdir,
+            "-x": lambda local: os.access(local, os.X_OK),
+        }[flag](self.path(path))
+        return int(result == negate), "", ""
+
+    def _cmd_sha256sum(self, args: list[str], _: str) -> tuple[int, str, str]:
+        with open(self.path(args[0]), "rb") as device_file:
+            checksum = hashlib.sha256(device_file.read()).hexdigest()
+        return 0, f"{checksum}  {args[0]}\n", ""
+
+    def _cmd_grep(self, args: list[str], _: str) -> tuple[int, str, str]:
+        pattern, path = args
+        lines = [line for line in self.read(path).splitlines() if pattern in line]
+        return int(not lines), "".join(f"{line}\n" for line in lines), ""
+
+    def _cmd_tee(self, args: list[str], stdin: str) -> tuple[int, str, str]:
+        self.write(args[0], stdin)
+        return 0, stdin, ""
+
+    def _cmd_mkdir(self, args: list[str], _: str) -> tuple[int, str, str]:
+        os.makedirs(self.path(args[-1]), exist_ok=True)
+        return 0, "", ""
+
+    def _cmd_mv(self, args: list[str], _: str) -> tuple[int, str, str]:
+        source, destination = self.path(args[0]), self.path(args[1])
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, os.path.basename(source))
+        os.replace(source, destination)
+        return 0, "", ""
+
+    def _cmd_cp(self, args: list[str], _: str) -> tuple[int, str, str]:
+        source, destination = self.path(args[-2]), self.path(args[-1])
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, os.path.basename(source))
+        shutil.copytree(source, destination, dirs_exist_ok=True)
+        return 0, "", ""
+
+    def _cmd_ln(self, args: list[str], _: str) -> tuple[int, str, str]:
+        target, link = self.path(args[-2]), self.path(args[-1])
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(target, link)
+        return 0, "", ""
+
+    def _cmd_rm(self, args: list[str], _: str) -> tuple[int, str, str]:
+        if os.path.lexists(self.path(args[-1])):
+            os.remove(self.path(args[-1]))
+        return 0, "", ""
+
+    def _cmd_setsid(self, args: list[str], _: str) -> tuple[int, str, str]:
+        # only "python3 -m http.server <port> --bind <address> --directory <directory>",
+        # in background
+        self.served_address = args[args.index("--bind") + 1]
+        self.served_directory = args[args.index("--directory") + 1]
+        return 0, "", ""
+
+    def _cmd_curl(self, args: list[str], _: str) -> tuple[int, str, str]:
+        url = args[-1]
+        host, name = url.split("/")[2].split(":")[0], url.rsplit("/", 1)[1]
+        # the device probes its own server on its address, its peers use its hostname
+        peer = self if host == self.served_address else self.peers.get(host)
+        if peer is None or peer.served_directory is None:
+            return 7, "", f"curl: (7) Failed to connect to {host}\n"
+
+        # a HEAD request (-I) has no output file
+        if "-o" not in args:
+            if not os.path.exists(peer.path(f"{peer.served_directory}/{name}")):
+                return 22, "", "curl: (22) The requested URL returned error: 404\n"
+            return 0, "HTTP/1.0 200 OK\n", ""
+
+        shutil.copyfile(
+            peer.path(f"{peer.served_directory}/{name}"), self.path(args[args.index("-o") + 1])
+        )
+        self.copied_from.append(host)
+        return 0, "", ""
+
+    def _cmd_chown(self, args: list[str], _: str) -> tuple[int, str, str]:
+        if not os.path.exists(self.path(args[-1])):
+            return 1, "", f"chown: cannot access '{args[-1]}'\n"
+        return 0, "", ""
+
+    def _cmd_chmod(self, args: list[str], _: str) -> tuple[int, str, str]:
+        mode, path = args
+        local = self.path(path)
+        if mode == "+x":
+            os.chmod(local, os.stat(local).st_mode | 0o111)
+        else:
+            os.chmod(local, int(mode, 8))
+        return 0, "", ""
+
+    def _cmd_systemctl(self, args: list[str], _: str) -> tuple[int, str, str]:
+        action, units = args[0], [unit for unit in args[1:] if not unit.startswith("--")]
+        if action == "daemon-reload":
+            return 0, "", ""
+        if action == "is-enabled":
+            enabled = units[0] in self.enabled
+            return int(not enabled), "enabled\n" if enabled else "disabled\n", ""
+        if action == "is-active":
+            active = units[0] in self.active
+            return 3 * int(not active), "active\n" if active else "inactive\n", ""
+
+        for unit in units:
+            if not os.path.exists(self.path(f"/etc/systemd/system/{unit}")):
+                return 5, "", f"Failed to {action} {unit}: Unit {unit} not found.\n"
+
+        if action == "enable":
+            self.enabled.update(units)
+            if "--now" in args:
+                self.active.update(units)
+        elif action == "restart":
+            self.active.update(units)
+        elif action != "try-restart":
+            return 1, "", f"Unknown command verb {action}.\n"
+
+        return 0, "", ""
+
+
+class _SFTPServer(asyncssh.SFTPServer):
+    """SFTP server of a device, delayed by the latency of the device."""
+
+    def __init__(self, chan: asyncssh.SSHServerChannel, device: SimulatedDevice) -> None:
+        super().__init__(chan, chroot=device.root.encode())
+        self.device = device
+
+    async def open(self, path, pflags, attrs):  # type: ignore
+        await asyncio.sleep(self.device.latency)
+        return super().open(path, pflags, attrs)
+
+
+class _SSHServer(asyncssh.SSHServer):
+    """Password authentication of a device."""
+
+    def __init__(self, device: SimulatedDevice) -> None:
+        self.device = device
+
+    def connection_made(self, conn: asyncssh.SSHServerConnection) -> None:
+        self.device.connections += 1
+
+    def begin_auth(self, username: str) -> bool:
+        return True
+
+    def password_auth_supported(self) -> bool:
+        return True
+
+    async def validate_password(self, username: str, password: str) -> bool:
+        await asyncio.sleep(self.device.latency)
+        return not self.device.refuse_auth and (username, password) == (USERNAME, PASSWORD)
+
+
+class _JumpHostServer(asyncssh.SSHServer):
+    """No authentication, connections to the devices are forwarded."""
+
+    def __init__(self, jump_host: "SimulatedJumpHost") -> None:
+        self.jump_host = jump_host
+
+    def connection_made(self, conn: asyncssh.SSHServerConnection) -> None:
+        self.jump_host.connections.append(conn)
+
+    def begin_auth(self, username: str) -> bool:
+        return False
+
+    def connection_requested(self, dest_host: str, dest_port: int, *_) -> bool:
+        self.jump_host.channels += 1
+        return True
+
+
+class SimulatedJumpHost:
+    """Jump host listening on a local port, which forwards the connections to the devices."""
+
+    def __init__(self) -> None:
+        """Initialize the counters."""
+        # connections to the jump host, and devices tunneled over them
+        self.connections: list[asyncssh.SSHServerConnection] = []
+        self.channels = 0
+        self.port = 0
+        self._server: Optional[asyncssh.SSHAcceptor] = None
+
+    @property
+    def endpoint(self) -> str:
+        """Return the address:port of the jump host, see CONF.jump_hosts."""
+        return f"127.0.0.1:{self.port}"
+
+    async def __aenter__(self) -> "SimulatedJumpHost":
+        self._server = await asyncssh.listen(
+            "127.0.0.1",
+            0,
+            server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+            server_factory=partial(_JumpHostServer, self),
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class SimulatedFleet:
+    """Devices named switch<N>, each one listening on its own local port."""
+
+    def __init__(self, root: str, size: int, **device_options) -> None:
+        """Create the devices, see SimulatedDevice for the options."""
+        self.devices = {
+            f"switch{index}": SimulatedDevice(
+                f"switch{index}", f"{root}/switch{index}", **device_options
+            )
+            for index in range(size)
+        }
+        for device in self.devices.values():
+            device.peers = self.devices
+        self._servers: list[asyncssh.SSHAcceptor] = []
+
+    @property
+    def endpoints(self) -> dict[str, str]:
+        """Return hostname -> address:port, see CONF.ssh_endpoints."""
+        return {hostname: f"127.0.0.1:{device.port}" for hostname, device in self.devices.items()}
+
+    async def start(self) -> None:
+        """Start the SSH servers of all devices."""
+        host_key = asyncssh.generate_private_key("ssh-ed25519")
+        for device in self.devices.values():
+            server = await asyncssh.listen(
+                "127.0.0.1",
+                0,
+                server_host_keys=[host_key],
+                server_factory=partial(_SSHServer, device),
+                process_factory=device.handle_process,
+                sftp_factory=device.start_sftp,
+                allow_scp=True,
+                backlog=1024,
+            )
+            device.port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+
+    async def stop(self) -> None:
+        """Stop the SSH servers of all devices."""
+        for server in self._servers:
+            server.close()
+        await asyncio.gather(*[server.wait_closed() for server in self._servers])
+        self._servers = []
+
+    async def __aenter__(self) -> "SimulatedFleet":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.stop()
+
+    def stats(self, duration: float) -> dict[str, float]:
+        """Return the load statistics of a run which lasted duration seconds."""
+        size = len(self.devices)
+        return {
+            "devices": size,
+            "duration": round(duration, 3),
+            "devices_per_second": round(size / duration, 1),
+            "round_trips_per_device": round(
+                sum(device.round_trips for device in self.devices.values()) / size, 1
+            ),
+            "peak_rss_mib": round(peak_rss_mib(), 1),
+        }
+
+
+async def run_deployment(fleet: SimulatedFleet) -> dict[str, float]:
+    """Deploy on all the devices of the fleet, return the load statistics."""
+    from app.main import start_deployment  # noqa: PLC0415
+
+    for device in fleet.devices.values():
+        device.reset_counters()
+
+    start = time.perf_counter()
+    await start_deployment(dict.fromkeys(fleet.devices, {USERNAME: PASSWORD}), list(fleet.devices))
+    return fleet.stats(time.perf_counter() - start)
@@ -0,0 +1,123 @@
+"""Tests for the credentials of the devices."""
+import asyncio
+import sys
+import types
+
+import pytest
+
+from app.credentials import StaticCredentials, VaultCredentials
+from app.settings import CONF
+
+SECRETS = {
+    "sonic/par1": {"admin": "par1-password", "admin_default": "YourPaSsWoRd"},
+    "sonic/ams1": {"admin": "ams1-password", "admin_default": "YourPaSsWoRd"},
+    "sonic/nyc1": {"admin": "nyc1-password"},
+}
+
+
+class VaultError(Exception):
+    """hvac.exceptions.VaultError."""
+
+
+class FakeVaultClient:
+    """Record the calls to Vault."""
+
+    calls: list = []
+    expired = False
+
+    def __init__(self, url):
+        """Connect to Vault."""
+        self.url = url
+        self.auth = types.SimpleNamespace(
+            ldap=types.SimpleNamespace(login=self._login),
+        )
+        self.secrets = types.SimpleNamespace(
+            kv=types.SimpleNamespace(read_secret_version=self._read)
+        )
+
+    def _login(self, username, password):
+        self.calls.append("login")
+        return {"auth": {"lease_duration": 3600, "renewable": True}}
+
+    def _read(self, path, mount_point):
+        self.calls.append(path)
+        if path not in SECRETS:
+            raise VaultError(f"no secret at {path}")
+        return {"data": {"data": SECRETS[path]}}
+
+    def is_authenticated(self):
+        """Return if logged in."""
+        return True
+
+    def logout(self, revoke_token):
+        """Revoke the token, fail if it expired."""
+        self.calls.append("logout")
+        if self.expired:
+            raise VaultError("permission denied")
+
+
+@pytest.fixture(name="vault")
+def fixture_vault(monkeypatch):
+    """Read the credentials from a fake Vault, return the calls to Vault."""
+    hvac = types.ModuleType("hvac")
+    hvac.Client = FakeVaultClient
+    hvac.exceptions = types.SimpleNamespace(VaultError=VaultError)
+    monkeypatch.setitem(sys.modules, "hvac", hvac)
+    monkeypatch.setattr(FakeVaultClient, "calls", [])
+    monkeypatch.setattr(CONF, "vault_url", "https://vault.example.net")
+    monkeypatch.setattr(CONF, "vault_secret_path", "sonic/{site}")
+    monkeypatch.setattr(CONF, "vault_device_usernames", ["admin", "admin_default"])
+    return FakeVaultClient.calls
+
+
+def test_static_credentials():
+    """All devices have the same credentials."""
+    credentials = asyncio.run(StaticCredentials({"admin": "password"}).get_all(["a", "b"]))
+
+    assert credentials == {"a": {"admin": "password"}, "b": {"admin": "password"}}
+
+
+def test_secrets_are_read_once_per_path(vault):
+    """Each path is read once, with a single login."""
+    hostnames = ["switch1.par1.example.net", "switch2.par1.example.net", "switch1.ams1.example.net"]
+    provider = VaultCredentials()
+
+    credentials = asyncio.run(provider.get_all(hostnames))
+    provider.close()
+
+    assert credentials["switch2.par1.example.net"]["admin"] == "par1-password"
+    assert credentials["switch1.ams1.example.net"]["admin"] == "ams1-password"
+    assert sorted(vault) == ["login", "logout", "sonic/ams1", "sonic/par1"]
+
+
+def test_missing_secrets_fail_their_devices_only(vault, caplog):
+    """Devices without secret get no credentials, the others are deployed."""
+    credentials = asyncio.run(
+        VaultCredentials().get_all(
+            ["switch1.nyc1.example.net", "switch1.lon1.example.net", "switch1.par1.example.net"]
+        )
+    )
+
+    assert credentials == {
+        "switch1.nyc1.example.net": {},
+        "switch1.lon1.example.net": {},
+        "switch1.par1.example.net": SECRETS["sonic/par1"],
+    }
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(
+        "switch1.nyc1.example.net in sonic/nyc1" in message and "admin_default" in message
+        for message in messages
+    )
+    assert any("switch1.lon1.example.net in sonic/lon1" in message for message in messages)
+
+
+def test_token_revocation_failure_is_logged(vault, monkeypatch, caplog):
+    """The secrets are read even if the token expired before its revocation."""
+    monkeypatch.setattr(FakeVaultClient, "expired", True)
+    provider = VaultCredentials()
+    asyncio.run(provider.get_all(["switch1.par1.example.net"]))
+
+    provider.close()
+
+    assert vault == ["login", "sonic/par1", "logout"]
+    assert "unable to revoke the Vault token" in caplog.text
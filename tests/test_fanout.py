@@ -0,0 +1,55 @@
+"""Tests for the selection of the devices the PEX is copied from."""
+import asyncio
+
+from app.fanout import FanOut
+from app.settings import CONF
+
+CHECKSUM = "0" * 64
+
+
+def test_sources_serve_a_limited_number_of_devices(monkeypatch):
+    """The first device is the seed, each source serves minion_fanout_degree devices."""
+    monkeypatch.setattr(CONF, "minion_fanout_degree", 2)
+
+    async def acquire_all():
+        fanout = FanOut()
+        site, source = await fanout.acquire("switch0.par1.lan", CHECKSUM)
+        assert source is None
+        waiting = asyncio.ensure_future(fanout.acquire("switch1.par1.lan", CHECKSUM))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        await fanout.release(site, "switch0.par1.lan", None, serving=True)
+        acquired = [await waiting, await fanout.acquire("switch2.par1.lan", CHECKSUM)]
+        # switch0 serves 2 devices: switch3 waits for switch1 to become a source
+        waiting = asyncio.ensure_future(fanout.acquire("switch3.par1.lan", CHECKSUM))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        await fanout.release(site, "switch1.par1.lan", "switch0.par1.lan", serving=True)
+        acquired.append(await waiting)
+        assert {acquired_site for acquired_site, _ in acquired} == {site}
+        # another site has its own seed
+        acquired.append(await fanout.acquire("switch0.ams1.lan", CHECKSUM))
+        assert acquired[-1][0] is not site
+        return [source for _, source in acquired]
+
+    assert asyncio.run(acquire_all()) == [
+        "switch0.par1.lan",
+        "switch0.par1.lan",
+        "switch1.par1.lan",
+        None,
+    ]
+
+
+def test_failed_seed_is_replaced():
+    """Another device becomes the seed if the seed failed to get the PEX."""
+
+    async def acquire_after_failure():
+        fanout = FanOut()
+        site, _ = await fanout.acquire("switch0.par1.lan", CHECKSUM)
+        waiting = asyncio.ensure_future(fanout.acquire("switch1.par1.lan", CHECKSUM))
+        await asyncio.sleep(0)
+        await fanout.release(site, "switch0.par1.lan", None, serving=False)
+        return await waiting
+
+    assert asyncio.run(acquire_after_failure())[1] is None
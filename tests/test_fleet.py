@@ -0,0 +1,374 @@
+"""End-to-end tests of the deployment on a simulated fleet."""
+import asyncio
+import json
+import os
+
+import pytest
+from fleet import SimulatedJumpHost, run_deployment
+
+from app.drain import DRAIN
+from app.settings import CONF
+
+
+@pytest.fixture(name="report")
+def fixture_report(tmp_path, monkeypatch):
+    """Write the run report to a temporary file, return the outcome of each device."""
+    path = tmp_path / "report.jsonl"
+    monkeypatch.setattr(CONF, "report_file", str(path))
+
+    def outcomes():
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        return {line["hostname"]: line["outcome"] for line in lines if line["type"] == "device"}
+
+    return outcomes
+
+
+@pytest.fixture(name="drain")
+def fixture_drain():
+    """Request a drain when a device runs a command, reset it after the test."""
+
+    def request_on(device, pattern):
+        handle_process = device.handle_process
+
+        async def handle_and_drain(process):
+            if pattern in (process.command or ""):
+                DRAIN.request()
+            await handle_process(process)
+
+        device.handle_process = handle_and_drain
+
+    yield request_on
+    DRAIN.reset()
+
+
+async def _deploy(fleet, monkeypatch):
+    async with fleet:
+        monkeypatch.setattr(CONF, "ssh_endpoints", fleet.endpoints)
+        return await run_deployment(fleet)
+
+
+def test_deploy_then_nothing_to_do(simulated_fleet, monkeypatch, report):
+    """A second run finds everything deployed and changes nothing."""
+    fleet = simulated_fleet(3)
+
+    stats = asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert set(report().values()) == {"succeeded"}
+    assert stats["devices"] == 3
+    device = fleet.devices["switch0"]
+    assert device.read("/etc/salt/minion") == CONF.minion_config
+    assert "salt-minion.service" in device.active
+    assert "salt-update-grains.timer" in device.enabled
+    assert device.uploads == 6
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert set(report().values()) == {"already_deployed"}
+    assert device.uploads == 0
+
+
+def test_grains_path_unit(simulated_fleet, monkeypatch, report):
+    """The grains path unit is installed only if enabled."""
+    monkeypatch.setattr(CONF, "grains_path_unit", True)
+    fleet = simulated_fleet(1)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "succeeded"}
+    assert "salt-update-grains.path" in fleet.devices["switch0"].active
+
+
+def test_failures_are_isolated(simulated_fleet, monkeypatch, report):
+    """A failing device does not prevent the deployment on the others."""
+    fleet = simulated_fleet(4)
+    fleet.devices["switch1"].refuse_auth = True
+    fleet.devices["switch2"].failures = {"sudo mv /tmp/salt-minion": 1}
+    fleet.devices["switch3"].failures = {"sonic_release": 1}
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {
+        "switch0": "succeeded",
+        "switch1": "failed",
+        "switch2": "failed",
+        "switch3": "failed",
+    }
+    assert "salt-minion.service" not in fleet.devices["switch2"].active
+
+
+def test_dry_run_changes_nothing(simulated_fleet, monkeypatch, report):
+    """Dry-run only checks the devices."""
+    monkeypatch.setattr(CONF, "dry_run", True)
+    fleet = simulated_fleet(2)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert set(report().values()) == {"to_deploy"}
+    assert not any(device.uploads for device in fleet.devices.values())
+
+
+def test_hung_command_is_aborted(simulated_fleet, monkeypatch, report):
+    """The watchdog aborts the device with a hung command, the others are deployed."""
+    monkeypatch.setattr(CONF, "command_timeout", 0.5)
+    fleet = simulated_fleet(3)
+    fleet.devices["switch1"].hangs = ["sha256sum /opt/salt/update_grains.py"]
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "succeeded", "switch1": "timeout", "switch2": "succeeded"}
+
+
+def test_hung_device_is_aborted(simulated_fleet, monkeypatch, report):
+    """A device slower than the device timeout is aborted."""
+    monkeypatch.setattr(CONF, "device_timeout", 1)
+    fleet = simulated_fleet(2)
+    fleet.devices["switch0"].latency = 0.2
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "timeout", "switch1": "succeeded"}
+
+
+def test_connection_reset_is_retried(simulated_fleet, monkeypatch, tmp_path, report):
+    """The device is reconnected after a connection reset."""
+    monkeypatch.setattr(CONF, "retry_base_delay", 0.01)
+    fleet = simulated_fleet(2)
+    fleet.devices["switch0"].disconnects = ["sha256sum /opt/salt/update_grains.py"]
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "succeeded", "switch1": "succeeded"}
+    lines = (tmp_path / "report.jsonl").read_text().splitlines()
+    assert [json.loads(line).get("attempts") for line in lines[:-1]].count(2) == 1
+
+
+def test_authentication_failure_is_not_retried(simulated_fleet, monkeypatch, report):
+    """A rejected password is final."""
+    monkeypatch.setattr(CONF, "retry_base_delay", 0.01)
+    fleet = simulated_fleet(1, refuse_auth=True)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "failed"}
+    assert fleet.devices["switch0"].connections == 1
+
+
+def test_drain_skips_deployments_not_started(simulated_fleet, monkeypatch, report, drain):
+    """After a drain request, the devices are checked but not deployed."""
+    fleet = simulated_fleet(2)
+    fleet.devices["switch1"].latency = 0.05
+    drain(fleet.devices["switch0"], "sha256sum /opt/salt/update_grains.py")
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "skipped", "switch1": "skipped"}
+    assert not any(device.uploads for device in fleet.devices.values())
+
+
+def test_drain_during_deployment_skips_remaining_components(
+    simulated_fleet, monkeypatch, tmp_path, report, drain
+):
+    """The components in progress finish, the ones not started are skipped."""
+    fleet = simulated_fleet(1)
+    drain(fleet.devices["switch0"], "sudo mv /tmp/salt-minion")
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "skipped"}
+    (line,) = (
+        json.loads(line)
+        for line in (tmp_path / "report.jsonl").read_text().splitlines()
+        if json.loads(line)["type"] == "device"
+    )
+    assert "minion" in line["changed"]
+    assert line["failed"] == []
+    assert "salt-minion.service" not in fleet.devices["switch0"].active
+
+
+def test_drain_cancels_devices_at_deadline(simulated_fleet, monkeypatch, report, drain):
+    """The devices still in progress at the drain deadline are cancelled."""
+    monkeypatch.setattr(CONF, "drain_timeout", 0.2)
+    fleet = simulated_fleet(1)
+    fleet.devices["switch0"].hangs = ["sha256sum /opt/salt/update_grains.py"]
+    drain(fleet.devices["switch0"], "sha256sum /opt/salt/update_grains.py")
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "cancelled"}
+
+
+def test_devices_are_tunneled_over_shared_jump_host_connections(
+    simulated_fleet, monkeypatch, report
+):
+    """The devices behind a jump host share a few connections to it."""
+    monkeypatch.setattr(CONF, "jump_host_max_channels", 2)
+    fleet = simulated_fleet(5)
+
+    async def deploy_through_jump_host():
+        async with SimulatedJumpHost() as jump_host:
+            monkeypatch.setattr(CONF, "jump_hosts", {"default": f"deployer@{jump_host.endpoint}"})
+            await _deploy(fleet, monkeypatch)
+            return jump_host
+
+    jump_host = asyncio.run(deploy_through_jump_host())
+
+    assert set(report().values()) == {"succeeded"}
+    assert jump_host.channels == 5
+    assert len(jump_host.connections) == 3
+
+
+def test_minion_fanout(simulated_fleet, monkeypatch, report):
+    """The PEX is uploaded once per site, the other devices copy it from each other."""
+    monkeypatch.setattr(CONF, "minion_fanout", True)
+    monkeypatch.setattr(CONF, "minion_fanout_degree", 2)
+    fleet = simulated_fleet(6)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert set(report().values()) == {"succeeded"}
+    copies = [device.copied_from for device in fleet.devices.values()]
+    assert sorted(len(copied_from) for copied_from in copies) == [0, 1, 1, 1, 1, 1]
+    # the sources serve the PEX on their management address
+    sources = {source for copied_from in copies for source in copied_from}
+    assert {fleet.devices[source].served_address for source in sources} == {"127.0.0.1"}
+    # the files of the other components are still uploaded to every device
+    assert sum(device.uploads for device in fleet.devices.values()) == 6 * 5 + 1
+    checksums = {
+        device.run("sha256sum /opt/salt/salt-minion")[1].split()[0]
+        for device in fleet.devices.values()
+    }
+    assert len(checksums) == 1
+
+
+def test_minion_fanout_falls_back_to_upload(simulated_fleet, monkeypatch, report):
+    """A device which cannot copy the PEX from a peer gets it from the deployer."""
+    monkeypatch.setattr(CONF, "minion_fanout", True)
+    monkeypatch.setattr("app.deployers.minion.SERVE_PROBE_INTERVAL", 0)
+    fleet = simulated_fleet(3, failures={"curl": 7})
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert set(report().values()) == {"succeeded"}
+    assert [device.uploads for device in fleet.devices.values()] == [6, 6, 6]
+
+
+def test_concurrency_limits(simulated_fleet, monkeypatch, report):
+    """The devices wait for a slot, their connections for the handshake rate."""
+    monkeypatch.setattr(CONF, "max_concurrent_devices", 2)
+    monkeypatch.setattr(CONF, "site_handshake_rate", 20)
+    monkeypatch.setattr(CONF, "site_handshake_burst", 1)
+    fleet = simulated_fleet(4)
+
+    stats = asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert set(report().values()) == {"succeeded"}
+    assert stats["duration"] > 3 / 20
+
+
+def test_reused_plan_is_invalidated_when_the_desired_state_changes(
+    simulated_fleet, monkeypatch, tmp_path, report
+):
+    """A device planned as ready is skipped, unless what would be deployed changed."""
+    monkeypatch.setattr(CONF, "plan_file", str(tmp_path / "plans.json"))
+    fleet = simulated_fleet(1)
+    device = fleet.devices["switch0"]
+    asyncio.run(_deploy(fleet, monkeypatch))
+    monkeypatch.setattr(CONF, "dry_run", True)
+    asyncio.run(_deploy(fleet, monkeypatch))
+    monkeypatch.setattr(CONF, "dry_run", False)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "already_deployed"}
+    assert device.connections == 0
+
+    minion_config = "master: salt2.lan\n"
+    (tmp_path / "minion.yml").write_text(minion_config)
+    monkeypatch.setattr(CONF, "minion_config_file", str(tmp_path / "minion.yml"))
+    monkeypatch.setattr(CONF, "minion_config", minion_config)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "succeeded"}
+    assert device.connections == 1
+    assert device.read("/etc/salt/minion") == minion_config
+
+
+def test_two_phase_rollout(simulated_fleet, monkeypatch, report):
+    """The PEX is staged, activated, then rolled back to the minion deployed before."""
+    fleet = simulated_fleet(1)
+    device = fleet.devices["switch0"]
+    asyncio.run(_deploy(fleet, monkeypatch))
+    minion = device.path("/opt/salt/salt-minion")
+    legacy = device.path("/opt/salt/releases/salt-minion-legacy")
+
+    monkeypatch.setattr(CONF, "minion_rollout", "stage")
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "succeeded"}
+    assert not os.path.islink(minion)
+    (release,) = os.listdir(device.path("/opt/salt/releases"))
+
+    monkeypatch.setattr(CONF, "minion_rollout", "activate")
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "succeeded"}
+    assert os.path.realpath(minion) == device.path(f"/opt/salt/releases/{release}")
+    assert os.path.realpath(device.path("/opt/salt/salt-minion.previous")) == legacy
+
+    monkeypatch.setattr(CONF, "minion_rollout", "rollback")
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "succeeded"}
+    assert os.path.realpath(minion) == legacy
+    asyncio.run(_deploy(fleet, monkeypatch))
+    assert report() == {"switch0": "already_deployed"}
+
+
+def test_rollback_without_previous_release_fails(simulated_fleet, monkeypatch, report):
+    """A device without previously active PEX cannot be rolled back."""
+    monkeypatch.setattr(CONF, "minion_rollout", "rollback")
+    fleet = simulated_fleet(1)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    assert report() == {"switch0": "failed"}
+    assert not os.path.exists(fleet.devices["switch0"].path("/opt/salt/salt-minion"))
+
+
+def test_chrome_trace(simulated_fleet, monkeypatch, tmp_path, report):
+    """The trace has one thread per device, with the spans of its deployment."""
+    monkeypatch.setattr(CONF, "trace_file", str(tmp_path / "trace.json"))
+    fleet = simulated_fleet(2)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    threads = {event["args"]["name"]: event["tid"] for event in events if event["ph"] == "M"}
+    assert sorted(threads) == ["switch0", "switch1"]
+    spans = [event for event in events if event["ph"] == "X"]
+    for tid in threads.values():
+        names = {event["name"] for event in spans if event["tid"] == tid}
+        assert {"deploy_on_device", "connect", "run", "upload", "deploy"} <= names
+    assert all(event["dur"] >= 0 for event in spans)
+
+
+def test_otlp_trace(simulated_fleet, monkeypatch, tmp_path, report):
+    """The trace has one trace per device, the spans of a device are nested in its root span."""
+    monkeypatch.setattr(CONF, "trace_file", str(tmp_path / "trace.json"))
+    monkeypatch.setattr(CONF, "trace_format", "otlp")
+    fleet = simulated_fleet(2)
+
+    asyncio.run(_deploy(fleet, monkeypatch))
+
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    (scope,) = trace["resourceSpans"][0]["scopeSpans"]
+    spans = {span["spanId"]: span for span in scope["spans"]}
+    roots = [span for span in spans.values() if not span["parentSpanId"]]
+    assert sorted(span["name"] for span in roots) == ["deploy_on_device"] * 2
+    assert len({span["traceId"] for span in roots}) == 2
+    for span in spans.values():
+        if span["parentSpanId"]:
+            assert spans[span["parentSpanId"]]["traceId"] == span["traceId"]
+        assert int(span["startTimeUnixNano"]) <= int(span["endTimeUnixNano"])
+        assert span["status"] == {"code": 1}
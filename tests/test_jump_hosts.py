@@ -0,0 +1,55 @@
+"""Tests for the connections to the jump hosts."""
+import asyncio
+
+import pytest
+from fleet import SimulatedJumpHost
+
+from app.jump_hosts import JumpHostPool, get_jump_host, parse_jump_host
+from app.settings import CONF
+
+
+@pytest.mark.parametrize(
+    "jump_host, expected",
+    [
+        ("bastion.lan", (None, "bastion.lan", 22)),
+        ("deployer@bastion.lan:2222", ("deployer", "bastion.lan", 2222)),
+        ("deployer@[2001:db8::1]:22", ("deployer", "[2001:db8::1]", 22)),
+    ],
+)
+def test_parse_jump_host(jump_host, expected):
+    """The username and the port are optional."""
+    assert parse_jump_host(jump_host) == expected
+
+
+def test_jump_host_by_hostname_or_site(monkeypatch):
+    """A jump host of a hostname overrides the jump host of its site."""
+    monkeypatch.setattr(
+        CONF, "jump_hosts", {"par1": "bastion.par1", "switch2.par1.lan": "bastion.switch2"}
+    )
+
+    assert get_jump_host("switch1.par1.lan") == "bastion.par1"
+    assert get_jump_host("switch2.par1.lan") == "bastion.switch2"
+    assert get_jump_host("switch1.ams1.lan") is None
+
+
+def test_closed_upstream_is_replaced(monkeypatch):
+    """A closed connection to the jump host is replaced, released channels are reused."""
+    monkeypatch.setattr(CONF, "jump_host_max_channels", 1)
+
+    async def acquire_twice():
+        pool = JumpHostPool()
+        async with SimulatedJumpHost() as jump_host:
+            first = await pool.acquire(jump_host.endpoint)
+            pool.release(first)
+            assert await pool.acquire(jump_host.endpoint) is first
+
+            first.conn.abort()
+            await first.conn.wait_closed()
+            second = await pool.acquire(jump_host.endpoint)
+            await pool.close()
+            return jump_host, first, second
+
+    jump_host, first, second = asyncio.run(acquire_twice())
+
+    assert second is not first
+    assert len(jump_host.connections) == 2
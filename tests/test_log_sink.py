@@ -0,0 +1,64 @@
+"""Tests for the output of the logs of each device."""
+import json
+import logging
+
+import pytest
+from futurelog import FutureLogger
+
+from app.log_sink import DeviceLogSink
+
+FUTURE_LOGGER = FutureLogger("tests.sink")
+
+
+@pytest.fixture(name="logs")
+def fixture_logs():
+    """Record logs for two devices, forget those which are not flushed."""
+    FUTURE_LOGGER.info("switch0", "deploy %s", "minion")
+    FUTURE_LOGGER.debug("switch0", "hidden below INFO")
+    FUTURE_LOGGER.error("switch1", "failed")
+    FUTURE_LOGGER.warning("switch0", "done")
+    yield
+    FUTURE_LOGGER.logs.clear()
+
+
+def test_text_logs_go_through_logging(logs, caplog):
+    """The logs of the device are emitted by their logger, in order."""
+    with caplog.at_level(logging.INFO, logger="sink"):
+        DeviceLogSink().flush("switch0")
+
+    assert [record.getMessage() for record in caplog.records] == ["deploy minion", "done"]
+    assert "switch1" in FUTURE_LOGGER.logs
+
+
+def test_json_logs(logs, capsys):
+    """The logs of the device are written as JSON lines on stdout."""
+    DeviceLogSink(log_format="json").flush("switch0")
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(line["level"], line["message"]) for line in lines] == [
+        ("INFO", "deploy minion"),
+        ("WARNING", "done"),
+    ]
+    assert {(line["hostname"], line["logger"]) for line in lines} == {("switch0", "sink")}
+
+
+def test_text_logs_per_file(logs, tmp_path):
+    """The logs of each device are written in its own file."""
+    sink = DeviceLogSink(str(tmp_path))
+
+    sink.flush("switch0")
+    sink.flush("switch1")
+
+    expected = "INFO - sink: deploy minion\nWARNING - sink: done\n"
+    assert (tmp_path / "switch0.log").read_text() == expected
+    assert (tmp_path / "switch1.log").read_text() == "ERROR - sink: failed\n"
+    assert not FUTURE_LOGGER.logs
+
+
+def test_json_logs_per_file(logs, tmp_path):
+    """The JSON lines of each device are written in its own file."""
+    DeviceLogSink(str(tmp_path), "json").flush("switch0")
+
+    lines = (tmp_path / "switch0.jsonl").read_text().splitlines()
+    assert [json.loads(line)["message"] for line in lines] == ["deploy minion", "done"]
+    assert not (tmp_path / "switch1.jsonl").exists()
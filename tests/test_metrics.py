@@ -0,0 +1,130 @@
+"""Tests for the export of the metrics."""
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from app import metrics
+from app.settings import CONF
+
+
+class _PushgatewayHandler(BaseHTTPRequestHandler):
+    """Local stand-in of a Pushgateway: record the pushed requests."""
+
+    requests: list = []
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.requests.append((self.path, body.decode()))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(name="pushgateway")
+def fixture_pushgateway():
+    """Start a local Pushgateway stand-in."""
+    _PushgatewayHandler.requests = []
+    server = HTTPServer(("127.0.0.1", 0), _PushgatewayHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"127.0.0.1:{server.server_address[1]}", _PushgatewayHandler.requests
+
+    server.shutdown()
+
+
+@pytest.fixture(name="settings")
+def fixture_settings(monkeypatch, tmp_path):
+    """Reset export settings and deployment status series."""
+    monkeypatch.setattr(CONF, "prometheus_textfile_path", None)
+    monkeypatch.setattr(CONF, "prometheus_pushgateway_url", None)
+    metrics.prune_deployment_status([])
+    yield tmp_path
+    metrics.prune_deployment_status([])
+
+
+def test_export_textfile_prunes_removed_hosts(settings, monkeypatch):
+    """Series of hosts no longer in the inventory are not exported."""
+    textfile = settings / "deployer.prom"
+    monkeypatch.setattr(CONF, "prometheus_textfile_path", str(textfile))
+    metrics.set_deployment_status("switch1", "202205", 1)
+    metrics.set_deployment_status("switch2", "202205", -1)
+
+    metrics.export_metrics(["switch1"])
+
+    content = textfile.read_text()
+    assert 'hostname="switch1"' in content
+    assert 'hostname="switch2"' not in content
+    assert list(settings.iterdir()) == [textfile]
+
+
+def test_export_pushgateway(settings, monkeypatch, pushgateway):
+    """All metrics are pushed with PUT, to replace the series of the job."""
+    url, requests = pushgateway
+    monkeypatch.setattr(CONF, "prometheus_pushgateway_url", url)
+    metrics.set_deployment_status("switch1", "202205", 1)
+
+    metrics.export_metrics(["switch1"])
+
+    assert len(requests) == 1
+    path, body = requests[0]
+    assert path == f"/metrics/job/{CONF.prometheus_pushgateway_job}"
+    assert 'sonic_salt_minion_deployment_status{hostname="switch1"' in body
+
+
+def test_export_pushgateway_unreachable(settings, monkeypatch):
+    """An unreachable Pushgateway does not fail the run."""
+    monkeypatch.setattr(CONF, "prometheus_pushgateway_url", "127.0.0.1:1")
+
+    metrics.export_metrics([])
+
+
+def _samples(name):
+    return {
+        tuple(sample.labels.values()): sample.value
+        for metric in metrics.REGISTRY.collect()
+        for sample in metric.samples
+        if sample.name == name
+    }
+
+
+def test_version_change_expires_series(settings):
+    """The series of the previous SONiC version of a device is removed."""
+    metrics.set_deployment_status("switch1", "201911", 1)
+    metrics.set_deployment_status("switch2", "201911", 0)
+    metrics.set_deployment_status("switch1", "202205", -1)
+
+    assert _samples("sonic_salt_minion_deployment_status") == {
+        ("switch1", "202205"): -1,
+        ("switch2", "201911"): 0,
+    }
+    assert _samples("sonic_salt_deployer_sonic_version_devices") == {
+        ("201911",): 1,
+        ("202205",): 1,
+    }
+    assert _samples("sonic_salt_minion_deployment_status_devices") == {
+        ("waiting",): 1,
+        ("failed",): 1,
+    }
+
+    metrics.prune_deployment_status(["switch1"])
+
+    assert _samples("sonic_salt_deployer_sonic_version_devices") == {("202205",): 1}
+    assert _samples("sonic_salt_minion_deployment_status_devices") == {("failed",): 1}
+
+
+def test_per_host_metrics_disabled(settings, monkeypatch):
+    """Only aggregates are exported."""
+    monkeypatch.setattr(CONF, "prometheus_per_host_metrics", False)
+    metrics.set_deployment_status("switch1", "202205", 1)
+    metrics.set_deployment_status("switch1", "202205", 0)
+
+    assert not _samples("sonic_salt_minion_deployment_status")
+    assert _samples("sonic_salt_minion_deployment_status_devices") == {("waiting",): 1}
+
+    metrics.prune_deployment_status([])
+
+    assert not _samples("sonic_salt_minion_deployment_status_devices")
@@ -0,0 +1,31 @@
+"""Tests for the profiling of the deployer."""
+
+import asyncio
+import logging
+import pstats
+import time
+
+from app.profiling import run_profiled
+
+
+def test_profiled_run(tmp_path, caplog):
+    """The profile is saved in pstats format, and slow callbacks are logged."""
+    output = str(tmp_path / "run.pstats")
+    loop_settings = []
+
+    async def blocking_app():
+        loop = asyncio.get_running_loop()
+        loop_settings.append((loop.get_debug(), loop.slow_callback_duration))
+        # the step which enabled the debug mode is not measured
+        await asyncio.sleep(0)
+        time.sleep(0.05)  # noqa: ASYNC251
+
+    with caplog.at_level(logging.WARNING, logger="asyncio"):
+        run_profiled(blocking_app, output, 0.01)
+
+    assert loop_settings == [(True, 0.01)]
+    functions = {function for _, _, function in pstats.Stats(output).stats}
+    assert "blocking_app" in functions
+    assert any(
+        record.name == "asyncio" and "took 0.0" in record.getMessage() for record in caplog.records
+    )
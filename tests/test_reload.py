@@ -0,0 +1,105 @@
+"""Tests for the reload of the settings."""
+import asyncio
+import os
+
+import pytest
+
+from app.deployers import ConfigDeployer, MinionDeployer
+from app.reload import reload_settings
+from app.settings import CONF
+
+
+@pytest.fixture(name="settings")
+def fixture_settings(monkeypatch):
+    """Restore the reloaded settings and state after the test."""
+    monkeypatch.setenv("MINION_FILES_LOCAL_DIRECTORY", CONF.minion_files_local_directory)
+    for name in ("dns_resolvers", "command_timeout", "minion_files_local_directory"):
+        monkeypatch.setattr(CONF, name, getattr(CONF, name))
+    monkeypatch.setattr(ConfigDeployer, "resolv_conf", ConfigDeployer.resolv_conf)
+    monkeypatch.setattr(ConfigDeployer, "dns_servers", ConfigDeployer.dns_servers)
+    monkeypatch.setattr(MinionDeployer, "minion_files", MinionDeployer.minion_files)
+
+
+@pytest.mark.usefixtures("simulated_fleet")
+def test_reload_rebuilds_affected_state_only(settings, monkeypatch):
+    """A new DNS resolver rebuilds resolv.conf, the PEX files are kept."""
+    minion_files = MinionDeployer.minion_files
+    monkeypatch.setenv("DNS_RESOLVERS", '["192.0.2.53"]')
+    monkeypatch.setenv("COMMAND_TIMEOUT", "30")
+    monkeypatch.setenv("DRY_RUN", "true")
+
+    changes = asyncio.run(reload_settings())
+
+    assert changes == ["command_timeout", "dns_resolvers"]
+    assert CONF.command_timeout == 30
+    assert ConfigDeployer.resolv_conf == "nameserver 192.0.2.53"
+    assert MinionDeployer.minion_files is minion_files
+    # settings of the whole run need a restart
+    assert not CONF.dry_run
+
+
+@pytest.mark.usefixtures("simulated_fleet")
+def test_reload_failure_keeps_previous_settings(settings, monkeypatch, tmp_path):
+    """If the PEX files are missing at the new location, nothing changes."""
+    minion_files = MinionDeployer.minion_files
+    resolv_conf = ConfigDeployer.resolv_conf
+    dns_resolvers = CONF.dns_resolvers
+    monkeypatch.setenv("MINION_FILES_LOCAL_DIRECTORY", str(tmp_path))
+    monkeypatch.setenv("DNS_RESOLVERS", '["192.0.2.53"]')
+
+    assert not asyncio.run(reload_settings())
+
+    assert CONF.dns_resolvers == dns_resolvers
+    assert ConfigDeployer.resolv_conf == resolv_conf
+    assert MinionDeployer.minion_files is minion_files
+
+
+@pytest.mark.usefixtures("simulated_fleet")
+def test_reload_replaces_minion_config_file_only_if_changed(settings, monkeypatch, tmp_path):
+    """The minion configuration file is not rewritten by a reload, unless it changed."""
+    path = tmp_path / "minion.yml"
+    path.write_text(CONF.minion_config)
+    monkeypatch.setenv("MINION_CONFIG_FILE", str(path))
+    monkeypatch.setattr(CONF, "minion_config_file", str(path))
+    inode = path.stat().st_ino
+
+    asyncio.run(reload_settings())
+
+    assert path.stat().st_ino == inode
+
+    monkeypatch.setenv("MINION_CONFIG", "master: salt2.lan\n")
+    monkeypatch.setattr(CONF, "minion_config", CONF.minion_config)
+
+    assert asyncio.run(reload_settings()) == ["minion_config"]
+
+    # replaced by a new file, an upload in progress still reads the previous one
+    assert path.stat().st_ino != inode
+    assert path.read_text() == "master: salt2.lan\n"
+    assert not (tmp_path / "minion.yml.tmp").exists()
+
+
+def test_new_download_removes_the_previous_one(monkeypatch):
+    """The PEX files downloaded again replace the previous download, which is removed."""
+
+    def download(directory, nexus_release, sonic_version):
+        path = os.path.join(directory, f"salt-minion-{nexus_release}-{sonic_version}.pex")
+        with open(path, "wb") as pex:
+            pex.write(b"#!/usr/bin/env python\n")
+        return path
+
+    monkeypatch.setattr(CONF, "minion_files_local_directory", None)
+    monkeypatch.setattr(CONF, "minion_files_nexus_location", "https://nexus.example.net/salt")
+    monkeypatch.setattr(MinionDeployer, "minion_files", MinionDeployer.minion_files)
+    monkeypatch.setattr(MinionDeployer, "checksum_sha256", MinionDeployer.checksum_sha256)
+    monkeypatch.setattr(MinionDeployer, "download", None)
+    monkeypatch.setattr(MinionDeployer, "_get_latest_nexus_build", lambda: "1.0")
+    monkeypatch.setattr(MinionDeployer, "_download_minion_from_nexus", download)
+    monkeypatch.setattr(MinionDeployer, "_get_checksum_from_nexus", lambda *_: "0" * 64)
+
+    MinionDeployer.download_minions()
+    previous = MinionDeployer.download.name
+    MinionDeployer.download_minions()
+
+    assert not os.path.exists(previous)
+    assert all(os.path.exists(path) for path in MinionDeployer.minion_files.values())
+    MinionDeployer.download.cleanup()
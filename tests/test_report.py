@@ -0,0 +1,69 @@
+"""Tests for the run report."""
+import csv
+import json
+
+from app.connection import ConnectionStats
+from app.report import DeviceResult, RunReport
+
+
+def _result(hostname, duration, outcome="succeeded"):
+    stats = ConnectionStats()
+    stats.durations = {("device", "connect"): 0.5, ("minion", "deploy"): 2.0}
+    stats.uploaded_bytes = 1024
+    result = DeviceResult(hostname=hostname, outcome=outcome, duration=duration)
+    result.add_stats(stats)
+    return result
+
+
+def test_report_is_written_incrementally(tmp_path):
+    """Each device is readable in the report as soon as it is added."""
+    path = tmp_path / "report.jsonl"
+    csv_path = tmp_path / "report.csv"
+    report = RunReport(str(path), str(csv_path))
+
+    report.add(_result("switch1", 3.0))
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines == [
+        {
+            "type": "device",
+            "hostname": "switch1",
+            "outcome": "succeeded",
+            "failure": "",
+            "sonic_version": "",
+            "changed": [],
+            "failed": [],
+            "durations": {"connect": 0.5},
+            "duration": 3.0,
+            "queued": 0.0,
+            "attempts": 0,
+            "commands": 0,
+            "uploaded_bytes": 1024,
+        }
+    ]
+    rows = list(csv.DictReader(csv_path.open()))
+    assert rows[0]["hostname"] == "switch1"
+    assert rows[0]["connect"] == "0.5"
+    assert rows[0]["deploy"] == ""
+
+    report.close()
+
+
+def test_report_summary(tmp_path):
+    """The summary gives outcome counts, percentiles and the slowest devices."""
+    path = tmp_path / "report.jsonl"
+    report = RunReport(str(path), top_n=2)
+    for index in range(1, 101):
+        report.add(_result(f"switch{index}", float(index), "failed" if index > 95 else "succeeded"))
+
+    report.close()
+
+    summary = json.loads(path.read_text().splitlines()[-1])
+    assert summary["type"] == "summary"
+    assert summary["devices"] == 100
+    assert summary["outcomes"] == {"succeeded": 95, "failed": 5}
+    assert summary["duration_percentiles"] == {"p50": 50.0, "p90": 90.0, "p99": 99.0}
+    assert summary["slowest"] == [
+        {"hostname": "switch100", "duration": 100.0},
+        {"hostname": "switch99", "duration": 99.0},
+    ]
@@ -0,0 +1,81 @@
+"""Tests for the resolution of the DNS resolvers hostnames."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+import pytest
+
+from app.resolver import HostnameResolver
+from app.settings import CONF
+
+RECORDS = {
+    ("dns1.lan", "A"): ["192.0.2.1"],
+    ("dns1.lan", "AAAA"): ["2001:db8::1"],
+    ("dns2.lan", "A"): ["192.0.2.2"],
+}
+QUERY_DURATION = 0.2
+
+
+class Answer(list):
+    """Records of an answer, with their TTL."""
+
+    rrset = SimpleNamespace(ttl=300)
+
+
+class FakeResolver:
+    """Answer from RECORDS after QUERY_DURATION, time out for "slow.lan"."""
+
+    queries: list = []
+
+    async def resolve(self, hostname, record_type, lifetime):
+        """Resolve one record type of a hostname."""
+        self.queries.append((hostname, record_type))
+        await asyncio.sleep(QUERY_DURATION)
+        if hostname == "slow.lan":
+            raise dns.exception.Timeout(timeout=lifetime)
+        if (hostname, record_type) not in RECORDS:
+            raise dns.resolver.NoAnswer()
+
+        return Answer(
+            SimpleNamespace(address=address) for address in RECORDS[(hostname, record_type)]
+        )
+
+
+@pytest.fixture(name="resolver")
+def fixture_resolver(monkeypatch, tmp_path):
+    """Resolve with FakeResolver, cache to a temporary file."""
+    monkeypatch.setattr(dns.asyncresolver, "Resolver", FakeResolver)
+    monkeypatch.setattr(FakeResolver, "queries", [])
+    monkeypatch.setattr(CONF, "dns_cache_file", str(tmp_path / "dns.json"))
+    return HostnameResolver()
+
+
+def test_resolution_is_concurrent(resolver):
+    """Hostnames and record types are resolved at the same time, timeouts are isolated."""
+    start = time.perf_counter()
+    addresses = asyncio.run(resolver.resolve(["dns1.lan", "dns2.lan", "slow.lan"]))
+
+    assert time.perf_counter() - start < 3 * QUERY_DURATION
+    assert addresses == {
+        "dns1.lan": ["192.0.2.1", "2001:db8::1"],
+        "dns2.lan": ["192.0.2.2"],
+        "slow.lan": [],
+    }
+
+
+def test_answers_are_cached_for_their_ttl(resolver, monkeypatch):
+    """The next runs reuse the cached answers until they expire."""
+    asyncio.run(resolver.resolve(["dns1.lan"]))
+    assert len(FakeResolver.queries) == 2
+
+    assert asyncio.run(HostnameResolver().resolve(["dns1.lan"])) == {
+        "dns1.lan": ["192.0.2.1", "2001:db8::1"]
+    }
+    assert len(FakeResolver.queries) == 2
+
+    monkeypatch.setattr(time, "time", lambda: 1e12)
+    asyncio.run(HostnameResolver().resolve(["dns1.lan"]))
+    assert len(FakeResolver.queries) == 4
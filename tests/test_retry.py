@@ -0,0 +1,88 @@
+"""Tests for the retries of transient failures."""
+import asyncio
+
+import asyncssh
+import pytest
+
+from app.exceptions import ChecksumException, DeviceConnectionException
+from app.retry import RetryPolicy, is_transient
+from app.settings import CONF
+
+
+@pytest.fixture(name="settings")
+def fixture_settings(monkeypatch):
+    """Retry without delay, with a small budget."""
+    monkeypatch.setattr(CONF, "retry_attempts", 2)
+    monkeypatch.setattr(CONF, "retry_base_delay", 0)
+    monkeypatch.setattr(CONF, "retry_budget_minimum", 1)
+    monkeypatch.setattr(CONF, "retry_budget_ratio", 0.5)
+
+
+def _caused_by(error):
+    try:
+        raise DeviceConnectionException("switch1") from error
+    except DeviceConnectionException as wrapper:
+        return wrapper
+
+
+def test_classification():
+    """The cause of an error is classified."""
+    assert is_transient(_caused_by(ConnectionResetError()))
+    assert is_transient(_caused_by(asyncssh.ConnectionLost("reset")))
+    assert not is_transient(_caused_by(asyncssh.PermissionDenied("denied")))
+    assert not is_transient(ChecksumException("mismatch"))
+    assert not is_transient(ValueError())
+
+
+def test_backoff_is_bounded(monkeypatch):
+    """The delay grows exponentially, up to the maximum delay."""
+    monkeypatch.setattr(CONF, "retry_base_delay", 1)
+    monkeypatch.setattr(CONF, "retry_max_delay", 5)
+
+    assert all(0 <= RetryPolicy.backoff(1) <= 2 for _ in range(100))
+    assert all(0 <= RetryPolicy.backoff(10) <= 5 for _ in range(100))
+
+
+def _flaky(failures, error):
+    calls = []
+
+    async def operation():
+        calls.append(None)
+        if len(calls) <= failures:
+            raise error
+        return len(calls)
+
+    return operation, calls
+
+
+def test_transient_error_is_retried(settings):
+    """The operation succeeds after the retries."""
+    operation, _ = _flaky(2, ConnectionResetError())
+
+    assert asyncio.run(RetryPolicy("device").run("switch1", operation)) == 3
+
+
+def test_permanent_error_is_not_retried(settings):
+    """A permanent error is raised at once."""
+    operation, calls = _flaky(1, ChecksumException("mismatch"))
+
+    with pytest.raises(ChecksumException):
+        asyncio.run(RetryPolicy("device").run("switch1", operation))
+    assert len(calls) == 1
+
+
+def test_budget_limits_retries(settings):
+    """Past the budget, transient errors are final."""
+    policy = RetryPolicy("device")
+
+    async def run_all():
+        operations = [_flaky(1, ConnectionResetError())[0] for _ in range(4)]
+        return await asyncio.gather(
+            *[policy.run("switch1", operation) for operation in operations],
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run_all())
+
+    # 1 + 0.5 * 4 operations = 3 retries
+    assert sum(isinstance(result, ConnectionResetError) for result in results) == 1
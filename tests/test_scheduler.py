@@ -0,0 +1,72 @@
+"""Tests for the scheduling of the devices by site."""
+import asyncio
+import time
+
+from app.scheduler import SCHEDULER, Scheduler, TokenBucket
+from app.settings import CONF
+
+
+async def _deploy_all(scheduler, hostnames):
+    """Deploy each device for a while, return the order they started in and the peak load."""
+    started = []
+    peaks = {"total": 0}
+
+    async def deploy(hostname):
+        async with scheduler.slot(hostname):
+            started.append(hostname.split(".")[1])
+            peaks["total"] = max(peaks["total"], scheduler.running)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(deploy(hostname) for hostname in hostnames))
+    return started, peaks["total"]
+
+
+def test_slots_are_given_to_the_sites_in_turn(monkeypatch):
+    """A site listed first does not get all the slots."""
+    monkeypatch.setattr(CONF, "max_concurrent_devices", 2)
+    hostnames = [f"switch{i}.par1.lan" for i in range(4)] + ["switch0.ams1.lan", "switch1.ams1.lan"]
+
+    started, peak = asyncio.run(_deploy_all(Scheduler(), hostnames))
+
+    assert started[:4] == ["par1", "ams1", "par1", "ams1"]
+    assert peak == 2
+
+
+def test_per_site_limit(monkeypatch):
+    """The devices of a site are limited, the other sites are not slowed down."""
+    monkeypatch.setattr(CONF, "max_concurrent_devices_per_site", 1)
+    hostnames = [f"switch{i}.par1.lan" for i in range(3)] + ["switch0.ams1.lan"]
+
+    started, peak = asyncio.run(_deploy_all(Scheduler(), hostnames))
+
+    assert started == ["par1", "ams1", "par1", "par1"]
+    assert peak == 2
+
+
+def test_token_bucket():
+    """Operations beyond the burst wait for the rate."""
+
+    async def acquire_all():
+        bucket = TokenBucket(rate=20, burst=2)
+        start = time.perf_counter()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.perf_counter() - start
+
+    assert 0.19 < asyncio.run(acquire_all()) < 0.5
+
+
+def test_handshakes_are_limited_per_site(monkeypatch):
+    """Each site has its own bucket."""
+    monkeypatch.setattr(CONF, "site_handshake_rate", 10)
+    monkeypatch.setattr(CONF, "site_handshake_burst", 1)
+
+    async def handshakes():
+        SCHEDULER.reset()
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(SCHEDULER.handshake(f"switch{i}.{site}.lan") for i in range(2) for site in "ab")
+        )
+        return time.perf_counter() - start
+
+    assert 0.09 < asyncio.run(handshakes()) < 0.25
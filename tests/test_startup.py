@@ -0,0 +1,25 @@
+"""Tests for the cold start of the deployer."""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# only needed on some code paths: inventory, Vault, Nexus, DNS resolution, pretty logs
+LAZY_MODULES = ("coloredlogs", "dns.resolver", "hvac", "jq", "requests")
+CHECK_IMPORTS = f"""
+import sys
+import app.main
+from app.settings import CONF
+assert object.__getattribute__(CONF, "_settings") is None, "settings built at import"
+print(",".join(module for module in {LAZY_MODULES!r} if module in sys.modules))
+"""
+
+
+def test_import_has_no_side_effects():
+    """Importing the application neither reads the settings nor loads optional modules."""
+    output = subprocess.run(
+        [sys.executable, "-c", CHECK_IMPORTS], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+
+    assert output.strip() == ""
@@ -0,0 +1,74 @@
+"""Tests for the grains script run on the devices."""
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+from app import resources
+
+VERSION_INFO = {
+    "asic_type": "broadcom",
+    "build_date": "Mon Jan 1 00:00:00 UTC 2024",
+    "build_version": "202205.1",
+    "commit_id": "abcdef",
+    "built_by": "builder",
+}
+
+
+@pytest.fixture(name="update_grains")
+def fixture_update_grains(tmp_path, monkeypatch):
+    """Load the script with fake SONiC modules, return it and the calls to SONiC."""
+    spec = importlib.util.spec_from_file_location(
+        "update_grains", f"{resources.__path__[0]}/scripts/update_grains.py"
+    )
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+    calls = []
+    device_info = types.ModuleType("sonic_py_common.device_info")
+    device_info.get_sonic_version_info = lambda: calls.append("version") or VERSION_INFO
+    device_info.get_platform_info = lambda: {"hwsku": "Force10-S6000"}
+    sonic_py_common = types.ModuleType("sonic_py_common")
+    sonic_py_common.device_info = device_info
+    monkeypatch.setitem(sys.modules, "sonic_py_common", sonic_py_common)
+    monkeypatch.setitem(sys.modules, "sonic_py_common.device_info", device_info)
+
+    version_file = tmp_path / "sonic_version.yml"
+    version_file.write_text("build_version: 202205.1\n")
+    monkeypatch.setattr(script, "GRAINS_FILE", str(tmp_path / "grains"))
+    monkeypatch.setattr(script, "FINGERPRINT_FILE", str(tmp_path / "grains.fingerprint"))
+    monkeypatch.setattr(script, "SOURCE_FILES", (str(version_file),))
+    monkeypatch.setattr(script, "MACHINE_CONF", str(tmp_path / "machine.conf"))
+    return script, calls
+
+
+def test_refresh_only_when_sources_change(update_grains, tmp_path):
+    """Grains are computed again only if the fingerprint changes."""
+    script, calls = update_grains
+    grains_file = tmp_path / "grains"
+
+    script.main([])
+    assert "hwsku: Force10-S6000" in grains_file.read_text()
+    assert calls == ["version"]
+
+    script.main([])
+    assert calls == ["version"]
+
+    script.main(["--force"])
+    assert calls == ["version", "version"]
+
+
+def test_unchanged_grains_are_not_written(update_grains, tmp_path):
+    """A refresh which finds the same grains does not write the grains file."""
+    script, calls = update_grains
+    grains_file = tmp_path / "grains"
+    script.main([])
+    os.utime(grains_file, (0, 0))
+
+    (tmp_path / "sonic_version.yml").write_text("build_version: 202205.1 \n")
+    script.main([])
+
+    assert calls == ["version", "version"]
+    assert grains_file.stat().st_mtime == 0